@@ -0,0 +1,456 @@
+"""Offline batch runner: images in, one JSONL report per image out.
+
+Runs the same guard-railed pipelines as the Streamlit app
+(:func:`radiology_pipeline.build_local_pipeline` / ``build_async_pipeline``) over a
+directory, a glob or a manifest file, and streams one JSON record per image to
+the output as soon as that image finishes — the shape used for retrospective
+audits over a PACS export::
+
+    python batch_report.py /data/pacs_export -o reports.jsonl
+    python batch_report.py "/data/**/*.png" -o reports.jsonl --workers 16
+    python batch_report.py manifest.csv -o reports.jsonl --resume
+    python batch_report.py /data/ct --backend gemini -o gemini.jsonl
+    python batch_report.py /data/pacs_export --backend cascade -o reports.jsonl
+
+Inputs are enumerated lazily and only a bounded number of images is in flight
+at once, so memory stays flat whether the input is 10 files or 100k. The local
+backend runs through :class:`staged_pipeline.StagedLocalPipeline`: ``--workers``
+threads (or ``--processes``) decode and preprocess while one consumer packs up
+to ``--batch-size`` images into each ``session.run``. With ``--prefork`` it
+instead runs ``--workers`` forked processes end to end, all sharing one copy of
+the model weights (see :mod:`prefork_pipeline`). The Gemini backend keeps up
+to ``--workers`` requests in flight through one
+:class:`gemini_backend.AsyncGeminiClient`, paced to ``--rate-per-minute``,
+retried on 429/5xx and abandoned after ``--deadline`` seconds per image.
+With ``--response-cache DIR`` its answers are kept on disk, so re-running a
+batch over the same archive makes almost no API calls (``--refresh-cache``
+asks again and overwrites them). Films are downscaled and re-encoded before
+upload (``GEMINI_UPLOAD_*``); ``--log-requests`` prints each request's payload
+size, encode time and round trip.
+
+``--backend cascade`` runs every image through the local model first and sends
+only the uncertain, flagged and CT ones on to Gemini
+(:class:`cascade_pipeline.CascadePipeline`); each record's audit starts with
+the routing decision, and the escalation counters are printed at the end.
+
+``--resume`` appends to an existing output and skips every path that already
+has a successful record; images that previously failed are retried.
+
+``--logit-store DIR`` (local backend, staged) also keeps every classified
+image's raw model output in a :class:`logit_store.LogitStore`, so the archive
+can later be re-templated under new thresholds without re-running the model
+(``python logit_store.py DIR -o new.jsonl --threshold …``).
+
+Each record holds the ``Analysis`` fields, the vlm-guard audit summary and
+per-stage timings in seconds::
+
+    {"path": "...", "status": "ok", "analysis": {...}, "audit": [...],
+     "timings": {"decode": 0.01, "inference": 0.3, ..., "total": 0.43}}
+
+Staged local records also carry ``batch_size``, the number of images in the
+``session.run`` call that classified the image.
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import glob
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+from PIL import Image
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+DEFAULT_PROMPT = "Analyze this medical image."
+
+# Analysis fields copied into each record (the rest are vlm-guard internals).
+_ANALYSIS_FIELDS = (
+    "label", "confidence", "evidence", "findings", "recommendation",
+    "validation_status", "metadata",
+)
+
+
+# ── Input enumeration (lazy) ──────────────────────────────────────────────────
+
+
+def _walk_images(directory: str) -> Iterator[str]:
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()  # deterministic order, so interrupted runs resume predictably
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, name)
+
+
+def _read_manifest(path: str) -> Iterator[str]:
+    """One image path per line (``#`` comments allowed), or a CSV whose ``path``
+    column — else first column — names the image. Relative paths resolve
+    against the manifest's directory."""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return
+            if "path" in header:
+                column = header.index("path")
+            else:
+                column, reader = 0, itertools.chain([header], reader)  # no header row
+            for row in reader:
+                if row and row[column].strip():
+                    yield os.path.join(base, row[column].strip())
+        else:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield os.path.join(base, line)
+
+
+def iter_inputs(sources: Iterable[str]) -> Iterator[str]:
+    """Expand each source — directory, glob pattern or manifest file — into
+    image paths, lazily and in a stable order."""
+    for source in sources:
+        if os.path.isdir(source):
+            yield from _walk_images(source)
+        elif glob.has_magic(source):
+            for path in glob.iglob(source, recursive=True):
+                if path.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(path):
+                    yield path
+        elif source.lower().endswith(IMAGE_EXTENSIONS):
+            yield source
+        else:
+            yield from _read_manifest(source)
+
+
+def completed_paths(output: str) -> set[str]:
+    """Paths with a successful record in an existing output file (for --resume).
+    A truncated final line from an interrupted run is ignored."""
+    done: set[str] = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("status") != "error":
+                done.add(record["path"])
+    return done
+
+
+# ── Per-image work ────────────────────────────────────────────────────────────
+
+
+def make_record(path: str, result, timings: dict[str, float]) -> dict:
+    """JSONL record for one finished ``PipelineResult``."""
+    return {
+        "path": path,
+        "status": result.status,
+        "analysis": result.analysis.model_dump(include=set(_ANALYSIS_FIELDS)),
+        "audit": result.audit.summary() if result.audit else [],
+        "timings": {name: round(value, 6) for name, value in timings.items()},
+    }
+
+
+def _error_record(path: str, error: str) -> dict:
+    return {"path": path, "status": "error", "error": error}
+
+
+def process_image(pipeline, path: str, prompt: str = DEFAULT_PROMPT) -> dict:
+    """Run one image through ``pipeline`` and return its JSONL record. Failures
+    become an ``"error"`` record instead of aborting the batch."""
+    start = time.perf_counter()
+    try:
+        with Image.open(path) as image:
+            image = image.convert("RGB")
+        decoded = time.perf_counter()
+        result = pipeline.run(image, prompt, context={"scan_type": "radiology"})
+    except Exception as e:  # noqa: BLE001 — one bad file must not stop the run
+        return _error_record(path, f"{type(e).__name__}: {e}")
+    end = time.perf_counter()
+    return make_record(path, result, {
+        "decode": decoded - start, "pipeline": end - decoded, "total": end - start,
+    })
+
+
+class _Writer:
+    """Append records to the output stream as they arrive and count statuses."""
+
+    def __init__(self, out, on_record: Callable[[dict], None] | None = None):
+        self.out = out
+        self.on_record = on_record
+        self.counts: dict[str, int] = {"skipped": 0}
+
+    def write(self, record: dict) -> None:
+        self.out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.out.flush()
+        self.counts[record["status"]] = self.counts.get(record["status"], 0) + 1
+        if self.on_record:
+            self.on_record(record)
+
+    def unskipped(self, paths: Iterable[str], skip: set[str] | None) -> Iterator[str]:
+        for path in paths:
+            if skip and path in skip:
+                self.counts["skipped"] += 1
+            else:
+                yield path
+
+
+def run_batch(
+    paths: Iterable[str],
+    out,
+    pipeline,
+    workers: int = 4,
+    prompt: str = DEFAULT_PROMPT,
+    skip: set[str] | None = None,
+    on_record: Callable[[dict], None] | None = None,
+) -> dict[str, int]:
+    """Process ``paths`` with ``workers`` threads, writing each record to the
+    text stream ``out`` as soon as it is ready. At most ``2 × workers`` images
+    are held in memory at once. Returns per-status counts."""
+    writer = _Writer(out, on_record)
+    pending: set[Future] = set()
+
+    def drain(block_until: int) -> None:
+        nonlocal pending
+        while len(pending) > block_until:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                writer.write(future.result())
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for path in writer.unskipped(paths, skip):
+            drain(2 * workers - 1)
+            pending.add(pool.submit(process_image, pipeline, path, prompt))
+        drain(0)
+    return writer.counts
+
+
+def run_staged(
+    paths: Iterable[str],
+    out,
+    staged,
+    skip: set[str] | None = None,
+    on_record: Callable[[dict], None] | None = None,
+    store=None,
+) -> dict[str, int]:
+    """Like :func:`run_batch`, but through a
+    :class:`staged_pipeline.StagedLocalPipeline`, which overlaps decoding,
+    batched inference and templating. Raw model outputs are appended to
+    ``store`` (a :class:`logit_store.LogitStore`) when given. Returns
+    per-status counts."""
+    writer = _Writer(out, on_record)
+    for item in staged.run(writer.unskipped(paths, skip)):
+        if item.error is not None:
+            writer.write(_error_record(item.path, item.error))
+        else:
+            record = make_record(item.path, item.result, {
+                **item.timings, "total": item.result.elapsed_seconds,
+            })
+            if item.batch_size is not None:
+                record["batch_size"] = item.batch_size
+            writer.write(record)
+            # After the record: --resume trusts the output, so a run killed in
+            # between re-classifies the image rather than storing it twice.
+            if store is not None and item.raw is not None:
+                store.append(item.path, item.raw)
+    return writer.counts
+
+
+# ── CLI ───────────────────────────────────────────────────────────────────────
+
+
+def _build_runner(args) -> Callable:
+    """Return ``run(paths, out, skip, on_record) -> counts`` for the backend."""
+    if args.logit_store and (args.backend != "local" or args.prefork):
+        raise SystemExit("--logit-store needs the local backend without --prefork.")
+    if args.backend == "local" and args.prefork:
+        import local_backend
+        from prefork_pipeline import PreforkLocalPipeline
+
+        local_backend.ensure_model_available()
+        prefork = PreforkLocalPipeline(workers=args.workers)
+        return lambda paths, out, skip, on_record: run_staged(
+            paths, out, prefork, skip=skip, on_record=on_record
+        )
+    if args.backend == "local":
+        import local_backend
+        from staged_pipeline import StagedLocalPipeline
+
+        local_backend.ensure_model_available()
+        staged = StagedLocalPipeline(
+            prepare_workers=args.workers,
+            use_processes=args.processes,
+            queue_depth=args.queue_depth,
+            batch_size=args.batch_size,
+            template_workers=args.template_workers,
+        )
+        store = None
+        if args.logit_store:
+            from logit_store import LogitStore
+
+            store = LogitStore.create(
+                args.logit_store,
+                outputs=local_backend.raw_output_kind(),
+                model=local_backend._model_identity(),
+                append=args.resume,
+            )
+        return lambda paths, out, skip, on_record: run_staged(
+            paths, out, staged, skip=skip, on_record=on_record, store=store
+        )
+
+    api_key = os.environ.get("GOOGLE_API_KEY")
+    if not api_key:
+        raise SystemExit(f"GOOGLE_API_KEY is required for --backend {args.backend}.")
+    import google.generativeai as genai
+
+    from radiology_pipeline import (
+        GEMINI_MODEL_NAME,
+        SYSTEM_INSTRUCTION,
+        build_async_pipeline,
+        build_cascade_pipeline,
+    )
+
+    genai.configure(api_key=api_key)
+    model = genai.GenerativeModel(
+        model_name=GEMINI_MODEL_NAME, system_instruction=SYSTEM_INSTRUCTION
+    )
+    from gemini_backend import default_response_cache
+
+    options = {
+        "max_concurrency": args.workers,
+        "cache": default_response_cache(model, args.response_cache),
+    }
+    if args.refresh_cache:
+        options["bypass_cache"] = True
+    if args.rate_per_minute is not None:
+        options["rate_per_minute"] = args.rate_per_minute
+    if args.deadline is not None:
+        options["deadline"] = args.deadline
+    if args.backend == "cascade":
+        import local_backend
+
+        local_backend.ensure_model_available()
+        pipeline = build_cascade_pipeline(model, **options)
+    else:
+        pipeline = build_async_pipeline(model, **options)
+
+    def run(paths, out, skip, on_record):
+        # Twice as many threads as requests in flight, so the next images are
+        # decoded and enhanced while the client waits on the network.
+        counts = run_batch(
+            paths, out, pipeline, workers=2 * args.workers, prompt=args.prompt,
+            skip=skip, on_record=on_record,
+        )
+        if args.backend == "cascade":
+            stats = ", ".join(f"{k}={v}" for k, v in pipeline.stats.items())
+            print(f"Cascade: {stats} (escalation rate {pipeline.escalation_rate:.1%})",
+                  file=sys.stderr)
+        stats = ", ".join(f"{k}={v}" for k, v in pipeline.client.stats.items())
+        print(f"Gemini: {stats}", file=sys.stderr)
+        return counts
+
+    return run
+
+
+def _parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Run the report pipeline over many images, streaming JSONL."
+    )
+    parser.add_argument(
+        "inputs", nargs="+",
+        help="image directories, glob patterns (quote them), or manifest files (.txt/.csv)",
+    )
+    parser.add_argument("-o", "--output", required=True, help="JSONL file to write")
+    parser.add_argument("--backend", choices=["local", "gemini", "cascade"], default="local")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 4,
+        help="local: decode/preprocess workers; gemini, cascade: max requests in flight",
+    )
+    parser.add_argument(
+        "--processes", action="store_true",
+        help="local: decode/preprocess in processes instead of threads (no GIL)",
+    )
+    parser.add_argument(
+        "--prefork", action="store_true",
+        help="local: run --workers forked processes end to end, sharing one "
+             "copy of the model weights (POSIX only)",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=16, help="local: max images per session.run",
+    )
+    parser.add_argument(
+        "--queue-depth", type=int, default=64,
+        help="local: max images buffered between pipeline stages",
+    )
+    parser.add_argument(
+        "--template-workers", type=int, default=1,
+        help="local: threads templating reports and running guardrails",
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="append to --output, skipping images it already has a report for",
+    )
+    parser.add_argument(
+        "--logit-store", metavar="DIR",
+        help="local: also keep raw model outputs here for re-templating "
+             "(see logit_store.py); appended to with --resume",
+    )
+    parser.add_argument(
+        "--rate-per-minute", type=float, default=None,
+        help="gemini: request quota per minute (default: GEMINI_RATE_PER_MINUTE)",
+    )
+    parser.add_argument(
+        "--deadline", type=float, default=None,
+        help="gemini: seconds per image, retries included (default: GEMINI_DEADLINE_S)",
+    )
+    parser.add_argument(
+        "--response-cache", metavar="DIR",
+        help="gemini: keep responses in this directory across runs (default: GEMINI_CACHE_DIR)",
+    )
+    parser.add_argument(
+        "--refresh-cache", action="store_true",
+        help="gemini: skip cached responses, storing the fresh ones",
+    )
+    parser.add_argument(
+        "--log-requests", action="store_true",
+        help="gemini: log each request's upload size, encode time and round trip to stderr",
+    )
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv)
+    if args.log_requests:
+        logging.basicConfig(stream=sys.stderr, format="%(message)s")
+        logging.getLogger("gemini_backend").setLevel(logging.INFO)
+    run = _build_runner(args)
+    skip = completed_paths(args.output) if args.resume else set()
+
+    started = time.perf_counter()
+    processed = 0
+
+    def progress(record: dict) -> None:
+        nonlocal processed
+        processed += 1
+        if processed % 100 == 0:
+            rate = processed / (time.perf_counter() - started)
+            print(f"{processed} images ({rate:.1f}/s)", file=sys.stderr)
+
+    with open(args.output, "a" if args.resume else "w", encoding="utf-8") as out:
+        counts = run(iter_inputs(args.inputs), out, skip, progress)
+    summary = ", ".join(f"{k}={v}" for k, v in sorted(counts.items()))
+    print(f"Done in {time.perf_counter() - started:.1f}s: {summary}", file=sys.stderr)
+    return 1 if counts.get("error") else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
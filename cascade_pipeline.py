@@ -0,0 +1,356 @@
+"""Routing between the local and Gemini backends: a local-first cascade, and
+latency-budget hedging of Gemini with the local model.
+
+Cascade
+-------
+
+Most of our traffic is unremarkable chest films, which the local model reports
+with High confidence in a fraction of a Gemini round trip and at no API cost.
+:class:`CascadePipeline` runs the local pipeline on every study and keeps its
+report when the report is High confidence and no guardrail fired. Otherwise the
+study is escalated to the Gemini pipeline:
+
+* ``ct_slice`` — the local CT gate rejected the image (Gemini reads CT);
+* ``guardrail`` — a rule fired on the local report (blocked, flagged or
+  corrected);
+* ``low_confidence`` / ``medium_confidence`` — the local read was not High.
+
+A study may meet several of these; all are recorded, and the first in that
+order counts as the study's reason in ``stats``. The decision is the first
+entry of the returned audit trail (rule ``cascade_routing``, action
+``route``) and is also in ``result.metadata["route"]``. Timings of both runs
+land in ``metadata["timings"]`` as ``local.<stage>`` and ``gemini.<stage>``.
+
+If the escalation fails (no answer within the Gemini deadline, an API error),
+the local report is returned with a ``flag`` entry saying so rather than
+failing the study.
+
+Hedging
+-------
+:class:`HedgedPipeline` runs Gemini first and bounds the wait for it. When
+Gemini has not answered within ``budget`` seconds (``HEDGE_BUDGET_S``), or has
+failed, the local pipeline starts alongside it. The first acceptable result
+wins:
+
+* any Gemini answer;
+* a local report for a chest radiograph, i.e. one the local gates did not
+  reject (:func:`is_chest_report`).
+
+When the local report wins, the Gemini request is cancelled on the client's
+loop (:class:`gemini_backend.CancelScope`). A local run that loses cannot be
+interrupted mid-``session.run``, so it finishes in the background and its
+result is dropped; one still queued for a local worker is cancelled. The
+decision is the first audit entry (rule ``latency_hedge``) and
+``result.metadata["hedge"]``. :meth:`HedgedPipeline.latency_percentiles`
+reports the tail of the time to result over recent studies.
+"""
+from __future__ import annotations
+
+import datetime
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+from vlm_guard import AuditEntry, AuditTrail, PipelineResult
+
+from gemini_backend import CancelScope, cancellable
+from local_backend import UNSUPPORTED_MODALITY, get_session_pool
+
+# ── Tunables (overridable via environment) ────────────────────────────────────
+# Seconds to wait for Gemini before starting the local model alongside it.
+_HEDGE_BUDGET_S = float(os.environ.get("HEDGE_BUDGET_S", "10"))
+# Studies kept for HedgedPipeline.latency_percentiles.
+_LATENCY_WINDOW = int(os.environ.get("HEDGE_LATENCY_WINDOW", "1000"))
+
+ROUTING_RULE = "cascade_routing"
+HEDGE_RULE = "latency_hedge"
+
+_REASONS = {
+    "ct_slice": "CT / cross-sectional image",
+    "guardrail": "guardrail fired",
+    "low_confidence": "Low confidence",
+    "medium_confidence": "Medium confidence",
+}
+
+
+def escalation_reasons(result: PipelineResult) -> list[str]:
+    """Why the local ``result`` should go to Gemini, most specific first;
+    empty when the local report can be returned as is."""
+    analysis = result.analysis
+    reasons = []
+    if analysis.metadata.get("modality") == UNSUPPORTED_MODALITY:
+        reasons.append("ct_slice")
+    if result.audit is not None and result.audit.entries:
+        reasons.append("guardrail")
+    if analysis.confidence != "High":
+        reasons.append(f"{analysis.confidence.lower()}_confidence")
+    return reasons
+
+
+def _describe(reasons: list[str], local: PipelineResult) -> str:
+    parts = []
+    for reason in reasons:
+        text = _REASONS.get(reason, reason)
+        if reason == "guardrail":
+            text += f" ({', '.join(e.rule_name for e in local.audit.entries)})"
+        parts.append(text)
+    return ", ".join(parts)
+
+
+class CascadePipeline:
+    """Run ``local`` first and ``remote`` only when the local report is not
+    good enough (see the module docstring). Both are ``VLMGuardPipeline``-like
+    objects with ``run(image, prompt, context)``; ``remote.client``, if any,
+    is exposed as ``client``.
+
+    ``stats`` counts studies, local answers, escalations by reason and failed
+    escalations since the pipeline was created; :attr:`escalation_rate` is the
+    share of studies escalated. Safe to share between threads.
+    """
+
+    def __init__(self, local, remote):
+        self.local = local
+        self.remote = remote
+        self.client = getattr(remote, "client", None)
+        self.stats = {
+            "studies": 0, "local": 0, "escalated": 0, "escalation_failed": 0,
+            **{reason: 0 for reason in _REASONS},
+        }
+        self._lock = threading.Lock()
+
+    @property
+    def escalation_rate(self) -> float:
+        with self._lock:
+            studies = self.stats["studies"]
+            return self.stats["escalated"] / studies if studies else 0.0
+
+    def run(self, image, prompt, context=None) -> PipelineResult:
+        started = time.perf_counter()
+        local = self.local.run(image, prompt, dict(context or {}))
+        reasons = escalation_reasons(local)
+        timings = _prefixed("local", local)
+        with self._lock:
+            self.stats["studies"] += 1
+            self.stats["escalated" if reasons else "local"] += 1
+            if reasons:
+                self.stats[reasons[0]] += 1
+
+        if not reasons:
+            entry = _route_entry("route", "Local report kept: High confidence, no guardrail fired.",
+                                 "local", reasons, local)
+            return _finish(local, entry, timings, started, route=_route(entry))
+
+        try:
+            remote = self.remote.run(image, prompt, dict(context or {}))
+        except Exception as e:  # noqa: BLE001 — the local report is still an answer
+            with self._lock:
+                self.stats["escalation_failed"] += 1
+            entry = _route_entry(
+                "flag",
+                f"Escalated to Gemini ({_describe(reasons, local)}) but it failed "
+                f"({type(e).__name__}: {e}); local report returned.",
+                "local", reasons, local,
+            )
+            return _finish(local, entry, timings, started, route=_route(entry))
+        entry = _route_entry("route", f"Escalated to Gemini: {_describe(reasons, local)}.",
+                             "gemini", reasons, local)
+        timings.update(_prefixed("gemini", remote))
+        return _finish(remote, entry, timings, started, route=_route(entry))
+
+
+def _prefixed(prefix: str, result: PipelineResult) -> dict[str, float]:
+    return {f"{prefix}.{k}": v for k, v in result.metadata.get("timings", {}).items()}
+
+
+def _route_entry(action: str, message: str, backend: str, reasons: list[str],
+                 local: PipelineResult) -> AuditEntry:
+    return AuditEntry(
+        rule_name=ROUTING_RULE,
+        rule_description="Local-first cascade: escalate to Gemini when the local report is not enough",
+        timestamp=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        action_type=action,
+        message=message,
+        severity="warning" if action == "flag" else "info",
+        context={
+            "backend": backend,
+            "reasons": reasons,
+            "local_confidence": local.analysis.confidence,
+            "local_rules": [e.rule_name for e in local.audit.entries] if local.audit else [],
+        },
+    )
+
+
+def _route(entry: AuditEntry) -> dict:
+    return {"backend": entry.context["backend"], "reasons": entry.context["reasons"]}
+
+
+def _finish(result: PipelineResult, entry: AuditEntry, timings: dict[str, float],
+            started: float, **metadata) -> PipelineResult:
+    """``result`` with ``entry`` heading its audit trail, ``timings`` replacing
+    its own and ``metadata`` added."""
+    audit = AuditTrail(entries=[entry, *(result.audit.entries if result.audit else [])])
+    metadata = {**result.metadata, **metadata}
+    if timings:
+        metadata["timings"] = timings
+    return PipelineResult(
+        analysis=result.analysis,
+        raw_output=result.raw_output,
+        status=result.status,
+        elapsed_seconds=time.perf_counter() - started,
+        audit=audit,
+        image_enhanced=result.image_enhanced,
+        metadata=metadata,
+    )
+
+
+# ── Hedging ───────────────────────────────────────────────────────────────────
+
+
+def is_chest_report(result: PipelineResult) -> bool:
+    """Whether a local ``result`` is a chest-radiograph report (not a gate
+    rejection), and so an acceptable answer for a hedged study."""
+    return bool(result.analysis.metadata.get("is_medical_image"))
+
+
+def _run_in_scope(scope: CancelScope, pipeline, image, prompt, context) -> PipelineResult:
+    with cancellable(scope):
+        return pipeline.run(image, prompt, context)
+
+
+class HedgedPipeline:
+    """Run ``primary`` (Gemini) and, past ``budget`` seconds or on its
+    failure, ``fallback`` (local) alongside it; return the first acceptable
+    result (see the module docstring). ``accept`` decides whether a fallback
+    result is acceptable. ``primary.client``, if any, is exposed as
+    ``client``.
+
+    ``stats`` counts studies, hedges, wins per backend, fallback results
+    rejected as not chest films, primary failures, cancelled primaries and
+    fallbacks cancelled before they started. :attr:`latencies` holds the time
+    to result of the last ``window`` studies. Safe to share between threads;
+    primaries run on a private pool of ``max_workers`` threads, fallbacks on
+    one of ``fallback_workers`` (default: the local
+    :class:`~local_backend.SessionPool` size), so hedged studies queue for the
+    CPU rather than oversubscribing it.
+    """
+
+    def __init__(self, primary, fallback, budget: float = _HEDGE_BUDGET_S, *,
+                 accept=is_chest_report, max_workers: int = 32,
+                 fallback_workers: int | None = None, window: int = _LATENCY_WINDOW):
+        self.primary = primary
+        self.fallback = fallback
+        self.budget = budget
+        self.accept = accept
+        self.client = getattr(primary, "client", None)
+        self.stats = {
+            "studies": 0, "hedged": 0, "primary_won": 0, "fallback_won": 0,
+            "fallback_rejected": 0, "primary_failed": 0, "primary_cancelled": 0,
+            "fallback_cancelled": 0,
+        }
+        self.latencies: deque[float] = deque(maxlen=window)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self._fallback_pool = ThreadPoolExecutor(
+            max_workers=fallback_workers or get_session_pool().size,
+            thread_name_prefix="hedge-local",
+        )
+        self._lock = threading.Lock()
+
+    def latency_percentiles(self, quantiles=(50, 95, 99)) -> dict[str, float]:
+        """Nearest-rank percentiles of :attr:`latencies`, in seconds."""
+        with self._lock:
+            ordered = sorted(self.latencies)
+        if not ordered:
+            return {}
+        return {
+            f"p{q}": ordered[min(len(ordered) - 1, max(0, -(-q * len(ordered) // 100) - 1))]
+            for q in quantiles
+        }
+
+    def _count(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self.stats[key] += 1
+
+    def run(self, image, prompt, context=None) -> PipelineResult:
+        started = time.perf_counter()
+        scope = CancelScope()
+        primary = self._pool.submit(
+            _run_in_scope, scope, self.primary, image, prompt, dict(context or {})
+        )
+        self._count("studies")
+        done, _ = wait([primary], timeout=self.budget)
+        if done and primary.exception() is None:
+            self._count("primary_won")
+            entry = _hedge_entry("pass", f"Gemini answered within the {self.budget:g}s budget.",
+                                 "gemini", False, self.budget)
+            return self._finish(primary.result(), entry, "gemini", started)
+
+        self._count("hedged")
+        waited = time.perf_counter() - started
+        fallback = self._fallback_pool.submit(
+            self.fallback.run, image, prompt, dict(context or {})
+        )
+        pending: set[Future] = {primary, fallback}
+        winner: Future | None = None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            if primary in done and primary.exception() is None:
+                winner = primary
+            elif fallback in done and fallback.exception() is None:
+                if self.accept(fallback.result()):
+                    winner = fallback
+                else:
+                    self._count("fallback_rejected")
+
+        if winner is None:
+            # Gemini failed and the local model had no chest report to offer.
+            self._count("primary_failed")
+            raise primary.exception()
+        if winner is primary:
+            self._count("primary_won")
+            if fallback.cancel():  # still queued behind other studies' local runs
+                self._count("fallback_cancelled")
+            entry = _hedge_entry(
+                "route",
+                f"Gemini slower than the {self.budget:g}s budget; local model started "
+                f"after {waited:.1f}s, Gemini answered first.",
+                "gemini", True, self.budget,
+            )
+            return self._finish(primary.result(), entry, "gemini", started)
+
+        if primary.done():
+            self._count("primary_failed")
+            error = primary.exception()
+            message = f"Gemini failed ({type(error).__name__}: {error}); local chest report returned."
+        else:
+            scope.cancel()
+            self._count("primary_cancelled")
+            message = (
+                f"Gemini gave no answer within the {self.budget:g}s budget; local chest "
+                "report returned and the Gemini request cancelled."
+            )
+        self._count("fallback_won")
+        entry = _hedge_entry("route", message, "local", True, self.budget)
+        return self._finish(fallback.result(), entry, "local", started)
+
+    def _finish(self, result: PipelineResult, entry: AuditEntry, backend: str,
+                started: float) -> PipelineResult:
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencies.append(elapsed)
+        hedge = {**entry.context, "seconds": elapsed}
+        return _finish(result, entry, _prefixed(backend, result), started, hedge=hedge)
+
+
+def _hedge_entry(action: str, message: str, backend: str, hedged: bool,
+                 budget: float) -> AuditEntry:
+    return AuditEntry(
+        rule_name=HEDGE_RULE,
+        rule_description="Start the local model when Gemini exceeds its latency budget",
+        timestamp=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        action_type=action,
+        message=message,
+        context={"backend": backend, "hedged": hedged, "budget": budget},
+    )
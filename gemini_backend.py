@@ -0,0 +1,599 @@
+"""Asynchronous Gemini backend: many studies in flight, within quota.
+
+``build_pipeline``'s ``gemini_model_fn`` makes one blocking
+``generate_content`` call per image, with no timeout and no retry, so a batch
+waits on network latency one image at a time and one transient 503 fails a
+study. :class:`AsyncGeminiClient` keeps its requests on a single background
+event loop and sends them with ``generate_content_async``:
+
+* at most ``max_concurrency`` requests in flight (an ``asyncio.Semaphore``);
+* a :class:`TokenBucket` paces request starts to ``rate_per_minute`` (our
+  quota), allowing bursts of ``burst``;
+* 429 and 5xx responses (and dropped connections) are retried with full-jitter
+  exponential backoff (:class:`RetryPolicy`). A 429 also pauses the bucket, so
+  every request backs off together rather than hammering the quota;
+* each study has a ``deadline`` covering queueing, retries and backoff. When it
+  passes, the call raises :class:`GeminiDeadlineExceeded`;
+* with a :class:`ResponseCache`, a study already answered — same enhanced
+  pixels, prompt, schema, system instruction and model — is served from the
+  cache without a request. The cache persists across restarts when given a
+  directory (``GEMINI_CACHE_DIR``);
+* before upload, each film is downscaled, made greyscale (unless it is in
+  colour) and re-encoded per its :class:`UploadEncoding` (``GEMINI_UPLOAD_*``),
+  so a multi-megapixel film no longer goes over the wire at full size. Bytes
+  sent and encode / round-trip times are logged per request on the
+  ``gemini_backend`` logger;
+* requests submitted inside :func:`cancellable` can be cancelled from another
+  thread with :meth:`CancelScope.cancel` (e.g. when a hedged local read won).
+
+The client is a ``model_fn`` — ``client(image, prompt) -> str`` blocks the
+calling thread until the loop has the answer — so it drops into
+``VLMGuardPipeline`` unchanged (:func:`radiology_pipeline.build_async_pipeline`).
+Streamlit sessions and batch worker threads then share one limiter. Async
+callers ``await client.generate(image, prompt)`` instead.
+
+``model`` is anything with ``generate_content_async(contents, *,
+generation_config, safety_settings, request_options)`` returning an object with
+``.text`` — a ``genai.GenerativeModel``, or a fake with injected latency and
+errors in tests. google.generativeai is never imported here.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future
+from contextvars import ContextVar
+from typing import NamedTuple
+
+from PIL import Image, ImageChops
+
+from radiology_pipeline import (
+    GEMINI_MODEL_NAME,
+    GENERATION_CONFIG,
+    SAFETY_SETTINGS,
+    SYSTEM_INSTRUCTION,
+)
+from result_cache import ResultCache
+from stage_timing import span
+
+# ── Tunables (overridable via environment) ────────────────────────────────────
+_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", "8"))
+# Requests per minute the token bucket allows (match the project's quota), and
+# how many may start back to back after an idle spell.
+_RATE_PER_MINUTE = float(os.environ.get("GEMINI_RATE_PER_MINUTE", "60"))
+_BURST = int(os.environ.get("GEMINI_BURST", "4"))
+# Attempts per study, and the full-jitter backoff between them (seconds).
+_MAX_ATTEMPTS = int(os.environ.get("GEMINI_MAX_ATTEMPTS", "5"))
+_BACKOFF_BASE_S = float(os.environ.get("GEMINI_BACKOFF_BASE_S", "1.0"))
+_BACKOFF_MAX_S = float(os.environ.get("GEMINI_BACKOFF_MAX_S", "30"))
+# Whole-study budget: queueing, every attempt and every backoff.
+_DEADLINE_S = float(os.environ.get("GEMINI_DEADLINE_S", "120"))
+
+# Response cache (see ResponseCache). The memory tier holds GEMINI_CACHE_SIZE
+# responses (0 disables it); GEMINI_CACHE_DIR adds a persistent disk tier capped
+# at GEMINI_CACHE_MAX_MB. Entries older than GEMINI_CACHE_TTL_S are ignored
+# (0 = keep forever). GEMINI_CACHE_BYPASS=1 skips lookups but still stores the
+# fresh responses, refreshing the cache.
+_CACHE_SIZE = int(os.environ.get("GEMINI_CACHE_SIZE", "128"))
+_CACHE_DIR = os.environ.get("GEMINI_CACHE_DIR") or None
+_CACHE_MAX_MB = float(os.environ.get("GEMINI_CACHE_MAX_MB", "512"))
+_CACHE_TTL_S = float(os.environ.get("GEMINI_CACHE_TTL_S", str(30 * 24 * 3600)))
+CACHE_BYPASS = os.environ.get("GEMINI_CACHE_BYPASS", "0") == "1"
+
+# Upload encoding (see UploadEncoding): longest side in pixels (0 = keep the
+# size), single-channel greyscale for films without colour, container and JPEG
+# quality.
+# GEMINI_UPLOAD_ENCODE=0 hands the SDK the enhanced PIL image, as before.
+_UPLOAD_ENCODE = os.environ.get("GEMINI_UPLOAD_ENCODE", "1") == "1"
+_UPLOAD_MAX_SIDE = int(os.environ.get("GEMINI_UPLOAD_MAX_SIDE", "1024"))
+_UPLOAD_GREYSCALE = os.environ.get("GEMINI_UPLOAD_GREYSCALE", "1") == "1"
+_UPLOAD_FORMAT = os.environ.get("GEMINI_UPLOAD_FORMAT", "jpeg").lower()
+_UPLOAD_QUALITY = int(os.environ.get("GEMINI_UPLOAD_QUALITY", "85"))
+
+log = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying: rate limited, or a transient server failure.
+RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+
+class GeminiDeadlineExceeded(TimeoutError):
+    """A study's deadline passed before Gemini answered."""
+
+
+def status_code(error: BaseException) -> int | None:
+    """HTTP status of an API error (``google.api_core`` exceptions carry it as
+    ``.code``), or None."""
+    code = getattr(error, "code", None)
+    try:
+        return int(code) if code is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    return status_code(error) in RETRYABLE_STATUS or isinstance(error, ConnectionError)
+
+
+class RetryPolicy(NamedTuple):
+    """Full-jitter exponential backoff: before retry ``n`` (0-based), sleep a
+    uniform random time in ``[0, min(cap, base * 2**n)]``."""
+
+    max_attempts: int = _MAX_ATTEMPTS
+    base: float = _BACKOFF_BASE_S
+    cap: float = _BACKOFF_MAX_S
+
+    def delay(self, retry: int, rng: random.Random) -> float:
+        return rng.uniform(0.0, min(self.cap, self.base * 2 ** retry))
+
+
+class TokenBucket:
+    """Pace request starts to ``rate`` per second, allowing bursts of
+    ``capacity``. Waiters are served in arrival order. Use from one event loop.
+    """
+
+    def __init__(self, rate: float, capacity: int = 1, clock: Callable[[], float] = time.monotonic):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._clock = clock
+        self._tokens = float(self.capacity)
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock: asyncio.Lock | None = None
+
+    def _refill(self, now: float) -> None:
+        start = max(self._updated, self._paused_until)
+        if now > start:
+            self._tokens = min(self.capacity, self._tokens + (now - start) * self.rate)
+        self._updated = max(now, self._updated)
+
+    def pause(self, seconds: float) -> None:
+        """Hand out no token for ``seconds`` (e.g. after a 429), and forfeit the
+        tokens saved up so requests resume at the steady rate."""
+        now = self._clock()
+        self._refill(now)
+        self._tokens = min(self._tokens, 0.0)
+        self._paused_until = max(self._paused_until, now + seconds)
+
+    async def acquire(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = self._clock()
+                self._refill(now)
+                if now >= self._paused_until and self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = max(self._paused_until - now, (1.0 - self._tokens) / self.rate)
+                await asyncio.sleep(max(wait, 0.0))
+
+
+# ── Upload encoding ───────────────────────────────────────────────────────────
+
+_MIME_TYPES = {"jpeg": "image/jpeg", "png": "image/png"}
+
+
+class UploadEncoding(NamedTuple):
+    """How a film is encoded for upload. ``greyscale`` sends one channel for
+    images without colour (an X-ray comes out of the enhancer as RGB with
+    equal bands); a colour image keeps its channels, so the model can still
+    tell a photograph from a film. ``quality`` applies to JPEG; PNG is lossless
+    and only gains from the downscale and greyscale."""
+
+    max_side: int = _UPLOAD_MAX_SIDE
+    greyscale: bool = _UPLOAD_GREYSCALE
+    format: str = _UPLOAD_FORMAT
+    quality: int = _UPLOAD_QUALITY
+
+
+# What the clients use unless told otherwise; None sends the PIL image as is.
+DEFAULT_UPLOAD = UploadEncoding() if _UPLOAD_ENCODE else None
+
+
+class Upload(NamedTuple):
+    """An encoded film: ``part`` is the inline blob ``generate_content``
+    accepts in place of a PIL image."""
+
+    part: dict
+    size: tuple[int, int]
+    seconds: float
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.part["data"])
+
+
+def is_greyscale(image: Image.Image) -> bool:
+    """Whether ``image`` carries no colour: a single-band mode, or RGB(A) whose
+    three bands are identical."""
+    if image.mode in ("1", "L", "LA", "I", "I;16", "F"):
+        return True
+    if image.mode not in ("RGB", "RGBA"):
+        return False
+    red, green, blue = image.split()[:3]
+    return (
+        ImageChops.difference(red, green).getbbox() is None
+        and ImageChops.difference(green, blue).getbbox() is None
+    )
+
+
+def encode_upload(image: Image.Image, encoding: UploadEncoding) -> Upload:
+    """Downscale ``image`` so its longest side is at most ``encoding.max_side``,
+    convert it to greyscale if asked and it has no colour (:func:`is_greyscale`),
+    and encode it as JPEG or PNG."""
+    mime_type = _MIME_TYPES.get(encoding.format)
+    if mime_type is None:
+        raise ValueError(f"unsupported upload format {encoding.format!r} (use jpeg or png)")
+    start = time.perf_counter()
+    grey = image.mode == "L" or (encoding.greyscale and is_greyscale(image))
+    mode = "L" if grey else "RGB"
+    if image.mode != mode:
+        # Before resizing, so the resampler works on one channel, not three.
+        image = image.convert(mode)
+    longest = max(image.size)
+    if encoding.max_side > 0 and longest > encoding.max_side:
+        scale = encoding.max_side / longest
+        size = tuple(max(1, round(side * scale)) for side in image.size)
+        image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    buf = io.BytesIO()
+    if encoding.format == "jpeg":
+        image.save(buf, format="JPEG", quality=encoding.quality)
+    else:
+        image.save(buf, format="PNG")
+    return Upload(
+        {"mime_type": mime_type, "data": buf.getvalue()},
+        image.size,
+        time.perf_counter() - start,
+    )
+
+
+def log_request(upload: Upload | None, round_trip: float, attempts: int = 1) -> None:
+    """One INFO line per answered request: payload, encode and round-trip time."""
+    if upload is None:
+        log.info("gemini request: PIL image, %.2fs round trip, %d attempt(s)", round_trip, attempts)
+    else:
+        log.info(
+            "gemini request: %d bytes (%s %dx%d, encoded in %.1f ms), %.2fs round trip, %d attempt(s)",
+            upload.nbytes, upload.part["mime_type"], *upload.size, 1000 * upload.seconds,
+            round_trip, attempts,
+        )
+
+
+# ── Cancellation ──────────────────────────────────────────────────────────────
+
+
+class CancelScope:
+    """Collects the requests :class:`AsyncGeminiClient` submits inside
+    :func:`cancellable`, so another thread can abandon them: :meth:`cancel`
+    cancels those in flight (on the client's loop) and any submitted later.
+    The blocked ``client(image, prompt)`` call then raises ``CancelledError``.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._futures: list[Future] = []
+        self._lock = threading.Lock()
+
+    def add(self, future: Future) -> None:
+        with self._lock:
+            if not self.cancelled:
+                self._futures.append(future)
+                return
+        future.cancel()
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.cancel()
+
+
+_scope: ContextVar[CancelScope | None] = ContextVar("gemini_cancel_scope", default=None)
+
+
+@contextlib.contextmanager
+def cancellable(scope: CancelScope) -> Iterator[CancelScope]:
+    """Register the requests submitted by this thread in this block with ``scope``."""
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+
+
+# ── Response cache ────────────────────────────────────────────────────────────
+
+
+class ResponseCache:
+    """Gemini response texts in a :class:`result_cache.ResultCache`, keyed by
+    everything that determines them.
+
+    The key digests the image as the model receives it (after enhancement),
+    the upload encoding, the prompt, ``RADIOLOGY_JSON_SCHEMA``, the system
+    instruction and the model name, so changing any of them misses rather than
+    serving an answer to a different question. Size eviction is the
+    ResultCache's. Each entry also records when it was stored, and entries
+    older than ``ttl`` seconds are treated as misses (``ttl=0`` keeps them
+    forever).
+    """
+
+    def __init__(
+        self,
+        store: ResultCache,
+        ttl: float = _CACHE_TTL_S,
+        model_name: str = GEMINI_MODEL_NAME,
+        system_instruction: str = SYSTEM_INSTRUCTION,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.store = store
+        self.ttl = ttl
+        self._clock = clock
+        # Everything but the image and prompt is fixed per cache: digest it once.
+        self._context = hashlib.blake2b(
+            json.dumps(
+                {
+                    "model": model_name,
+                    "system_instruction": system_instruction,
+                    "generation_config": GENERATION_CONFIG,
+                },
+                sort_keys=True,
+            ).encode(),
+            digest_size=20,
+        ).digest()
+
+    def key(self, image: Image.Image, prompt: str, upload: UploadEncoding | None = None) -> str:
+        h = hashlib.blake2b(self._context, digest_size=20)
+        h.update(f"{tuple(upload) if upload else None}:".encode())
+        h.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+        h.update(image.tobytes())
+        h.update(prompt.encode())
+        return h.hexdigest()
+
+    def get(self, key: str) -> str | None:
+        value = self.store.get(key)
+        if value is None:
+            return None
+        try:
+            entry = json.loads(value)
+        except ValueError:
+            return None
+        if self.ttl > 0 and self._clock() - entry["stored_at"] > self.ttl:
+            return None
+        return entry["text"]
+
+    def put(self, key: str, text: str) -> None:
+        """Store a response; text that is not a JSON object is not cached."""
+        try:
+            if not isinstance(json.loads(text), dict):
+                return
+        except ValueError:
+            return
+        self.store.put(key, json.dumps({"stored_at": self._clock(), "text": text}).encode())
+
+
+def system_instruction_of(model) -> str:
+    """The system instruction ``model`` was built with, as text.
+    ``genai.GenerativeModel`` keeps it as a ``Content`` on ``_system_instruction``
+    (None when it has none); a model without that attribute is assumed to use
+    ``SYSTEM_INSTRUCTION``."""
+    if not hasattr(model, "_system_instruction"):
+        return SYSTEM_INSTRUCTION
+    instruction = model._system_instruction
+    if instruction is None or isinstance(instruction, str):
+        return instruction or ""
+    return "".join(getattr(part, "text", "") for part in instruction.parts)
+
+
+def default_response_cache(
+    model, directory: str | None = None, system_instruction: str | None = None
+) -> ResponseCache | None:
+    """The ``GEMINI_CACHE_*`` response cache for ``model`` (with its disk tier
+    in ``directory`` if given), or None when both tiers are disabled. Entries
+    are keyed by ``system_instruction``, by default the model's own
+    (:func:`system_instruction_of`)."""
+    directory = directory or _CACHE_DIR
+    if _CACHE_SIZE <= 0 and not directory:
+        return None
+    store = ResultCache(
+        max_entries=_CACHE_SIZE,
+        directory=directory,
+        max_bytes=int(_CACHE_MAX_MB * 1024 * 1024),
+    )
+    # genai.GenerativeModel names itself "models/<name>".
+    name = getattr(model, "model_name", None) or GEMINI_MODEL_NAME
+    if system_instruction is None:
+        system_instruction = system_instruction_of(model)
+    return ResponseCache(
+        store, model_name=name.removeprefix("models/"), system_instruction=system_instruction
+    )
+
+
+# ── Client ────────────────────────────────────────────────────────────────────
+
+
+def _cancel_and_stop(loop: asyncio.AbstractEventLoop) -> None:
+    """Cancel every task on ``loop`` and stop it once they have all unwound.
+    Runs on the loop's own thread (via ``call_soon_threadsafe``)."""
+    tasks = asyncio.all_tasks(loop)
+    if not tasks:
+        loop.stop()
+        return
+    for task in tasks:
+        task.cancel()
+    asyncio.gather(*tasks, return_exceptions=True).add_done_callback(lambda _: loop.stop())
+
+
+class AsyncGeminiClient:
+    """Concurrency-limited, rate-limited, retrying Gemini caller (see the
+    module docstring). ``stats`` counts cache hits, requests, attempts,
+    retries, 429s, failures, deadline overruns, cancellations and the image
+    bytes sent
+    (every attempt re-sends them) since the client was created. With
+    ``bypass_cache`` set, lookups are skipped but responses are still stored.
+    ``upload=None`` sends the PIL image unencoded.
+    """
+
+    def __init__(
+        self,
+        model,
+        *,
+        max_concurrency: int = _MAX_CONCURRENCY,
+        rate_per_minute: float = _RATE_PER_MINUTE,
+        burst: int = _BURST,
+        policy: RetryPolicy | None = None,
+        deadline: float = _DEADLINE_S,
+        rng: random.Random | None = None,
+        cache: ResponseCache | None = None,
+        bypass_cache: bool = CACHE_BYPASS,
+        upload: UploadEncoding | None = DEFAULT_UPLOAD,
+    ):
+        self.model = model
+        self.upload = upload
+        self.cache = cache
+        self.bypass_cache = bypass_cache
+        self.max_concurrency = max(1, max_concurrency)
+        self.policy = policy or RetryPolicy()
+        self.deadline = deadline
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst)
+        self.stats = {
+            "cache_hits": 0, "requests": 0, "attempts": 0, "retries": 0, "throttled": 0,
+            "failed": 0, "deadline_exceeded": 0, "cancelled": 0, "bytes_sent": 0,
+        }
+        self._rng = rng or random.Random()
+        self._semaphore: asyncio.Semaphore | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock = threading.Lock()
+
+    # ── entry points ──────────────────────────────────────────────────────────
+
+    def __call__(self, image: Image.Image, prompt: str) -> str:
+        """``model_fn`` contract: block until the report JSON text is in."""
+        return self.submit(image, prompt).result()
+
+    def submit(self, image: Image.Image, prompt: str) -> Future:
+        """Schedule one study on the client's loop; thread-safe. A cache hit
+        returns an already completed Future. The cache is keyed and read, and
+        the film encoded, on the calling thread, so large films never stall
+        the loop."""
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(image, prompt, self.upload)
+            text = None if self.bypass_cache else self.cache.get(key)
+            if text is not None:
+                with self._lock:
+                    self.stats["cache_hits"] += 1
+                future: Future = Future()
+                future.set_result(text)
+                return future
+        upload = None
+        if self.upload is not None:
+            with span("upload_encode"):
+                upload = encode_upload(image, self.upload)
+        future = asyncio.run_coroutine_threadsafe(
+            self._generate(upload.part if upload else image, prompt, key, upload),
+            self._ensure_loop(),
+        )
+        scope = _scope.get()
+        if scope is not None:
+            scope.add(future)
+        return future
+
+    async def generate(self, image: Image.Image, prompt: str) -> str:
+        """:meth:`__call__` for coroutines, on any event loop."""
+        return await asyncio.wrap_future(self.submit(image, prompt))
+
+    def close(self) -> None:
+        """Stop the background loop. Requests still pending are cancelled: their
+        Futures raise ``CancelledError`` instead of never resolving."""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is not None:
+            loop.call_soon_threadsafe(_cancel_and_stop, loop)
+
+    # ── loop side ─────────────────────────────────────────────────────────────
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is not None:
+            return self._loop
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=loop.run_forever, name="gemini-async", daemon=True
+                ).start()
+                self._loop = loop
+        return self._loop
+
+    async def _generate(
+        self, part, prompt: str, key: str | None = None, upload: Upload | None = None
+    ) -> str:
+        self.stats["requests"] += 1
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        started = time.monotonic()
+        deadline = started + self.deadline
+        try:
+            text, attempts = await asyncio.wait_for(
+                self._attempts(part, prompt, deadline, upload), self.deadline
+            )
+            log_request(upload, time.monotonic() - started, attempts)
+            if key is not None:
+                # Stored before the caller sees the answer, off the loop thread.
+                await asyncio.to_thread(self.cache.put, key, text)
+            return text
+        except asyncio.CancelledError:
+            self.stats["cancelled"] += 1
+            raise
+        except asyncio.TimeoutError:
+            self.stats["deadline_exceeded"] += 1
+            raise GeminiDeadlineExceeded(
+                f"no Gemini response within {self.deadline:g}s"
+            ) from None
+        except Exception:
+            self.stats["failed"] += 1
+            raise
+
+    async def _attempts(
+        self, part, prompt: str, deadline: float, upload: Upload | None
+    ) -> tuple[str, int]:
+        """The response text, and how many attempts it took."""
+        retry = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    # Take the token only once a slot is free, so requests queued
+                    # on the semaphore do not drain the bucket and then burst.
+                    await self.bucket.acquire()
+                    self.stats["attempts"] += 1
+                    if upload is not None:
+                        self.stats["bytes_sent"] += upload.nbytes
+                    response = await self.model.generate_content_async(
+                        [prompt, part],
+                        generation_config=GENERATION_CONFIG,
+                        safety_settings=SAFETY_SETTINGS,
+                        request_options={"timeout": max(deadline - time.monotonic(), 0.001)},
+                    )
+                return response.text, retry + 1
+            except Exception as e:
+                if not is_retryable(e) or retry + 1 >= self.policy.max_attempts:
+                    raise
+                throttled = status_code(e) == 429
+            delay = self.policy.delay(retry, self._rng)
+            if throttled:
+                self.stats["throttled"] += 1
+                self.bucket.pause(delay)
+            self.stats["retries"] += 1
+            retry += 1
+            await asyncio.sleep(delay)
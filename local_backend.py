@@ -24,12 +24,26 @@ file or onnxruntime installed.
 """
 from __future__ import annotations
 
+import bisect
+import contextlib
+import hashlib
 import json
 import os
+import platform
+import queue
+import threading
+import time
+from collections.abc import Callable, Sequence
+from concurrent.futures import Future
+from functools import cached_property, lru_cache
+from typing import NamedTuple
 
 import numpy as np
 from PIL import Image
 
+from result_cache import ResultCache
+from stage_timing import span
+
 # ── Canonical model output order ──────────────────────────────────────────────
 # TorchXRayVision densenet121-res224-all pathology order. tools/export_onnx.py
 # asserts the loaded model matches this exactly, so index i of the ONNX output
@@ -63,26 +77,236 @@ _STRUCTURE = {
     "Hernia": "Diaphragm",
 }
 
+# Modality of the report for an image the CT gate rejected (see build_report).
+UNSUPPORTED_MODALITY = "CT / cross-sectional (unsupported)"
+
 # ── Tunables (overridable via environment) ────────────────────────────────────
 # Probability above which a pathology is reported as a finding.
 DETECTION_THRESHOLD = float(os.environ.get("CHEXNET_THRESHOLD", "0.5"))
+# Per-pathology thresholds written by tools/calibrate.py; pathologies the file
+# does not list keep DETECTION_THRESHOLD (see load_thresholds).
+_THRESHOLDS_PATH = os.environ.get("CHEXNET_THRESHOLDS") or None
 # Heuristic gate thresholds (see looks_like_xray).
 _MAX_SATURATION = float(os.environ.get("CHEXNET_MAX_SATURATION", "15"))
 _MIN_CONTRAST = float(os.environ.get("CHEXNET_MIN_CONTRAST", "10"))
 
-_ONNX_PATH = os.environ.get(
-    "CHEXNET_ONNX_PATH",
-    os.path.join(os.path.dirname(__file__), "models", "chexnet.onnx"),
-)
+# Images per session.run() in the batched path. The exported graph has a dynamic
+# batch axis, so any size works; this only bounds peak memory per call.
+BATCH_SIZE = int(os.environ.get("CHEXNET_BATCH_SIZE", "32"))
+# Process-wide micro-batching of concurrent single-image requests (see
+# MicroBatcher). Off by default: a single-user deployment gains nothing from it.
+_MICROBATCH = os.environ.get("CHEXNET_MICROBATCH", "0") == "1"
+_MICROBATCH_MAX_SIZE = int(os.environ.get("CHEXNET_MICROBATCH_MAX_SIZE", "8"))
+_MICROBATCH_MAX_WAIT_MS = float(os.environ.get("CHEXNET_MICROBATCH_MAX_WAIT_MS", "15"))
+
+# Content-addressed cache of raw model outputs (see _cache_key). The memory tier
+# holds CHEXNET_CACHE_SIZE entries (0 disables caching); setting
+# CHEXNET_CACHE_DIR adds a disk tier capped at CHEXNET_CACHE_MAX_MB.
+_CACHE_SIZE = int(os.environ.get("CHEXNET_CACHE_SIZE", "256"))
+_CACHE_DIR = os.environ.get("CHEXNET_CACHE_DIR") or None
+_CACHE_MAX_MB = float(os.environ.get("CHEXNET_CACHE_MAX_MB", "256"))
+
+# Streamlit app: warm the session up in the background as soon as the server
+# starts, instead of when the Local or Cascade backend is first selected (see
+# start_warm_up). Off by default so Gemini-only deployments never load the model.
+WARM_UP_ON_START = os.environ.get("CHEXNET_WARM_UP", "0") == "1"
+
+# Which exported graph to run: "fp32" (tools/export_onnx.py), "int8"
+# (tools/export_onnx.py --quantize …) or "fused" (tools/export_onnx.py --fuse:
+# uint8 pixels in, probabilities out). CHEXNET_ONNX_PATH overrides all three.
+_MODEL_FILES = {
+    "fp32": "chexnet.onnx",
+    "int8": "chexnet.int8.onnx",
+    "fused": "chexnet.fused.onnx",
+}
+_MODEL_VARIANT = os.environ.get("CHEXNET_MODEL_VARIANT", "fp32").lower()
+
+
+def _resolve_model_path(variant: str) -> str:
+    """Default model path for ``variant``; ValueError for an unknown one."""
+    if variant not in _MODEL_FILES:
+        raise ValueError(
+            f"CHEXNET_MODEL_VARIANT must be one of {sorted(_MODEL_FILES)}, got {variant!r}"
+        )
+    return os.path.join(os.path.dirname(__file__), "models", _MODEL_FILES[variant])
+
+
+_ONNX_PATH = os.environ.get("CHEXNET_ONNX_PATH") or _resolve_model_path(_MODEL_VARIANT)
+
+# Model metadata tools/export_onnx.py --fuse stamps on the graph (see
+# _graph_layout). A graph without them is the plain export: xrv-normalised
+# float32 input, raw logits out.
+_META_INPUT = "chexnet.input"      # "uint8" | "float32"
+_META_OUTPUT = "chexnet.output"    # "probabilities" | "logits"
+
+# onnxruntime SessionOptions (see _session_options). The defaults suit a 1-vCPU
+# host: one intra-op thread avoids oversubscription on weak CPUs.
+_INTRA_OP_THREADS = int(os.environ.get("CHEXNET_INTRA_OP_THREADS", "1"))
+_INTER_OP_THREADS = int(os.environ.get("CHEXNET_INTER_OP_THREADS", "1"))
+# Sessions in the process-wide SessionPool, each with CHEXNET_INTRA_OP_THREADS
+# threads of its own. "auto" = one per CHEXNET_INTRA_OP_THREADS cores. Every
+# session holds its own copy of the weights, so memory grows with the pool.
+_SESSION_POOL_SIZE = os.environ.get("CHEXNET_SESSION_POOL_SIZE", "1").lower()
+_EXECUTION_MODE = os.environ.get("CHEXNET_EXECUTION_MODE", "sequential").lower()
+_GRAPH_OPT_LEVEL = os.environ.get("CHEXNET_GRAPH_OPT_LEVEL", "all").lower()
+_CPU_MEM_ARENA = os.environ.get("CHEXNET_CPU_MEM_ARENA", "1") == "1"
+_MEM_PATTERN = os.environ.get("CHEXNET_MEM_PATTERN", "1") == "1"
+# Directory for the graph onnxruntime optimises at session creation. When set,
+# the first cold start saves it and later starts load it with optimisation
+# disabled, skipping the rewrite. Unset = optimise in memory on every start.
+_OPTIMIZED_MODEL_DIR = os.environ.get("CHEXNET_OPTIMIZED_MODEL_DIR") or None
+
+_EXECUTION_MODES = {"sequential": "ORT_SEQUENTIAL", "parallel": "ORT_PARALLEL"}
+_GRAPH_OPT_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+# Short side load_image() decodes large films down to (see load_image). 448 is
+# the ImagePyramid base level: twice the model's 224 px. 0 = always full decode.
+_DECODE_MIN_SIDE = int(os.environ.get("CHEXNET_DECODE_MIN_SIDE", "448"))
+
+# Lazily-initialised pool of onnxruntime sessions (see SessionPool; heavy
+# import, kept out of module load).
+_pool = None
+_pool_lock = threading.Lock()
+# Lazily-built logit cache (see _get_cache); False once found to be disabled.
+_cache = None
+# Process-wide background warm-up (see start_warm_up).
+_warm_up = None
+_warm_up_lock = threading.Lock()
+# Lazily-started process-wide MicroBatcher (see get_scheduler).
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+# ── Reduced-resolution decode ────────────────────────────────────────────────
+
+
+def load_image(fp, min_side: int | None = None) -> Image.Image:
+    """Open ``fp`` (path or file object) as RGB, decoded no larger than needed.
+
+    The pipeline never looks at more than a 448 px short side (see
+    :class:`ImagePyramid`), yet a 3000×3000 DX export fully decoded is ~27 MB of
+    RGB before anything is thrown away. For JPEG, ``Image.draft`` makes libjpeg
+    scale the DCT by 1/2, 1/4 or 1/8 while decoding, so the full-size frame is
+    never materialised. PNG has no such mode; it is decoded in full but
+    box-reduced *before* the RGB conversion, so the full-size RGB copy is never
+    made and the full-size frame is freed straight away.
+
+    The short side stays at least ``min_side`` (default
+    ``CHEXNET_DECODE_MIN_SIDE``); smaller images, and ``min_side=0``, decode as
+    before.
+    """
+    min_side = _DECODE_MIN_SIDE if min_side is None else min_side
+    with Image.open(fp) as image:
+        if min_side > 0 and min(image.size) >= 2 * min_side:
+            image.draft(None, (min_side, min_side))  # no-op for non-JPEG
+            image.load()
+            factor = min(image.size) // min_side
+            if factor > 1:
+                if image.mode not in _REDUCIBLE_MODES:
+                    image = image.convert("RGB")
+                image = image.reduce(factor)
+        return image.convert("RGB")
+
+
+# ── Shared image pyramid ──────────────────────────────────────────────────────
+
+# Model input side; also the anchor for the pyramid's base level.
+_MODEL_SIDE = 224
+# Gates down-sample the whole frame to these sides (see looks_like_*).
+_XRAY_GATE_SIDE = 64
+_CT_GATE_SIDE = 96
+# Modes Image.reduce() handles directly; anything else is converted to RGB first.
+_REDUCIBLE_MODES = {"L", "LA", "RGB", "RGBA", "I", "F"}
+_GREY_MODES = {"1", "L", "LA", "I", "I;16", "F"}
+
+
+class ImagePyramid:
+    """Decode-once view of an upload, shared by both gates and the model input.
+
+    The gates and :func:`_preprocess` each used to convert and resample the
+    full-resolution film on their own — three colour conversions and three
+    resamples of a possibly 3000×3000 image. Here the source is box-reduced
+    once (``Image.reduce``, integer factor) to a *base* level whose short side
+    stays at least twice the model's 224 px, greyscaled once, and every
+    consumer reads a small level derived from that:
+
+    * ``xray_view`` — 64×64 float RGB of the whole frame (saturation/contrast)
+    * ``ct_view``   — 96×96 float greyscale of the whole frame (CT corners)
+    * ``model_view`` — 224×224 uint8 greyscale centre crop (classifier input)
+
+    Levels are built lazily, so an upload rejected by the first gate never pays
+    for the rest. Down-sampling from the base instead of the original shifts
+    pixel values by a grey level or so; ``tests/test_local_backend.py`` pins the
+    tolerance against the full-resolution path.
+    """
+
+    def __init__(self, image: Image.Image):
+        self.source = image
+        if image.mode not in _REDUCIBLE_MODES:
+            image = image.convert("RGB")
+        factor = max(1, min(image.size) // (2 * _MODEL_SIDE))
+        self.base = image.reduce(factor) if factor > 1 else image
+
+    @cached_property
+    def gray(self) -> Image.Image:
+        """The base level in greyscale — the only colour conversion made."""
+        return self.base if self.base.mode == "L" else self.base.convert("L")
+
+    @cached_property
+    def xray_view(self) -> np.ndarray:
+        side = (_XRAY_GATE_SIDE, _XRAY_GATE_SIDE)
+        if self.source.mode in _GREY_MODES:
+            # No colour to measure: replicate the grey level instead of
+            # converting the base to RGB (saturation is then exactly 0).
+            grey = np.asarray(self.gray.resize(side), dtype=np.float32)
+            return np.repeat(grey[:, :, None], 3, axis=2)
+        return np.asarray(self.base.convert("RGB").resize(side), dtype=np.float32)
+
+    @cached_property
+    def ct_view(self) -> np.ndarray:
+        side = (_CT_GATE_SIDE, _CT_GATE_SIDE)
+        return np.asarray(self.gray.resize(side), dtype=np.float32)
+
+    @cached_property
+    def model_view(self) -> np.ndarray:
+        gray = self.gray
+        w, h = gray.size
+        side = min(w, h)
+        left, top = (w - side) // 2, (h - side) // 2
+        crop = gray.crop((left, top, left + side, top + side))
+        return np.asarray(crop.resize((_MODEL_SIDE, _MODEL_SIDE)), dtype=np.uint8)
+
+
+def _as_pyramid(image: Image.Image | ImagePyramid) -> ImagePyramid:
+    return image if isinstance(image, ImagePyramid) else ImagePyramid(image)
 
-# Lazily-initialised onnxruntime session (heavy import; kept out of module load).
-_session = None
+
+# An image, its pyramid, or a model view already taken from one.
+ModelInput = Image.Image | ImagePyramid | np.ndarray
+
+
+def _model_view(image: ModelInput) -> np.ndarray:
+    return image if isinstance(image, np.ndarray) else _as_pyramid(image).model_view
 
 
 # ── is_medical_image gate ─────────────────────────────────────────────────────
 
 
-def looks_like_xray(image: Image.Image) -> bool:
+def _xray_stats(image: Image.Image | ImagePyramid) -> tuple[float, float]:
+    """(saturation, contrast) of the 64×64 whole-frame view."""
+    small = _as_pyramid(image).xray_view
+    # Per-pixel (max-min) across channels ≈ saturation; ~0 for true greyscale.
+    saturation = float((small.max(axis=2) - small.min(axis=2)).mean())
+    contrast = float(small.mean(axis=2).std())
+    return saturation, contrast
+
+
+def looks_like_xray(image: Image.Image | ImagePyramid) -> bool:
     """Cheap heuristic: does this image plausibly look like a chest radiograph?
 
     Radiographs are greyscale (near-zero colour saturation) and have real tonal
@@ -92,27 +316,13 @@ def looks_like_xray(image: Image.Image) -> bool:
     it reliably rejects colour images and blank uploads. Limitations are
     documented; downstream the NonMedicalImageRule blocks anything that fails.
     """
-    small = np.asarray(image.convert("RGB").resize((64, 64))).astype(np.float32)
-    # Per-pixel (max-min) across channels ≈ saturation; ~0 for true greyscale.
-    saturation = float((small.max(axis=2) - small.min(axis=2)).mean())
-    contrast = float(small.mean(axis=2).std())
+    saturation, contrast = _xray_stats(image)
     return saturation < _MAX_SATURATION and contrast > _MIN_CONTRAST
 
 
-def looks_like_ct_slice(image: Image.Image) -> bool:
-    """Best-effort detector for an axial CT slice (which the CXR model can't read).
-
-    Both X-rays and CT are greyscale, so looks_like_xray() can't separate them.
-    But an axial CT reconstruction has a *circular field of view*: the corners sit
-    outside the bore and are pure black, while the mid-edges and centre (the body
-    cross-section) are bright. Chest radiographs fill the frame, so their corners
-    are not uniformly black with a bright interior.
-
-    This catches the common axial-CT case. It is NOT bulletproof — a CT exported
-    to fill the frame, or a coronal/sagittal reformat, may slip through, and the
-    Low-confidence guardrail is the backstop for those. Thresholds are tunable.
-    """
-    arr = np.asarray(image.convert("L").resize((96, 96)), dtype=np.float32)
+def _ct_stats(image: Image.Image | ImagePyramid) -> tuple[float, float, float]:
+    """(corner, edge, centre) mean intensities of the 96×96 whole-frame view."""
+    arr = _as_pyramid(image).ct_view
     c = 14  # corner / edge patch size
     mid = slice(48 - c // 2, 48 + c // 2)
 
@@ -125,7 +335,23 @@ def looks_like_ct_slice(image: Image.Image) -> bool:
         arr[mid, :c].mean(), arr[mid, -c:].mean(),
     ]))
     center_mean = float(arr[mid, mid].mean())
+    return corner_mean, edge_mean, center_mean
+
 
+def looks_like_ct_slice(image: Image.Image | ImagePyramid) -> bool:
+    """Best-effort detector for an axial CT slice (which the CXR model can't read).
+
+    Both X-rays and CT are greyscale, so looks_like_xray() can't separate them.
+    But an axial CT reconstruction has a *circular field of view*: the corners sit
+    outside the bore and are pure black, while the mid-edges and centre (the body
+    cross-section) are bright. Chest radiographs fill the frame, so their corners
+    are not uniformly black with a bright interior.
+
+    This catches the common axial-CT case. It is NOT bulletproof — a CT exported
+    to fill the frame, or a coronal/sagittal reformat, may slip through, and the
+    Low-confidence guardrail is the backstop for those. Thresholds are tunable.
+    """
+    corner_mean, edge_mean, center_mean = _ct_stats(image)
     dark_corners = corner_mean < 25.0
     bright_interior = (center_mean > corner_mean + 40.0
                        and edge_mean > corner_mean + 25.0)
@@ -135,18 +361,130 @@ def looks_like_ct_slice(image: Image.Image) -> bool:
 # ── Probability → schema mapping (pure, unit-testable) ────────────────────────
 
 
-def _bucket_severity(prob: float) -> str:
+_SEVERITIES = ("mild", "moderate", "severe", "critical")
+_CONFIDENCES = ("Low", "Medium", "High")
+_PATHOLOGY_INDEX = {name: i for i, name in enumerate(PATHOLOGIES)}
+
+
+class ReportBands(NamedTuple):
+    """Every cut-off applied to probabilities after inference. None of them
+    affects the model output, so a stored raw output can be re-templated under
+    new bands without re-running the model (see :mod:`logit_store`).
+
+    ``threshold`` and ``severity`` each hold one value (one triple) for every
+    pathology, or a tuple with one per :data:`PATHOLOGIES` entry (see
+    :func:`load_bands`).
+    """
+
+    threshold: float | tuple[float, ...] = 0.5               # reported as a finding from
+    severity: tuple = (0.60, 0.75, 0.90)                     # moderate / severe / critical from
+    finding_confidence: tuple[float, float] = (0.65, 0.85)   # Medium / High: strongest finding from
+    negative_margin: tuple[float, float] = (0.05, 0.15)      # Medium / High: all this far below threshold
+
+    def cutoff(self, name: str) -> float:
+        """Detection threshold for pathology ``name``."""
+        if isinstance(self.threshold, tuple):
+            return self.threshold[_PATHOLOGY_INDEX[name]]
+        return self.threshold
+
+    def severity_cutoffs(self, name: str) -> tuple[float, float, float]:
+        """Moderate / severe / critical cut-offs for pathology ``name``."""
+        if isinstance(self.severity[0], tuple):
+            return self.severity[_PATHOLOGY_INDEX[name]]
+        return self.severity
+
+    def thresholds(self) -> np.ndarray:
+        """Detection thresholds as an array aligned with :data:`PATHOLOGIES`."""
+        return report_table(self).thresholds
+
+
+class ReportTable(NamedTuple):
+    """:class:`ReportBands` as arrays aligned with :data:`PATHOLOGIES`, built
+    once per bands by :func:`report_table` for :func:`build_reports`."""
+
+    thresholds: np.ndarray          # (P,)
+    severity: np.ndarray            # (P, 3)
+    finding_confidence: np.ndarray  # (2,)
+    negative_margin: np.ndarray     # (2,)
+
+
+@lru_cache(maxsize=32)
+def report_table(bands: ReportBands) -> ReportTable:
+    """The (cached, read-only) array form of ``bands``."""
+    width = len(PATHOLOGIES)
+    arrays = ReportTable(
+        thresholds=np.broadcast_to(np.asarray(bands.threshold, dtype=np.float64), (width,)),
+        severity=np.broadcast_to(np.asarray(bands.severity, dtype=np.float64), (width, 3)),
+        finding_confidence=np.asarray(bands.finding_confidence, dtype=np.float64),
+        negative_margin=np.asarray(bands.negative_margin, dtype=np.float64),
+    )
+    for array in arrays:
+        array.flags.writeable = False
+    return arrays
+
+
+def load_thresholds(path: str, default: float | None = None) -> tuple[float, ...]:
+    """Per-pathology detection thresholds from a ``tools/calibrate.py`` config,
+    aligned with :data:`PATHOLOGIES`. Pathologies the file does not list get
+    ``default`` (``DETECTION_THRESHOLD``). ValueError on an unknown pathology
+    or a threshold outside [0, 1]."""
+    with open(path, encoding="utf-8") as f:
+        table = json.load(f)["thresholds"]
+    unknown = set(table) - set(PATHOLOGIES)
+    if unknown:
+        raise ValueError(f"{path}: unknown pathologies {sorted(unknown)}")
+    default = DETECTION_THRESHOLD if default is None else default
+    thresholds = tuple(float(table.get(name, default)) for name in PATHOLOGIES)
+    if not all(0.0 <= t <= 1.0 for t in thresholds):
+        raise ValueError(f"{path}: thresholds must lie in [0, 1]")
+    return thresholds
+
+
+def load_bands(path: str, base: ReportBands | None = None) -> ReportBands:
+    """``base`` (default: ``DETECTION_THRESHOLD`` and the default bands) with
+    the per-pathology tables of a config file: ``thresholds`` as in
+    :func:`load_thresholds` and, optionally, ``severity`` — pathology →
+    ascending ``[moderate, severe, critical]`` cut-offs. ValueError on an
+    unknown pathology or a malformed entry."""
+    base = base or ReportBands(DETECTION_THRESHOLD)
+    default = base.threshold if not isinstance(base.threshold, tuple) else None
+    with open(path, encoding="utf-8") as f:
+        table = json.load(f).get("severity") or {}
+    unknown = set(table) - set(PATHOLOGIES)
+    if unknown:
+        raise ValueError(f"{path}: unknown pathologies {sorted(unknown)}")
+    severity = base.severity
+    if table:
+        severity = tuple(
+            tuple(float(c) for c in table[name]) if name in table else base.severity_cutoffs(name)
+            for name in PATHOLOGIES
+        )
+        for name, cutoffs in zip(PATHOLOGIES, severity):
+            if len(cutoffs) != 3 or not 0.0 <= cutoffs[0] <= cutoffs[1] <= cutoffs[2] <= 1.0:
+                raise ValueError(f"{path}: severity for {name} must be 3 ascending values in [0, 1]")
+    return base._replace(threshold=load_thresholds(path, default), severity=severity)
+
+
+_loaded_bands: ReportBands | None = None
+
+
+def default_bands() -> ReportBands:
+    """The bands reports use unless told otherwise: the ``CHEXNET_THRESHOLDS``
+    table if set (read once), else ``DETECTION_THRESHOLD`` for every pathology."""
+    global _loaded_bands
+    if _THRESHOLDS_PATH is None:
+        return ReportBands(DETECTION_THRESHOLD)
+    if _loaded_bands is None:
+        _loaded_bands = load_bands(_THRESHOLDS_PATH)
+    return _loaded_bands
+
+
+def _bucket_severity(prob: float, cutoffs: Sequence[float] = ReportBands().severity) -> str:
     """Map a pathology probability to the schema's severity enum."""
-    if prob >= 0.90:
-        return "critical"
-    if prob >= 0.75:
-        return "severe"
-    if prob >= 0.60:
-        return "moderate"
-    return "mild"  # in [threshold, 0.60)
+    return _SEVERITIES[bisect.bisect_right(cutoffs, prob)]  # mild is [threshold, cutoffs[0])
 
 
-def _confidence(probs: dict[str, float], threshold: float) -> str:
+def _confidence(probs: dict[str, float], bands: ReportBands) -> str:
     """Derive an overall confidence_level from how decisive the probabilities are.
 
     Findings present → confidence tracks the strongest finding. No findings →
@@ -155,19 +493,20 @@ def _confidence(probs: dict[str, float], threshold: float) -> str:
     """
     if not probs:
         return "Low"
-    top = max(probs.values())
-    flagged = [p for p in probs.values() if p >= threshold]
+    flagged = [p for name, p in probs.items() if p >= bands.cutoff(name)]
     if flagged:
         strongest = max(flagged)
-        if strongest >= 0.85:
+        medium, high = bands.finding_confidence
+        if strongest >= high:
             return "High"
-        if strongest >= 0.65:
+        if strongest >= medium:
             return "Medium"
         return "Low"
     # Clean negative read: penalise borderline probabilities near the threshold.
-    if top < threshold - 0.15:
+    medium, high = bands.negative_margin
+    if all(p < bands.cutoff(name) - high for name, p in probs.items()):
         return "High"
-    if top < threshold - 0.05:
+    if all(p < bands.cutoff(name) - medium for name, p in probs.items()):
         return "Medium"
     return "Low"
 
@@ -175,22 +514,25 @@ def _confidence(probs: dict[str, float], threshold: float) -> str:
 def build_report(
     probs: dict[str, float],
     is_medical: bool,
-    threshold: float = DETECTION_THRESHOLD,
+    threshold: float | None = None,
     *,
     unsupported_modality: bool = False,
+    bands: ReportBands | None = None,
 ) -> dict:
     """Template classifier probabilities into a RADIOLOGY_JSON_SCHEMA-shaped dict.
 
     ``probs`` maps pathology name → probability in [0, 1]. ``is_medical`` is the
     output of the :func:`looks_like_xray` gate. ``unsupported_modality`` marks a
     rejection where the input *is* medical but not a chest radiograph (e.g. a CT
-    slice) so the message can say so rather than "not a medical image". The
-    returned dict contains every field ``radiology_pipeline.parse_to_analysis``
-    requires.
+    slice) so the message can say so rather than "not a medical image".
+    ``threshold`` replaces the detection threshold of :func:`default_bands`
+    for every pathology; ``bands`` overrides every cut-off, ``threshold``
+    included. The returned dict contains every field
+    ``radiology_pipeline.parse_to_analysis`` requires.
     """
     if not is_medical:
         if unsupported_modality:
-            modality = "CT / cross-sectional (unsupported)"
+            modality = UNSUPPORTED_MODALITY
             impression = "Input appears to be a CT or cross-sectional scan, not a chest radiograph."
             recommendation = (
                 "The local backend supports chest X-rays only. "
@@ -211,30 +553,94 @@ def build_report(
             "recommendation": recommendation,
         }
 
+    if bands is None:
+        bands = default_bands() if threshold is None else ReportBands(threshold)
     findings = sorted(
-        ((name, p) for name, p in probs.items() if p >= threshold),
+        ((name, p) for name, p in probs.items() if p >= bands.cutoff(name)),
         key=lambda kv: kv[1],
         reverse=True,
     )
+    return _chest_report(
+        [
+            (name, f"{p:.0%}", _bucket_severity(p, bands.severity_cutoffs(name)))
+            for name, p in findings
+        ],
+        _confidence(probs, bands),
+    )
+
+
+def build_reports(probs: np.ndarray, bands: ReportBands | None = None) -> list[dict]:
+    """:func:`build_report` (``is_medical=True``) for every row of an
+    (N, len(PATHOLOGIES)) probability matrix.
+
+    Thresholding, severity bucketing, ordering and confidence are computed for
+    the whole matrix in array operations against the :func:`report_table` of
+    ``bands`` (default: :func:`default_bands`); only the final string assembly
+    runs per row. The reports equal ``build_report`` on each row's dict.
+    """
+    table = report_table(bands or default_bands())
+    probs = np.asarray(probs, dtype=np.float64).reshape(-1, len(PATHOLOGIES))
+    thresholds = table.thresholds
+    flagged = probs >= thresholds
+    # Cut-offs at or below each probability, as bisect_right counts them.
+    severity = (probs[:, :, None] >= table.severity).sum(axis=2)
+    # Flagged pathologies first, by descending probability; ties keep
+    # PATHOLOGIES order, as the stable sort in build_report does.
+    order = np.argsort(np.where(flagged, -probs, np.inf), axis=1, kind="stable")
+    counts = flagged.sum(axis=1)
+
+    strongest = np.where(flagged, probs, -np.inf).max(axis=1)
+    medium, high = table.negative_margin
+    negative = np.where(
+        (probs < thresholds - high).all(axis=1), 2,
+        np.where((probs < thresholds - medium).all(axis=1), 1, 0),
+    )
+    confidence = np.where(
+        counts > 0,
+        np.searchsorted(table.finding_confidence, strongest, side="right"),
+        negative,
+    )
 
+    # Percentages rounded as the ".0%" format rounds them (half to even).
+    percent = np.rint(probs * 100).astype(np.int64)
+    sorted_percent = np.take_along_axis(percent, order, axis=1).tolist()
+    sorted_severity = np.take_along_axis(severity, order, axis=1).tolist()
+    return [
+        _chest_report(
+            [
+                (PATHOLOGIES[j], f"{pct}%", _SEVERITIES[sev])
+                for j, pct, sev in zip(row_order[:count], row_percent, row_severity)
+            ],
+            _CONFIDENCES[conf],
+        )
+        for row_order, row_percent, row_severity, count, conf in zip(
+            order.tolist(), sorted_percent, sorted_severity, counts.tolist(), confidence.tolist()
+        )
+    ]
+
+
+_LABELS = {name: name.replace("_", " ") for name in PATHOLOGIES}
+
+
+def _chest_report(findings: list[tuple[str, str, str]], confidence: str) -> dict:
+    """Assemble the schema dict from ``(name, percentage, severity)`` findings,
+    strongest first."""
+    labels = [_LABELS.get(name) or name.replace("_", " ") for name, _, _ in findings]
     per_structure = [
         {
             "structure": _STRUCTURE.get(name, "Chest"),
-            "observation": f"{name.replace('_', ' ')} (probability {p:.0%})",
-            "severity": _bucket_severity(p),
+            "observation": f"{label} (probability {pct})",
+            "severity": severity,
         }
-        for name, p in findings
+        for label, (name, pct, severity) in zip(labels, findings)
     ]
 
-    confidence = _confidence(probs, threshold)
-
     if findings:
         # findings is sorted by probability, so findings[0] is the dominant read.
         # The CheXNet labels are correlated (one opacity often fires several), so
         # we headline the strongest and treat the rest as associated/differential.
-        (primary_name, primary_p), associated = findings[0], findings[1:]
-        primary_label = primary_name.replace("_", " ")
-        primary_sev = _bucket_severity(primary_p)
+        (_, primary_pct, primary_sev), associated = findings[0], findings[1:]
+        primary_label = labels[0]
 
         if associated:
             impression = (
@@ -242,13 +648,15 @@ def build_report(
                 f"{len(associated)} associated finding(s)."
             )
             key_findings = (
-                f"Primary: {primary_label} ({primary_p:.0%}). Associated: "
-                + ", ".join(f"{n.replace('_', ' ')} ({p:.0%})" for n, p in associated)
+                f"Primary: {primary_label} ({primary_pct}). Associated: "
+                + ", ".join(
+                    f"{label} ({pct})" for label, (_, pct, _) in zip(labels[1:], associated)
+                )
                 + "."
             )
         else:
             impression = f"{primary_label} ({primary_sev})."
-            key_findings = f"Primary: {primary_label} ({primary_p:.0%})."
+            key_findings = f"Primary: {primary_label} ({primary_pct})."
 
         severities = {f["severity"] for f in per_structure}
         if severities & {"severe", "critical"}:
@@ -275,83 +683,687 @@ def build_report(
 # ── ONNX inference ────────────────────────────────────────────────────────────
 
 
+def model_path() -> str:
+    """The ONNX file this process loads (variant or CHEXNET_ONNX_PATH)."""
+    return _ONNX_PATH
+
+
 def ensure_model_available() -> None:
     """Raise FileNotFoundError (with export instructions) if the ONNX model is
     missing. Lets the UI report the problem up front, before any image is run.
     """
     if not os.path.exists(_ONNX_PATH):
+        command = "python tools/export_onnx.py"
+        if _MODEL_VARIANT == "int8":
+            command += " --quantize dynamic"
+        elif _MODEL_VARIANT == "fused":
+            command += " --fuse"
         raise FileNotFoundError(
             f"Local CXR model not found at {_ONNX_PATH}. Generate it once with:\n"
             "    pip install -r requirements-export.txt\n"
-            "    python tools/export_onnx.py"
+            f"    {command}"
         )
 
 
-def _load_session():
-    """Lazily create the onnxruntime session (single CPU thread is plenty)."""
-    global _session
-    if _session is None:
-        if not os.path.exists(_ONNX_PATH):
-            raise FileNotFoundError(
-                f"Local CXR model not found at {_ONNX_PATH}. Generate it once with:\n"
-                "    pip install -r requirements-export.txt\n"
-                "    python tools/export_onnx.py"
-            )
-        import onnxruntime as ort  # heavy; imported only when actually inferring
+def _choice(table: dict[str, str], value: str, variable: str) -> str:
+    if value not in table:
+        raise ValueError(f"{variable} must be one of {sorted(table)}, got {value!r}")
+    return table[value]
+
+
+def _session_options(ort, intra_op_threads: int | None = None):
+    """Build SessionOptions from the CHEXNET_* tunables. ValueError for an
+    unknown execution mode or optimisation level."""
+    opts = ort.SessionOptions()
+    opts.intra_op_num_threads = (
+        _INTRA_OP_THREADS if intra_op_threads is None else intra_op_threads
+    )
+    opts.inter_op_num_threads = _INTER_OP_THREADS
+    opts.execution_mode = getattr(
+        ort.ExecutionMode,
+        _choice(_EXECUTION_MODES, _EXECUTION_MODE, "CHEXNET_EXECUTION_MODE"),
+    )
+    opts.graph_optimization_level = getattr(
+        ort.GraphOptimizationLevel,
+        _choice(_GRAPH_OPT_LEVELS, _GRAPH_OPT_LEVEL, "CHEXNET_GRAPH_OPT_LEVEL"),
+    )
+    opts.enable_cpu_mem_arena = _CPU_MEM_ARENA
+    opts.enable_mem_pattern = _MEM_PATTERN
+    return opts
+
+
+def _optimized_model_path(ort) -> str | None:
+    """Where the optimised graph for the current model is cached, or None.
 
-        opts = ort.SessionOptions()
-        opts.intra_op_num_threads = 1  # weak CPUs: avoid oversubscription
-        _session = ort.InferenceSession(
-            _ONNX_PATH, sess_options=opts, providers=["CPUExecutionProvider"]
+    The filename hashes everything the optimised graph depends on — the source
+    model identity, the optimisation level, the onnxruntime version and the CPU
+    architecture (level "all" emits hardware-specific fused kernels) — so a
+    re-export, a config change or an upgrade never loads a stale graph.
+    """
+    if not _OPTIMIZED_MODEL_DIR:
+        return None
+    h = hashlib.blake2b(digest_size=12)
+    h.update(
+        f"{_model_identity()}:{_GRAPH_OPT_LEVEL}:{ort.__version__}:{platform.machine()}".encode()
+    )
+    stem = os.path.splitext(os.path.basename(_ONNX_PATH))[0]
+    return os.path.join(_OPTIMIZED_MODEL_DIR, f"{stem}.{h.hexdigest()}.opt.onnx")
+
+
+def _create_session(intra_op_threads: int | None = None):
+    """Create an onnxruntime session, reusing the cached optimised graph when
+    ``CHEXNET_OPTIMIZED_MODEL_DIR`` has one."""
+    ensure_model_available()
+    import onnxruntime as ort  # heavy; imported only when actually inferring
+
+    opts = _session_options(ort, intra_op_threads)
+    cached = _optimized_model_path(ort)
+    if cached and os.path.exists(cached):
+        # Already optimised offline: loading it as-is is what saves the time.
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        return ort.InferenceSession(
+            cached, sess_options=opts, providers=["CPUExecutionProvider"]
         )
-    return _session
 
+    tmp = None
+    if cached:
+        os.makedirs(_OPTIMIZED_MODEL_DIR, exist_ok=True)
+        # onnxruntime writes the file during construction; write to a unique
+        # name and rename so a concurrent cold start never reads it half-done.
+        tmp = f"{cached}.{os.getpid()}.{threading.get_ident()}.tmp"
+        opts.optimized_model_filepath = tmp
+    session = ort.InferenceSession(
+        _ONNX_PATH, sess_options=opts, providers=["CPUExecutionProvider"]
+    )
+    if tmp and os.path.exists(tmp):
+        os.replace(tmp, cached)
+    return session
+
+
+class GraphLayout(NamedTuple):
+    """What the loaded graph expects and returns, from its model metadata."""
+
+    uint8_input: bool      # takes raw 224×224 pixels and normalises in-graph
+    probabilities: bool    # ends in a Sigmoid, so outputs need no conversion
+
+
+def _graph_layout(session) -> GraphLayout:
+    """Read ``session``'s :class:`GraphLayout` from the model metadata that
+    tools/export_onnx.py stamps on a fused graph."""
+    meta = session.get_modelmeta().custom_metadata_map
+    return GraphLayout(
+        uint8_input=meta.get(_META_INPUT) == "uint8",
+        probabilities=meta.get(_META_OUTPUT) == "probabilities",
+    )
+
+
+class SessionPool:
+    """Bounded, lazily-filled pool of onnxruntime sessions.
+
+    One session pinned to ``CHEXNET_INTRA_OP_THREADS`` threads serialises every
+    request on a multi-core node. The pool holds up to ``size`` sessions, each
+    with its own thread settings, and lends one per :meth:`session` block::
+
+        with get_session_pool().session() as session:
+            session.run(None, feeds)
 
-def _preprocess(image: Image.Image) -> np.ndarray:
+    Sessions are created on first demand, never more than ``size`` of them,
+    and a caller that finds them all busy waits for one to be returned. Idle
+    sessions are handed out most-recently-used first, so a lightly loaded
+    server keeps reusing one warm session. If creating a session fails, its
+    slot is freed again and the error goes to the caller that tried.
+    """
+
+    def __init__(self, size: int = 1, factory: Callable[[], object] | None = None):
+        self.size = max(1, size)
+        self._factory = factory or _create_session
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._buffers: dict[int, IOBuffers] = {}
+
+    @cached_property
+    def layout(self) -> GraphLayout:
+        """The pooled graph's :class:`GraphLayout`, read once from a session."""
+        with self.session() as session:
+            return _graph_layout(session)
+
+    @cached_property
+    def model_identity(self) -> str:
+        """:func:`_model_identity` of the model file, read once per pool: the
+        pooled sessions keep running the weights they loaded, so the logit-cache
+        key must not change under them if the file is replaced."""
+        return _model_identity()
+
+    @contextlib.contextmanager
+    def session(self):
+        """Borrow a session for the duration of the ``with`` block."""
+        session = self._checkout()
+        try:
+            yield session
+        finally:
+            self._idle.put(session)
+
+    def buffers(self, session, count: int) -> IOBuffers:
+        """The :class:`IOBuffers` of a borrowed ``session``, grown to hold at
+        least ``count`` images. Only the borrower touches them, so they need no
+        lock of their own."""
+        buffers = self._buffers.get(id(session))
+        if buffers is None or buffers.capacity < count:
+            buffers = self._buffers[id(session)] = IOBuffers(session, count)
+        return buffers
+
+    def warm(self, fn: Callable[[object], None]) -> None:
+        """Create every session in the pool and call ``fn(session)`` on each."""
+        with contextlib.ExitStack() as stack:
+            for session in [stack.enter_context(self.session()) for _ in range(self.size)]:
+                fn(session)
+
+    def _checkout(self):
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    return self._factory()
+                except BaseException:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            try:
+                return self._idle.get(timeout=0.1)
+            except queue.Empty:
+                continue  # re-check: a failed creation may have freed a slot
+
+
+def _pool_size() -> int:
+    if _SESSION_POOL_SIZE == "auto":
+        return max(1, (os.cpu_count() or 1) // max(1, _INTRA_OP_THREADS))
+    return max(1, int(_SESSION_POOL_SIZE))
+
+
+def get_session_pool() -> SessionPool:
+    """The process-wide :class:`SessionPool`, created on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = SessionPool(_pool_size())
+    return _pool
+
+
+def _preprocess(image: Image.Image | ImagePyramid) -> np.ndarray:
     """Replicate TorchXRayVision preprocessing: greyscale, centre-cropped to a
     square, resized to 224×224, normalised to the [-1024, 1024] range xrv uses.
-    Returns a (1, 1, 224, 224) float32 array.
+    Returns a (1, 1, 224, 224) float32 array. The crop/resize comes from the
+    image's :class:`ImagePyramid`.
+    """
+    return _normalise(_as_pyramid(image).model_view)[None, None]
+
+
+def _normalise(pixels: np.ndarray, out: np.ndarray | None = None) -> np.ndarray:
+    """uint8 model pixels → float32 model input of the same shape, written into
+    ``out`` when given."""
+    arr = np.divide(pixels, np.float32(255.0), out=out, dtype=np.float32)  # [0, 1]
+    arr *= 2.0                                         # xrv normalize → [-1024, 1024]
+    arr -= 1.0
+    arr *= 1024.0
+    return arr
+
+
+def _to_probabilities(raw: np.ndarray, layout: GraphLayout) -> np.ndarray:
+    """Map an (N, 18) model output to probabilities.
+
+    The plain export returns raw per-pathology logits (op_threshs is disabled
+    at export time — see tools/export_onnx.py), so apply the sigmoid here. A
+    fused graph already ends in a Sigmoid; its output is returned as is.
+    """
+    raw = np.asarray(raw, dtype=np.float32)
+    return raw if layout.probabilities else 1.0 / (1.0 + np.exp(-raw))
+
+
+def _aligned_empty(shape: tuple[int, ...], dtype, alignment: int = 64) -> np.ndarray:
+    """``np.empty`` whose data starts on an ``alignment``-byte boundary (a cache
+    line, and what onnxruntime's own CPU allocator uses)."""
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    block = np.empty(nbytes + alignment, dtype=np.uint8)
+    offset = -block.ctypes.data % alignment
+    return block[offset:offset + nbytes].view(dtype).reshape(shape)
+
+
+class IOBuffers:
+    """Preallocated input/output arrays of one session, bound through IOBinding.
+
+    A plain ``session.run`` allocates a fresh input batch, a normalised copy of
+    it and the output array on every call. Here each session owns one aligned
+    (capacity, 1, 224, 224) input buffer — uint8 for a fused graph, float32
+    otherwise — and one (capacity, 18) output buffer. Model views are written
+    (and normalised) straight into the input rows, and one IOBinding per batch
+    size binds the leading rows of both buffers, so steady-state inference
+    allocates nothing per image. Obtain them with :meth:`SessionPool.buffers`.
     """
-    gray = image.convert("L")
-    w, h = gray.size
-    side = min(w, h)
-    left, top = (w - side) // 2, (h - side) // 2
-    gray = gray.crop((left, top, left + side, top + side)).resize((224, 224))
 
-    arr = np.asarray(gray, dtype=np.float32)          # [0, 255]
-    arr = (2.0 * (arr / 255.0) - 1.0) * 1024.0         # xrv normalize → [-1024, 1024]
-    return arr[None, None, :, :]                       # (1, 1, 224, 224)
+    def __init__(self, session, capacity: int):
+        self.capacity = capacity
+        self.uint8_input = _graph_layout(session).uint8_input
+        self.inputs = _aligned_empty(
+            (capacity, 1, _MODEL_SIDE, _MODEL_SIDE),
+            np.uint8 if self.uint8_input else np.float32,
+        )
+        self.outputs = _aligned_empty((capacity, len(PATHOLOGIES)), np.float32)
+        self._input_name = session.get_inputs()[0].name
+        self._bindings: dict[int, object] = {}
+
+    def write(self, row: int, view: np.ndarray) -> None:
+        """Copy a (224, 224) uint8 model view into input row ``row``."""
+        if self.uint8_input:
+            self.inputs[row, 0] = view
+        else:
+            _normalise(view, out=self.inputs[row, 0])
+
+    def run(self, session, count: int) -> np.ndarray:
+        """Run the first ``count`` input rows. Returns a view of the output
+        buffer, valid until ``session`` is next run."""
+        if not hasattr(session, "io_binding"):  # a session stand-in without IOBinding
+            out = session.run(None, {self._input_name: self.inputs[:count]})[0]
+            self.outputs[:count] = np.reshape(out, (count, -1))
+        else:
+            session.run_with_iobinding(self._binding(session, count))
+        return self.outputs[:count]
+
+    def _binding(self, session, count: int):
+        binding = self._bindings.get(count)
+        if binding is None:
+            from onnxruntime import OrtValue
 
+            # OrtValues over CPU numpy memory share it: the graph reads the
+            # input rows and writes the output rows in place.
+            binding = session.io_binding()
+            binding.bind_ortvalue_input(
+                self._input_name, OrtValue.ortvalue_from_numpy(self.inputs[:count])
+            )
+            binding.bind_ortvalue_output(
+                session.get_outputs()[0].name,
+                OrtValue.ortvalue_from_numpy(self.outputs[:count]),
+            )
+            self._bindings[count] = binding
+        return binding
+
+
+def _run_bound(pool: SessionPool, session, views: Sequence[np.ndarray]) -> np.ndarray:
+    """Run ``views`` on a borrowed ``session`` through its :class:`IOBuffers`."""
+    buffers = pool.buffers(session, len(views))
+    for row, view in enumerate(views):
+        buffers.write(row, view)
+    return buffers.run(session, len(views))
+
+
+def _run_session(views: Sequence[np.ndarray]) -> np.ndarray:
+    """Push (224, 224) uint8 model views through a pooled session in one run()
+    call and return a copy of the (N, len(PATHOLOGIES)) raw output."""
+    pool = get_session_pool()
+    with pool.session() as session:
+        return _run_bound(pool, session, views).copy()
+
+
+# ── Logit cache ───────────────────────────────────────────────────────────────
 
-def predict_probabilities(image: Image.Image) -> dict[str, float]:
-    """Run the ONNX classifier and return {pathology: probability}."""
-    session = _load_session()
-    inp = _preprocess(image)
-    input_name = session.get_inputs()[0].name
-    logits = np.asarray(session.run(None, {input_name: inp})[0]).ravel()
 
-    # The exported model returns raw per-pathology logits (op_threshs is disabled
-    # at export time — see tools/export_onnx.py), so apply the sigmoid here to get
-    # probabilities. The guard also covers a model that already applied sigmoid:
-    # if everything is already in [0, 1], leave it untouched.
-    if logits.min() < 0.0 or logits.max() > 1.0:
-        logits = 1.0 / (1.0 + np.exp(-logits))
+def _get_cache() -> ResultCache | None:
+    """Return the process-wide logit cache, or None when caching is disabled."""
+    global _cache
+    if _cache is None:
+        if _CACHE_SIZE <= 0 and not _CACHE_DIR:
+            _cache = False
+        else:
+            _cache = ResultCache(
+                max_entries=_CACHE_SIZE,
+                directory=_CACHE_DIR,
+                max_bytes=int(_CACHE_MAX_MB * 1024 * 1024),
+            )
+    return _cache if _cache is not False else None
+
+
+def _model_identity() -> str:
+    """Path + size + mtime of the model file: replacing or re-exporting the model
+    changes the identity, so stale logits can never be served."""
+    ensure_model_available()
+    st = os.stat(_ONNX_PATH)
+    return f"{os.path.abspath(_ONNX_PATH)}:{st.st_size}:{st.st_mtime_ns}"
 
-    return {name: float(p) for name, p in zip(PATHOLOGIES, logits)}
+
+def cache_key(image: ModelInput) -> str | None:
+    """Logit-cache key for ``image``, or None when caching is disabled. Cheap to
+    compute in a worker ahead of :func:`predict_model_views`."""
+    return _cache_key(image) if _get_cache() is not None else None
+
+
+def _cache_key(image: ModelInput) -> str:
+    """Digest of the 224×224 model view (the only pixels the model sees) plus
+    the identity of the pooled model.
+
+    The detection threshold and the report template are deliberately *not* part
+    of the key: the cache stores raw model outputs, which neither affects, so
+    tuning ``CHEXNET_THRESHOLD`` / ``CHEXNET_THRESHOLDS`` or editing
+    :func:`build_report` keeps every entry valid.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(_model_view(image).tobytes())
+    h.update(get_session_pool().model_identity.encode())
+    return h.hexdigest()
+
+
+def predict_probabilities(image: ModelInput) -> dict[str, float]:
+    """Run the ONNX classifier on an image, its :class:`ImagePyramid` or its
+    prepared 224×224 model view and return {pathology: probability}.
+
+    With ``CHEXNET_MICROBATCH=1`` the request is routed through the process-wide
+    :class:`MicroBatcher`, so concurrent callers share ``session.run`` calls.
+    """
+    if _MICROBATCH:
+        return get_scheduler().submit(image)
+    return predict_probabilities_batch([image])[0]
+
+
+def predict_probabilities_batch(
+    images: Sequence[ModelInput], batch_size: int = BATCH_SIZE
+) -> list[dict[str, float]]:
+    """Batched :func:`predict_probabilities`: one ``session.run`` per
+    ``batch_size`` images instead of one per image. Results are returned in
+    input order.
+
+    Raw outputs are looked up in the logit cache (keyed by the model view)
+    first; only the misses are run, and their outputs are cached for next time.
+    """
+    views = [_model_view(image) for image in images]
+    keys = [_cache_key(view) for view in views] if _get_cache() is not None else None
+    return _predict(len(views), keys, lambda i: views[i], batch_size)
+
+
+def predict_model_views(
+    views: Sequence[np.ndarray],
+    keys: Sequence[str | None] | None = None,
+    batch_size: int = BATCH_SIZE,
+) -> list[dict[str, float]]:
+    """Classify already-prepared 224×224 uint8 model views
+    (:attr:`ImagePyramid.model_view`), e.g. built in a worker pool. ``keys``
+    from :func:`cache_key` enable the logit cache; without them every view runs.
+    """
+    return probability_dicts(predict_model_views_raw(views, keys, batch_size))
+
+
+def predict_model_views_raw(
+    views: Sequence[np.ndarray],
+    keys: Sequence[str | None] | None = None,
+    batch_size: int = BATCH_SIZE,
+) -> np.ndarray:
+    """:func:`predict_model_views`, but return the (N, len(PATHOLOGIES)) raw
+    model output — logits or probabilities, per :func:`raw_output_kind` — for
+    callers that keep it, e.g. a :class:`logit_store.LogitStore`."""
+    if keys is not None and any(key is None for key in keys):
+        keys = None
+    return _predict_raw(len(views), keys, lambda i: views[i], batch_size)
+
+
+def probability_matrix(raw: np.ndarray) -> np.ndarray:
+    """A raw model output as an (N, len(PATHOLOGIES)) probability matrix, the
+    input :func:`build_reports` takes."""
+    if len(raw) == 0:
+        return np.empty((0, len(PATHOLOGIES)), dtype=np.float32)
+    return _to_probabilities(raw, get_session_pool().layout)
+
+
+def probability_dicts(raw: np.ndarray) -> list[dict[str, float]]:
+    """{pathology: probability} for each row of a raw model output."""
+    return [
+        {name: float(p) for name, p in zip(PATHOLOGIES, row)}
+        for row in probability_matrix(raw).tolist()
+    ]
+
+
+def raw_output_kind() -> str:
+    """What the loaded graph's raw output holds: ``"probabilities"`` for a
+    fused graph, else ``"logits"``."""
+    return "probabilities" if get_session_pool().layout.probabilities else "logits"
+
+
+def _predict(
+    count: int,
+    keys: Sequence[str] | None,
+    model_view: Callable[[int], np.ndarray],
+    batch_size: int,
+) -> list[dict[str, float]]:
+    return probability_dicts(_predict_raw(count, keys, model_view, batch_size))
+
+
+def _predict_raw(
+    count: int,
+    keys: Sequence[str] | None,
+    model_view: Callable[[int], np.ndarray],
+    batch_size: int,
+) -> np.ndarray:
+    """Shared batched inference: cache lookups by ``keys`` (None = no caching),
+    then ``model_view(i)`` for each miss, ``batch_size`` per session.run."""
+    cache = _get_cache() if keys is not None else None
+    raw = np.empty((count, len(PATHOLOGIES)), dtype=np.float32)
+    misses = list(range(count))
+    if cache is not None:
+        misses = []
+        for i, key in enumerate(keys):
+            hit = cache.get(key)
+            if hit is not None:
+                raw[i] = np.frombuffer(hit, dtype=np.float32)
+            else:
+                misses.append(i)
+
+    for start in range(0, len(misses), batch_size):
+        chunk = misses[start:start + batch_size]
+        raw[chunk] = _run_session([model_view(i) for i in chunk])
+        if cache is not None:
+            for i in chunk:
+                cache.put(keys[i], raw[i].tobytes())
+    return raw
+
+
+# ── Micro-batching scheduler ──────────────────────────────────────────────────
+
+
+class MicroBatcher:
+    """Coalesce concurrent single-image requests into batched inference.
+
+    Every Streamlit session runs ``pipeline.run`` on its own thread, so without
+    this they queue on the one onnxruntime session one image at a time. Callers
+    :meth:`submit` an image and block until its probabilities are ready; a
+    single background thread drains the queue and flushes a batch when it
+    reaches ``max_batch_size`` or ``max_wait_ms`` has passed since the batch
+    was opened.
+
+    The wait window only opens under observed concurrency — when another
+    request is already queued behind the first one. A lone request is flushed
+    immediately and pays no batching delay; under load, requests that arrive
+    while a batch is running accumulate and go out together in the next one.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = _MICROBATCH_MAX_SIZE,
+        max_wait_ms: float = _MICROBATCH_MAX_WAIT_MS,
+        run_batch: Callable[[list[Image.Image]], list[dict[str, float]]] | None = None,
+    ):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        # Late-bound by default so the module-level batch function (and any
+        # monkeypatch of it) is looked up at flush time.
+        self._run_batch = run_batch
+        self._queue: queue.Queue[tuple[Image.Image, Future]] = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def submit(self, image: Image.Image) -> dict[str, float]:
+        """Queue ``image`` for the next batch and block until its result is in."""
+        future: Future = Future()
+        self._queue.put((image, future))
+        self._ensure_worker()
+        return future.result()
+
+    def _ensure_worker(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._worker, name="chexnet-microbatch", daemon=True
+                )
+                self._thread.start()
+
+    def _collect(self) -> list[tuple[Image.Image, Future]]:
+        batch = [self._queue.get()]
+        if self._queue.empty():
+            return batch  # lone request: flush now rather than wait for company
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=max(remaining, 0.0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self) -> None:
+        while True:
+            batch = self._collect()
+            run_batch = self._run_batch or predict_probabilities_batch
+            try:
+                results = run_batch([image for image, _ in batch])
+            except BaseException as e:  # noqa: BLE001 — re-raised in each caller
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+def get_scheduler() -> MicroBatcher:
+    """Return the process-wide :class:`MicroBatcher`, creating it on first use."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = MicroBatcher()
+    return _scheduler
+
+
+def enable_microbatching(
+    max_batch_size: int = _MICROBATCH_MAX_SIZE,
+    max_wait_ms: float = _MICROBATCH_MAX_WAIT_MS,
+) -> MicroBatcher:
+    """Route :func:`predict_probabilities` through a process-wide
+    :class:`MicroBatcher` with the given limits — the programmatic equivalent of
+    ``CHEXNET_MICROBATCH=1`` for callers such as the batch CLI."""
+    global _MICROBATCH, _scheduler
+    with _scheduler_lock:
+        _scheduler = MicroBatcher(max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        _MICROBATCH = True
+    return _scheduler
+
+
+# ── Warm-up ───────────────────────────────────────────────────────────────────
+
+
+def warm_up() -> float:
+    """Create every pooled session and push one mid-grey image through each, so
+    the first real requests pay neither the model load, onnxruntime's first-run
+    kernel initialisation nor the allocation of the session's
+    :class:`IOBuffers`. Bypasses the logit cache. Returns the seconds it took."""
+    start = time.perf_counter()
+    view = np.full((_MODEL_SIDE, _MODEL_SIDE), 128, np.uint8)
+    pool = get_session_pool()
+    pool.warm(lambda session: _run_bound(pool, session, [view]))
+    return time.perf_counter() - start
+
+
+def start_warm_up(retry: bool = False) -> Future:
+    """Run :func:`warm_up` once per process on a daemon thread and return its
+    Future: the warm-up time, or the exception (e.g. FileNotFoundError for a
+    missing model). Later calls return the same Future, a failed one included,
+    so polling callers do not respawn the thread; pass ``retry=True`` to start
+    again after a failure."""
+    global _warm_up
+    with _warm_up_lock:
+        failed = _warm_up is not None and _warm_up.done() and _warm_up.exception()
+        if _warm_up is None or (failed and retry):
+            future: Future = Future()
+
+            def run() -> None:
+                try:
+                    ensure_model_available()
+                    future.set_result(warm_up())
+                except Exception as e:  # noqa: BLE001 — surfaced via the Future
+                    future.set_exception(e)
+
+            threading.Thread(target=run, name="chexnet-warm-up", daemon=True).start()
+            _warm_up = future
+        return _warm_up
 
 
 # ── Pipeline entry point ──────────────────────────────────────────────────────
 
 
-def local_model_fn(image: Image.Image, prompt: str) -> str:
-    """model_fn for VLMGuardPipeline: (image, prompt) → schema JSON string.
+def gate_report(image: Image.Image | ImagePyramid) -> dict | None:
+    """Run the modality gates; return the rejection report, or None if the image
+    should go on to the classifier."""
+    if not looks_like_xray(image):
+        return build_report({}, is_medical=False)
+    if looks_like_ct_slice(image):
+        return build_report({}, is_medical=False, unsupported_modality=True)
+    return None
+
+
+def local_model_fn_structured(image: Image.Image, prompt: str) -> dict:
+    """model_fn for VLMGuardPipeline: (image, prompt) → schema report dict.
 
     ``prompt`` is ignored — the classifier needs no instructions — but kept in
     the signature to match the Gemini backend so the two are interchangeable.
+    The image is decoded into one :class:`ImagePyramid` shared by the gates and
+    the classifier. :func:`radiology_pipeline.parse_raw` takes the dict as is,
+    skipping the JSON round trip a string would cost.
     """
-    if not looks_like_xray(image):
-        return json.dumps(build_report({}, is_medical=False))
-    if looks_like_ct_slice(image):
-        return json.dumps(build_report({}, is_medical=False, unsupported_modality=True))
-    probs = predict_probabilities(image)
-    return json.dumps(build_report(probs, is_medical=True))
+    pyramid = ImagePyramid(image)
+    with span("gates"):
+        rejected = gate_report(pyramid)
+    if rejected is not None:
+        return rejected
+    with span("preprocess"):
+        model_input = pyramid.model_view
+    with span("inference"):
+        probs = predict_probabilities(model_input)
+    with span("template"):
+        return build_report(probs, is_medical=True)
+
+
+def local_model_fn(image: Image.Image, prompt: str) -> str:
+    """:func:`local_model_fn_structured` as a schema JSON string, for callers
+    that need Gemini's exact string contract."""
+    return json.dumps(local_model_fn_structured(image, prompt))
+
+
+def local_model_fn_batch(images: Sequence[Image.Image], prompt: str) -> list[str]:
+    """Batched :func:`local_model_fn`: gate each image, then classify every image
+    that passed in as few ``session.run`` calls as possible. Returns one schema
+    JSON string per input image, in input order.
+    """
+    pyramids = [ImagePyramid(image) for image in images]
+    reports: list[dict | None] = [gate_report(p) for p in pyramids]
+    pending = [i for i, report in enumerate(reports) if report is None]
+    keys = [_cache_key(pyramids[i]) for i in pending] if _get_cache() is not None else None
+    raw = _predict_raw(len(pending), keys, lambda j: pyramids[pending[j]].model_view, BATCH_SIZE)
+    for i, report in zip(pending, build_reports(probability_matrix(raw))):
+        reports[i] = report
+    return [json.dumps(report) for report in reports]
@@ -0,0 +1,261 @@
+"""Append-only store of raw per-image model outputs, and re-templating from it.
+
+Every cut-off that turns a probability into a report — ``CHEXNET_THRESHOLD``,
+the severity buckets and the confidence bands (:class:`local_backend.ReportBands`)
+— is applied after inference. A batch run with ``--logit-store`` keeps each
+classified image's raw output row, so trying new cut-offs on an archive means
+re-templating from the store instead of re-running the model over every film::
+
+    python batch_report.py /data/pacs_export -o reports.jsonl --logit-store archive.logits
+    python logit_store.py archive.logits -o retemplated.jsonl --threshold 0.35
+    python logit_store.py archive.logits -o strict.jsonl --severity 0.65 0.8 0.95
+    python logit_store.py archive.logits -o calibrated.jsonl --thresholds thresholds.json
+
+Re-templating reads the rows through a memory map, converts them to
+probabilities and templates a whole chunk at a time with
+:func:`local_backend.build_reports`; the guardrail engine then runs on each
+report exactly as in the live pipeline. Each output record has the same
+``path`` / ``status`` / ``analysis`` / ``audit`` fields as ``batch_report.py``.
+
+A store is a directory:
+
+* ``outputs.f32`` — N × len(PATHOLOGIES) float32 rows, appended in order
+* ``index.jsonl`` — one ``{"path": ...}`` line per row
+* ``meta.json`` — pathology order, what the rows hold (``"logits"``, or
+  ``"probabilities"`` from a fused graph) and the identity of the model
+
+A row is written before its index line, so an interrupted run leaves at most a
+torn tail, which is trimmed when the store is next opened. A path is stored at
+most once: ``batch_report.py --resume`` may classify an image again whose
+output record was lost, and its second row is dropped. Only images that
+reached the classifier are stored: gate rejections depend on no cut-off.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+import local_backend as lb
+from batch_report import _ANALYSIS_FIELDS
+from radiology_pipeline import engine, parse_to_analysis
+
+_ROWS = "outputs.f32"
+_INDEX = "index.jsonl"
+_META = "meta.json"
+
+# Rows templated per build_reports call: bounds memory on very large stores.
+_CHUNK = 4096
+
+
+class LogitStore:
+    """Raw model outputs of many images, appended one row at a time.
+
+    Open an existing store with ``LogitStore(directory)``; start or continue
+    one for writing with :meth:`create`. Appends are thread-safe.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        meta_path = os.path.join(directory, _META)
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"No logit store at {directory} (missing {_META}).")
+        with open(meta_path, encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta["pathologies"] != lb.PATHOLOGIES:
+            raise ValueError(f"{directory} was written with a different pathology order.")
+        self._width = len(self.meta["pathologies"])
+        self._paths = self._recover()
+        self._held = set(self._paths)
+        self._lock = threading.Lock()
+        self._rows = open(os.path.join(directory, _ROWS), "ab")
+        self._index = open(os.path.join(directory, _INDEX), "a", encoding="utf-8")
+
+    @classmethod
+    def create(
+        cls, directory: str, outputs: str, model: str, append: bool = False
+    ) -> LogitStore:
+        """Start an empty store at ``directory`` — or, with ``append``, continue
+        one written by the same ``model`` with the same ``outputs`` kind.
+        ValueError if an existing store does not match."""
+        os.makedirs(directory, exist_ok=True)
+        meta = {"pathologies": lb.PATHOLOGIES, "outputs": outputs, "model": model}
+        meta_path = os.path.join(directory, _META)
+        if append and os.path.exists(meta_path):
+            store = cls(directory)
+            if (store.meta["outputs"], store.meta["model"]) != (outputs, model):
+                store.close()
+                raise ValueError(
+                    f"{directory} holds {store.meta['outputs']} of {store.meta['model']}; "
+                    f"cannot append {outputs} of {model}."
+                )
+            return store
+        for name in (_ROWS, _INDEX):
+            open(os.path.join(directory, name), "wb").close()
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        return cls(directory)
+
+    def _recover(self) -> list[str]:
+        """Read the index, trimming a torn tail left by an interrupted run."""
+        rows_path = os.path.join(self.directory, _ROWS)
+        index_path = os.path.join(self.directory, _INDEX)
+        paths, offsets, end = [], [], 0
+        with open(index_path, "rb") as f:
+            for line in f:
+                try:
+                    paths.append(json.loads(line)["path"])
+                except (json.JSONDecodeError, KeyError):
+                    break
+                end += len(line)
+                offsets.append(end)
+        row_bytes = 4 * self._width
+        count = min(len(paths), os.path.getsize(rows_path) // row_bytes)
+        del paths[count:]
+        index_bytes = offsets[count - 1] if count else 0
+        if os.path.getsize(index_path) != index_bytes:
+            os.truncate(index_path, index_bytes)
+        if os.path.getsize(rows_path) != count * row_bytes:
+            os.truncate(rows_path, count * row_bytes)
+        return paths
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    @property
+    def paths(self) -> list[str]:
+        return self._paths
+
+    def append(self, path: str, row: np.ndarray) -> None:
+        """Store one image's raw output row; a path already stored is ignored."""
+        data = np.asarray(row, dtype=np.float32).reshape(self._width).tobytes()
+        with self._lock:
+            if path in self._held:
+                return
+            self._held.add(path)
+            self._rows.write(data)
+            self._rows.flush()
+            self._index.write(json.dumps({"path": path}) + "\n")
+            self._index.flush()
+            self._paths.append(path)
+
+    def matrix(self) -> np.ndarray:
+        """All rows as a read-only (N, len(PATHOLOGIES)) memory map."""
+        if not self._paths:
+            return np.empty((0, self._width), dtype=np.float32)
+        return np.memmap(
+            os.path.join(self.directory, _ROWS), dtype=np.float32, mode="r",
+            shape=(len(self._paths), self._width),
+        )
+
+    def probabilities(self, start: int = 0, stop: int | None = None) -> np.ndarray:
+        """Rows ``start:stop`` as probabilities."""
+        layout = lb.GraphLayout(
+            uint8_input=False, probabilities=self.meta["outputs"] == "probabilities"
+        )
+        return lb._to_probabilities(self.matrix()[start:stop], layout)
+
+    def close(self) -> None:
+        self._rows.close()
+        self._index.close()
+
+    def __enter__(self) -> LogitStore:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+# ── Re-templating ─────────────────────────────────────────────────────────────
+
+
+def retemplate(
+    store: LogitStore,
+    out,
+    bands: lb.ReportBands | None = None,
+    guardrail_engine=None,
+    context: dict | None = None,
+) -> dict[str, int]:
+    """Re-template every stored row under ``bands`` and run the guardrails,
+    writing one JSONL record per row to the text stream ``out``. Returns
+    per-status counts."""
+    guardrail_engine = guardrail_engine or engine
+    context = {**(context or {"scan_type": "radiology"}), "image_enhanced": True}
+    include = set(_ANALYSIS_FIELDS)
+    counts: dict[str, int] = {}
+    for start in range(0, len(store), _CHUNK):
+        reports = lb.build_reports(store.probabilities(start, start + _CHUNK), bands)
+        lines = []
+        for path, report in zip(store.paths[start:start + _CHUNK], reports):
+            final, audit = guardrail_engine.apply_with_audit(parse_to_analysis(report), context)
+            status = "ok" if final.confidence != "Low" else "low_confidence"
+            counts[status] = counts.get(status, 0) + 1
+            lines.append(json.dumps({
+                "path": path,
+                "status": status,
+                "analysis": final.model_dump(include=include),
+                "audit": audit.summary(),
+            }, ensure_ascii=False) + "\n")
+        out.writelines(lines)
+    return counts
+
+
+def _parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Re-template stored model outputs under new cut-offs, streaming JSONL. "
+        "Cut-offs not given keep the backend defaults (CHEXNET_THRESHOLD(S)).",
+    )
+    parser.add_argument("store", help="logit store directory (batch_report.py --logit-store)")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file to write")
+    thresholds = parser.add_mutually_exclusive_group()
+    thresholds.add_argument(
+        "--threshold", type=float, help="one detection threshold for every pathology",
+    )
+    thresholds.add_argument(
+        "--thresholds", metavar="JSON",
+        help="per-pathology threshold / severity table (tools/calibrate.py)",
+    )
+    parser.add_argument(
+        "--severity", type=float, nargs=3,
+        metavar=("MODERATE", "SEVERE", "CRITICAL"), help="severity cut-offs",
+    )
+    parser.add_argument(
+        "--finding-confidence", type=float, nargs=2,
+        metavar=("MEDIUM", "HIGH"), help="strongest-finding cut-offs for Medium / High",
+    )
+    parser.add_argument(
+        "--negative-margin", type=float, nargs=2,
+        metavar=("MEDIUM", "HIGH"),
+        help="how far below its threshold every pathology of a negative read must sit",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv)
+    bands = lb.load_bands(args.thresholds) if args.thresholds else lb.default_bands()
+    overrides = {
+        "threshold": args.threshold,
+        "severity": args.severity,
+        "finding_confidence": args.finding_confidence,
+        "negative_margin": args.negative_margin,
+    }
+    bands = bands._replace(**{
+        name: value if name == "threshold" else tuple(value)
+        for name, value in overrides.items() if value is not None
+    })
+    started = time.perf_counter()
+    with LogitStore(args.store) as store, open(args.output, "w", encoding="utf-8") as out:
+        counts = retemplate(store, out, bands)
+    summary = ", ".join(f"{k}={v}" for k, v in sorted(counts.items()))
+    print(f"Re-templated in {time.perf_counter() - started:.1f}s: {summary}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
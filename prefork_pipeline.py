@@ -0,0 +1,110 @@
+"""Pre-fork worker processes for the local CXR backend, sharing one copy of the
+model weights.
+
+Python threads cannot preprocess in parallel (the GIL), and separately started
+processes each load their own onnxruntime session, so N workers cost N copies
+of the weights plus N session arenas. :class:`PreforkLocalPipeline` loads the
+session **once** in the parent and then forks its workers. Every worker
+inherits the already-initialised session, and the kernel shares its pages
+copy-on-write. onnxruntime only reads the weights during ``run``, so the pages
+stay shared, and eight workers cost little more than one model plus eight small
+per-worker heaps. ``tools/bench_prefork.py`` measures this.
+
+Each worker runs the whole per-image chain — reduced decode, enhancement,
+gates, inference, templating, guardrails — on its own core, one image at a time.
+Results are the same ``PipelineResult`` objects ``build_local_pipeline().run``
+produces, wrapped in :class:`staged_pipeline.StagedResult` and yielded in input
+order, so :func:`batch_report.run_staged` writes them unchanged.
+
+Constraints of forking a process that holds an onnxruntime session:
+
+* POSIX ``fork`` only: not Windows. On macOS, fork is unsafe once system
+  frameworks have started threads.
+* The shared session is created single-threaded (``intra_op_num_threads=1``),
+  because a forked child would not inherit an onnxruntime thread pool's
+  threads. Parallelism comes from the workers instead.
+* The parent must not run other threads that hold locks at fork time. Build
+  the pipeline before starting servers or micro-batchers.
+"""
+from __future__ import annotations
+
+import gc
+import multiprocessing
+import os
+import time
+from collections import deque
+from collections.abc import Iterable, Iterator
+
+import local_backend as lb
+from staged_pipeline import StagedResult
+
+PROMPT = "Analyze this medical image."
+
+# Set in the parent right before forking; inherited by every worker.
+_pipeline = None
+_context: dict = {}
+
+
+def _init_worker() -> None:
+    """Drop parent-only machinery the fork copied but cannot use (its threads
+    were not copied): the micro-batcher and the warm-up future."""
+    lb._MICROBATCH = False
+    lb._scheduler = None
+    lb._warm_up = None
+
+
+def _analyse(path: str) -> StagedResult:
+    start = time.perf_counter()
+    try:
+        image = lb.load_image(path)
+        decoded = time.perf_counter() - start
+        result = _pipeline.run(image, PROMPT, context=dict(_context))
+    except Exception as e:  # noqa: BLE001 — reported per image
+        return StagedResult(path, error=f"{type(e).__name__}: {e}")
+    timings = {"decode": decoded, **result.metadata.get("timings", {})}
+    result.metadata["timings"] = timings
+    result.metadata["worker_pid"] = os.getpid()
+    return StagedResult(path, result=result, timings=timings)
+
+
+class PreforkLocalPipeline:
+    """Run the local pipeline in ``workers`` forked processes that share the
+    parent's onnxruntime session copy-on-write.
+
+    ``run(paths)`` yields one :class:`staged_pipeline.StagedResult` per path,
+    in input order, keeping at most ``2 × workers`` images in flight.
+    """
+
+    def __init__(self, workers: int | None = None, context: dict | None = None):
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise RuntimeError("PreforkLocalPipeline needs the POSIX 'fork' start method.")
+        self.workers = workers or os.cpu_count() or 1
+        self.context = context or {"scan_type": "radiology"}
+
+    def run(self, paths: Iterable[str]) -> Iterator[StagedResult]:
+        global _pipeline, _context
+        from radiology_pipeline import build_local_pipeline
+
+        # One single-threaded session, loaded and warmed once in the parent.
+        previous_pool = lb._pool
+        lb._pool = lb.SessionPool(1, factory=lambda: lb._create_session(intra_op_threads=1))
+        lb.warm_up()
+        _pipeline, _context = build_local_pipeline(), self.context
+        # Move everything allocated so far out of the GC's reach, so collections
+        # in the workers do not write to (and un-share) the inherited pages.
+        gc.collect()
+        gc.freeze()
+        pool = multiprocessing.get_context("fork").Pool(self.workers, initializer=_init_worker)
+        try:
+            pending: deque = deque()
+            for path in paths:
+                if len(pending) >= 2 * self.workers:
+                    yield pending.popleft().get()
+                pending.append(pool.apply_async(_analyse, (path,)))
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+            pool.join()
+            gc.unfreeze()
+            lb._pool = previous_pool
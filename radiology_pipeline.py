@@ -1,9 +1,20 @@
 import json
+import threading
+import time
 
 from PIL import Image
-from vlm_guard import Analysis, BaseRule, GuardrailEngine, RuleResult, VLMGuardPipeline
+from vlm_guard import (
+    Analysis,
+    AuditTrail,
+    BaseRule,
+    GuardrailEngine,
+    RuleResult,
+    VLMGuardPipeline,
+)
 from vlm_guard.image.enhance import EnhancementStrategy, ImageEnhancer
 
+from stage_timing import record, span, timed
+
 # ── Schema ──────────────────────────────────────────────────────────────────
 
 RADIOLOGY_JSON_SCHEMA = {
@@ -38,6 +49,18 @@ RADIOLOGY_JSON_SCHEMA = {
     ],
 }
 
+GEMINI_MODEL_NAME = "gemini-2.0-flash"
+
+SYSTEM_INSTRUCTION = (
+    "If this is not a medical image, set is_medical_image to false "
+    "and leave per_structure_findings as an empty list."
+)
+
+GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": RADIOLOGY_JSON_SCHEMA,
+}
+
 SAFETY_SETTINGS = [
     {"category": "HARM_CATEGORY_HARASSMENT",        "threshold": "BLOCK_NONE"},
     {"category": "HARM_CATEGORY_HATE_SPEECH",        "threshold": "BLOCK_NONE"},
@@ -71,14 +94,24 @@ def parse_to_analysis(raw: dict) -> Analysis:
     )
 
 
-def parse_raw(raw: str) -> tuple[Analysis, str]:
+def parse_raw(raw: str | dict | Analysis) -> tuple[Analysis, str]:
     """Adapter matching VLMGuardPipeline's parser_fn contract.
 
-    The pipeline hands the parser the model's raw output *string* and unpacks a
-    ``(Analysis, raw_output)`` tuple (see vlm_guard.core.pipeline.run). It JSON-
-    decodes the string and delegates the dict→Analysis mapping to
+    The pipeline hands the parser the model's raw output and unpacks a
+    ``(Analysis, raw_output)`` tuple (see vlm_guard.core.pipeline.run). Gemini
+    returns a JSON *string*, which is decoded here and mapped by
     ``parse_to_analysis`` so that function stays independently unit-testable.
+
+    In-process backends can skip the decode: a schema *dict* goes straight to
+    ``parse_to_analysis``, and a prebuilt ``Analysis`` is passed through. Both
+    give the same Analysis as the string path. ``raw_output`` is still a string,
+    as ``PipelineResult`` expects, serialised from the dict (or from the
+    Analysis) instead of being parsed back from one.
     """
+    if isinstance(raw, Analysis):
+        return raw, raw.model_dump_json()
+    if isinstance(raw, dict):
+        return parse_to_analysis(raw), json.dumps(raw)
     return parse_to_analysis(json.loads(raw)), raw
 
 
@@ -146,7 +179,45 @@ class SeverityConsistencyRule(BaseRule):
 
 # ── Engine (module-level singleton) ──────────────────────────────────────────
 
-engine = GuardrailEngine()
+
+class ThreadSafeGuardrailEngine(GuardrailEngine):
+    """GuardrailEngine that can be shared by concurrent pipeline runs.
+
+    The base engine keeps a single ``self.audit`` that ``apply_with_audit``
+    clears and then returns *by reference*, so two overlapping runs (Streamlit
+    sessions, batch workers) would wipe or interleave each other's trail. Rules
+    are cheap, so runs are serialised under a lock and each caller receives its
+    own snapshot of the trail.
+
+    Each registered rule's ``condition`` and ``action`` are timed as stage
+    ``guardrails.<rule name>`` (see :mod:`stage_timing`), and the wait for the
+    lock as ``guardrails.wait``.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def register(self, rule: BaseRule):
+        stage = f"guardrails.{rule.name}"
+        rule.condition = timed(stage, rule.condition)
+        rule.action = timed(stage, rule.action)
+        super().register(rule)
+
+    def apply_with_audit(self, analysis, context=None):
+        # Time spent queued behind other runs is its own stage, so "guardrails"
+        # stays the rules' cost under load.
+        with span("guardrails.wait"):
+            self._lock.acquire()
+        try:
+            with span("guardrails"):
+                result, audit = super().apply_with_audit(analysis, context)
+                return result, AuditTrail(entries=list(audit.entries))
+        finally:
+            self._lock.release()
+
+
+engine = ThreadSafeGuardrailEngine()
 engine.register(NonMedicalImageRule())
 engine.register(LowConfidenceRule())
 engine.register(SeverityConsistencyRule())
@@ -154,25 +225,75 @@ engine.register(SeverityConsistencyRule())
 # ── Pipeline factory ──────────────────────────────────────────────────────────
 
 
-def build_pipeline(model) -> VLMGuardPipeline:
+class TimedPipeline(VLMGuardPipeline):
+    """VLMGuardPipeline that reports where each run's time went.
+
+    The enhancer, model and parser are timed as the ``enhance``, ``model`` and
+    ``parse`` stages; backends and the engine add finer spans of their own
+    (``gates``, ``inference``, ``guardrails.<rule>``, …). The seconds per stage
+    land in ``result.metadata["timings"]``, next to ``result.audit``. With
+    ``PIPELINE_TIMINGS=0`` the run is the plain ``VLMGuardPipeline.run``.
+    """
+
+    def __init__(self, *, model_fn, parser_fn, guardrail_engine, enhancer_fn=None):
+        super().__init__(
+            model_fn=timed("model", model_fn),
+            parser_fn=timed("parse", parser_fn),
+            guardrail_engine=guardrail_engine,
+            enhancer_fn=timed("enhance", enhancer_fn) if enhancer_fn else None,
+        )
+
+    def run(self, image, prompt, context=None):
+        with record() as timings:
+            result = super().run(image, prompt, context)
+        if timings is not None:
+            result.metadata["timings"] = timings
+        return result
+
+
+def build_pipeline(model, cached: bool = True) -> VLMGuardPipeline:
     """Create a VLMGuardPipeline that wraps the given Gemini model.
 
     The caller (streamlit_app.py) owns model creation and genai.configure().
     This function has no side effects on import — google.generativeai is not
     imported at module level so offline tests can import this module freely.
+    The film is downscaled and re-encoded per ``gemini_backend.DEFAULT_UPLOAD``
+    before it is sent. Unless ``cached`` is False, responses are cached per
+    :func:`gemini_backend.default_response_cache`, as in ``build_async_pipeline``.
     """
+    from gemini_backend import (
+        CACHE_BYPASS,
+        DEFAULT_UPLOAD,
+        default_response_cache,
+        encode_upload,
+        log_request,
+    )
+
+    cache = default_response_cache(model) if cached else None
+
     def gemini_model_fn(image: Image.Image, prompt: str) -> str:
+        key = None
+        if cache is not None:
+            key = cache.key(image, prompt, DEFAULT_UPLOAD)
+            text = None if CACHE_BYPASS else cache.get(key)
+            if text is not None:
+                return text
+        upload = None
+        if DEFAULT_UPLOAD is not None:
+            with span("upload_encode"):
+                upload = encode_upload(image, DEFAULT_UPLOAD)
+        started = time.monotonic()
         response = model.generate_content(
-            [prompt, image],
-            generation_config={
-                "response_mime_type": "application/json",
-                "response_schema": RADIOLOGY_JSON_SCHEMA,
-            },
+            [prompt, upload.part if upload else image],
+            generation_config=GENERATION_CONFIG,
             safety_settings=SAFETY_SETTINGS,
         )
+        log_request(upload, time.monotonic() - started)
+        if key is not None:
+            cache.put(key, response.text)
         return response.text
 
-    return VLMGuardPipeline(
+    return TimedPipeline(
         model_fn=gemini_model_fn,
         parser_fn=parse_raw,
         guardrail_engine=engine,
@@ -180,20 +301,74 @@ def build_pipeline(model) -> VLMGuardPipeline:
     )
 
 
+def build_async_pipeline(model, **client_options) -> VLMGuardPipeline:
+    """``build_pipeline``, with Gemini called through a
+    :class:`gemini_backend.AsyncGeminiClient`: bounded requests in flight, a
+    token-bucket rate limit, jittered backoff on 429/5xx and a per-study
+    deadline. Responses are cached per :func:`gemini_backend.default_response_cache`
+    unless ``client_options`` passes a ``cache`` (None disables it). The other
+    ``client_options`` also go to the client, which is reachable as
+    ``pipeline.client`` (e.g. for its ``stats``).
+    """
+    from gemini_backend import AsyncGeminiClient, default_response_cache
+
+    if "cache" not in client_options:
+        client_options["cache"] = default_response_cache(model)
+    client = AsyncGeminiClient(model, **client_options)
+    pipeline = TimedPipeline(
+        model_fn=client,
+        parser_fn=parse_raw,
+        guardrail_engine=engine,
+        enhancer_fn=ImageEnhancer(EnhancementStrategy.HIGH_CONTRAST),
+    )
+    pipeline.client = client
+    return pipeline
+
+
 def build_local_pipeline() -> VLMGuardPipeline:
     """Create a VLMGuardPipeline backed by the local ONNX chest-X-ray model.
 
     Mirrors ``build_pipeline`` but needs no API key or network: a quantised
     TorchXRayVision DenseNet runs on CPU via onnxruntime and emits the same
-    RADIOLOGY_JSON_SCHEMA JSON, so the engine, parser and enhancer are reused
-    unchanged. local_backend is imported lazily so this module stays importable
-    (and offline tests keep working) even when onnxruntime is not installed.
+    RADIOLOGY_JSON_SCHEMA report, so the engine, parser and enhancer are reused
+    unchanged. The report reaches ``parse_raw`` as a dict — there is no JSON
+    string to decode when model and parser share a process. local_backend is
+    imported lazily so this module stays importable (and offline tests keep
+    working) even when onnxruntime is not installed.
     """
-    from local_backend import local_model_fn
+    from local_backend import local_model_fn_structured
 
-    return VLMGuardPipeline(
-        model_fn=local_model_fn,
+    return TimedPipeline(
+        model_fn=local_model_fn_structured,
         parser_fn=parse_raw,
         guardrail_engine=engine,
         enhancer_fn=ImageEnhancer(EnhancementStrategy.HIGH_CONTRAST),
     )
+
+
+def build_cascade_pipeline(model, **client_options):
+    """Local-first cascade (:class:`cascade_pipeline.CascadePipeline`): every
+    study goes through ``build_local_pipeline``, and only Low/Medium-confidence
+    reads, CT rejections and reports a guardrail flagged are escalated to
+    ``build_async_pipeline(model, **client_options)``. The escalation counters
+    are ``pipeline.stats`` and the Gemini client is ``pipeline.client``.
+    """
+    from cascade_pipeline import CascadePipeline
+
+    return CascadePipeline(build_local_pipeline(), build_async_pipeline(model, **client_options))
+
+
+def build_hedged_pipeline(model, budget: float | None = None, **client_options):
+    """``build_async_pipeline(model, **client_options)`` with a latency budget
+    (:class:`cascade_pipeline.HedgedPipeline`): past ``budget`` seconds
+    (default ``HEDGE_BUDGET_S``) the local pipeline starts alongside Gemini,
+    and a local chest report that comes back first is returned instead.
+    Hedging counters are ``pipeline.stats``, recent times to result
+    ``pipeline.latencies``.
+    """
+    from cascade_pipeline import HedgedPipeline
+
+    options = {} if budget is None else {"budget": budget}
+    return HedgedPipeline(
+        build_async_pipeline(model, **client_options), build_local_pipeline(), **options
+    )
@@ -0,0 +1,159 @@
+"""Content-addressed result cache: a bounded in-memory LRU with an optional
+on-disk tier.
+
+Values are opaque ``bytes`` keyed by a hex digest the caller computes from
+whatever determines the result (pixels, model identity, …). Keeping the cache
+ignorant of what it stores means one implementation serves every backend; the
+local CXR backend stores raw model logits here (see
+:func:`local_backend.predict_probabilities_batch`).
+
+* **Memory tier** — an ``OrderedDict`` LRU bounded by entry count. Lost on
+  restart, but it absorbs Streamlit reruns and repeat clicks for free.
+* **Disk tier** (optional) — one file per key under ``directory``, bounded by
+  total bytes. The least-recently-used files (by mtime, refreshed on every
+  hit) are evicted first. Writes go through a temp file + ``os.replace`` so a
+  crash never leaves a half-written entry behind, and several processes can
+  share one directory.
+
+Both tiers are thread-safe.
+"""
+from __future__ import annotations
+
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """Two-tier ``bytes`` cache. ``max_entries=0`` disables the memory tier;
+    ``directory=None`` disables the disk tier."""
+
+    _SUFFIX = ".bin"
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        directory: str | None = None,
+        max_bytes: int = 256 * 1024 * 1024,
+    ):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_bytes = sum(size for _, _, size in self._disk_entries())
+
+    # ── public API ────────────────────────────────────────────────────────────
+
+    def get(self, key: str) -> bytes | None:
+        """Return the cached value for ``key`` or None. A disk hit is promoted
+        into the memory tier."""
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                return value
+        value = self._disk_get(key)
+        if value is not None:
+            self._memory_put(key, value)
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        """Store ``value`` under ``key`` in every enabled tier."""
+        self._memory_put(key, value)
+        self._disk_put(key, value)
+
+    def clear(self) -> None:
+        """Drop every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            if self.directory:
+                for path, _, _ in self._disk_entries():
+                    _remove(path)
+                self._disk_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._memory)
+
+    # ── memory tier ───────────────────────────────────────────────────────────
+
+    def _memory_put(self, key: str, value: bytes) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    # ── disk tier ─────────────────────────────────────────────────────────────
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self._SUFFIX)
+
+    def _disk_entries(self) -> list[tuple[str, float, int]]:
+        """(path, mtime, size) for every entry file, oldest first."""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if e.name.endswith(self._SUFFIX) and e.is_file():
+                    st = e.stat()
+                    entries.append((e.path, st.st_mtime, st.st_size))
+        entries.sort(key=lambda entry: entry[1])
+        return entries
+
+    def _disk_get(self, key: str) -> bytes | None:
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+            os.utime(path)  # refresh recency for LRU eviction
+        except OSError:
+            return None
+        return value
+
+    def _disk_put(self, key: str, value: bytes) -> None:
+        if not self.directory or len(value) > self.max_bytes:
+            return
+        path = self._path(key)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            with self._lock:
+                try:
+                    self._disk_bytes -= os.path.getsize(path)
+                except OSError:
+                    pass
+                os.replace(tmp, path)
+                self._disk_bytes += len(value)
+                if self._disk_bytes > self.max_bytes:
+                    self._evict()
+        except OSError:
+            _remove(tmp)
+
+    def _evict(self) -> None:
+        """Delete least-recently-used files until the tier fits in max_bytes.
+        Caller holds the lock. Re-scans the directory so space freed or used by
+        other processes sharing it is accounted for."""
+        entries = self._disk_entries()
+        total = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            total -= size
+        self._disk_bytes = total
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
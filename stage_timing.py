@@ -0,0 +1,81 @@
+"""Lightweight per-stage timing spans for the report pipelines.
+
+A pipeline run opens a recorder with :func:`record`; any code running inside it
+— the enhancer, the gates, ONNX inference, the Gemini round trip, the parser,
+each guardrail rule — marks its stage with :func:`span` (or is wrapped by
+:func:`timed`). Durations in seconds accumulate into the recorder's dict under
+the span's name, so a stage entered twice (a rule's ``condition`` and then its
+``action``) reports its total.
+
+The recorder lives in a :class:`contextvars.ContextVar`, so concurrent runs on
+different threads never mix their timings and no timing object has to be
+threaded through ``model_fn`` / ``parser_fn`` signatures. Outside a recorder —
+or with ``PIPELINE_TIMINGS=0`` — :func:`span` returns a shared no-op context
+manager: one ContextVar lookup per stage, nothing else.
+"""
+from __future__ import annotations
+
+import contextlib
+import functools
+import os
+import time
+from collections.abc import Callable, Iterator
+from contextvars import ContextVar
+
+# Set PIPELINE_TIMINGS=0 to turn instrumentation off entirely.
+ENABLED = os.environ.get("PIPELINE_TIMINGS", "1") == "1"
+
+_current: ContextVar[dict[str, float] | None] = ContextVar("stage_timings", default=None)
+_NULL = contextlib.nullcontext()
+
+
+class _Span:
+    __slots__ = ("timings", "name", "start")
+
+    def __init__(self, timings: dict[str, float], name: str):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        self.timings[self.name] = self.timings.get(self.name, 0.0) + elapsed
+        return False
+
+
+def span(name: str):
+    """Context manager timing the enclosed block as stage ``name`` in the active
+    recorder; a no-op when there is none."""
+    timings = _current.get()
+    if timings is None:
+        return _NULL
+    return _Span(timings, name)
+
+
+def timed(name: str, fn: Callable) -> Callable:
+    """Wrap ``fn`` so every call is timed as stage ``name``."""
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with span(name):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def record(into: dict[str, float] | None = None) -> Iterator[dict[str, float] | None]:
+    """Collect the spans entered in this block into ``into`` (or a new dict) and
+    yield it. Yields None, recording nothing, when instrumentation is disabled."""
+    if not ENABLED:
+        yield None
+        return
+    timings = {} if into is None else into
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
@@ -0,0 +1,382 @@
+"""Staged producer/consumer pipeline for batch runs of the local CXR backend.
+
+``VLMGuardPipeline.run`` is one serial call chain per image — decode, enhance,
+gates, preprocess, ``session.run``, template, guardrails — so during a batch
+the CPU work of decoding and preprocessing never overlaps with inference.
+:class:`StagedLocalPipeline` splits that chain into three stages joined by
+bounded queues:
+
+1. **prepare** — ``prepare_workers`` threads (or processes, with
+   ``use_processes=True``, for GIL-free decoding) open each file at reduced
+   resolution (:func:`local_backend.load_image`), apply the
+   same HIGH_CONTRAST enhancement as ``build_local_pipeline``, run
+   ``looks_like_xray`` / ``looks_like_ct_slice`` on the shared
+   :class:`local_backend.ImagePyramid`, and hand on only the 224×224 model view
+   and its logit-cache key.
+2. **inference** — a single consumer thread packs up to ``batch_size`` prepared
+   images into each ``session.run``, waiting at most ``batch_wait_ms`` to fill
+   a batch, and hands the batch's raw output rows on.
+3. **report** — ``template_workers`` threads template each batch at once
+   (:func:`local_backend.build_reports`), then parse the reports and run the
+   guardrail engine, so none of that holds up the next ``session.run``.
+
+Each stage holds at most ``queue_depth`` images (the report queue, whole
+batches of them), so memory stays bounded however long the input is. Results
+are the same ``PipelineResult`` objects ``build_local_pipeline().run``
+produces, yielded in completion order.
+"""
+from __future__ import annotations
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import NamedTuple
+
+import numpy as np
+from vlm_guard import PipelineResult
+from vlm_guard.image.enhance import EnhancementStrategy, ImageEnhancer
+
+import local_backend as lb
+from radiology_pipeline import engine as default_engine
+from radiology_pipeline import parse_raw
+from stage_timing import record, span
+
+# Same enhancement build_local_pipeline applies before the model sees the image.
+_ENHANCER = ImageEnhancer(EnhancementStrategy.HIGH_CONTRAST)
+
+
+@dataclass
+class StagedResult:
+    """One image's outcome: a PipelineResult, or the error that stopped it."""
+
+    path: str
+    result: PipelineResult | None = None
+    error: str | None = None
+    timings: dict[str, float] = field(default_factory=dict)
+    raw: np.ndarray | None = None  # the classifier's raw output row, if it ran
+    batch_size: int | None = None  # images in its session.run batch, if it ran
+
+
+class _Prepared(NamedTuple):
+    """Stage-1 output. Small and picklable so it can cross a process boundary."""
+
+    rejected: dict | None          # gate rejection report, or None
+    view: np.ndarray | None        # (224, 224) uint8 model view
+    key: str | None                # logit-cache key
+    timings: dict[str, float]
+    started: float                 # wall-clock start (time.time) for elapsed
+    batch_size: int | None = None  # set by the inference stage
+
+
+class _Scored(NamedTuple):
+    """Stage-2 output for one image: its gate rejection report, the raw output
+    row to template a report from, or the error that stopped it."""
+
+    path: str
+    prepared: _Prepared | None = None
+    report: dict | None = None
+    raw: np.ndarray | None = None
+    error: str | None = None
+
+
+class _Stopped(Exception):
+    """Raised inside stage threads once the consumer has gone away."""
+
+
+# ── Stage 1: prepare (worker pool) ────────────────────────────────────────────
+
+
+def _prepare(path: str) -> _Prepared:
+    started = time.time()
+    timings: dict[str, float] = {}
+    t = time.perf_counter()
+
+    def lap(name: str) -> None:
+        nonlocal t
+        now = time.perf_counter()
+        timings[name] = now - t
+        t = now
+
+    image = lb.load_image(path)
+    lap("decode")
+    image = _ENHANCER(image)
+    lap("enhance")
+    pyramid = lb.ImagePyramid(image)
+    rejected = lb.gate_report(pyramid)
+    lap("gates")
+    if rejected is not None:
+        return _Prepared(rejected, None, None, timings, started)
+    view = pyramid.model_view
+    key = lb.cache_key(pyramid)
+    lap("preprocess")
+    return _Prepared(None, view, key, timings, started)
+
+
+# ── Pipeline ──────────────────────────────────────────────────────────────────
+
+
+class StagedLocalPipeline:
+    """Overlap decode/preprocess, batched inference and report templating.
+
+    ``run(paths)`` yields one :class:`StagedResult` per path. Every stage's
+    concurrency and the depth of the queues between them are configurable so a
+    multi-core batch node can keep all cores busy.
+    """
+
+    def __init__(
+        self,
+        prepare_workers: int | None = None,
+        use_processes: bool = False,
+        queue_depth: int = 64,
+        batch_size: int = lb.BATCH_SIZE,
+        batch_wait_ms: float = 20.0,
+        template_workers: int = 1,
+        guardrail_engine=None,
+        context: dict | None = None,
+    ):
+        self.prepare_workers = prepare_workers or os.cpu_count() or 1
+        self.use_processes = use_processes
+        self.queue_depth = max(1, queue_depth)
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait_ms / 1000.0
+        self.template_workers = max(1, template_workers)
+        self.guardrail_engine = guardrail_engine or default_engine
+        self.context = context or {"scan_type": "radiology"}
+
+    def run(self, paths: Iterable[str]) -> Iterator[StagedResult]:
+        stop = threading.Event()
+        # Prepare slots: images being decoded or waiting for inference.
+        slots = threading.Semaphore(self.queue_depth)
+        prepared_q: queue.Queue = queue.Queue()  # bounded by `slots`
+        # Lists of _Scored: a whole inference batch, or one rejected / failed image.
+        report_q: queue.Queue = queue.Queue(
+            maxsize=max(1, self.queue_depth // self.batch_size)
+        )
+        out_q: queue.Queue = queue.Queue(maxsize=self.queue_depth)
+        failure: list[BaseException] = []
+        if self.use_processes:
+            # spawn, not fork: the stage threads are already running when the
+            # pool starts its workers, and forking a threaded process can
+            # deadlock on locks held by other threads.
+            pool = ProcessPoolExecutor(
+                max_workers=self.prepare_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        else:
+            pool = ThreadPoolExecutor(max_workers=self.prepare_workers)
+
+        threads = [
+            threading.Thread(
+                target=self._feed,
+                args=(paths, pool, slots, prepared_q, stop, failure),
+                daemon=True,
+            ),
+            threading.Thread(
+                target=self._infer, args=(prepared_q, slots, report_q, stop), daemon=True
+            ),
+        ] + [
+            threading.Thread(target=self._report, args=(report_q, out_q, stop), daemon=True)
+            for _ in range(self.template_workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            finished = 0
+            while finished < self.template_workers:
+                item = out_q.get()
+                if item is None:
+                    finished += 1
+                else:
+                    yield item
+            if failure:
+                raise failure[0]  # e.g. a missing manifest, raised in the feeder
+        finally:
+            stop.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    # ── stage threads ─────────────────────────────────────────────────────────
+
+    def _feed(self, paths, pool, slots, prepared_q, stop, failure) -> None:
+        """Submit paths to the prepare pool, never more than queue_depth ahead."""
+        count = 0
+        try:
+            for path in paths:
+                while not slots.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    return
+                future = pool.submit(_prepare, path)
+                future.add_done_callback(lambda f, p=path: prepared_q.put((p, f)))
+                count += 1
+        except BaseException as e:  # noqa: BLE001 — re-raised by run()
+            failure.append(e)
+        finally:
+            prepared_q.put(count)  # end marker: total number of submitted paths
+
+    def _collect(self, prepared_q, stop, state) -> list[tuple[str, Future]]:
+        """Next inference batch: block for one item, then take more until the
+        batch is full or batch_wait has passed."""
+        batch: list[tuple[str, Future]] = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            if state["total"] is not None and state["seen"] + len(batch) >= state["total"]:
+                break
+            timeout = 0.1 if deadline is None else deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = prepared_q.get(timeout=timeout)
+            except queue.Empty:
+                if stop.is_set():
+                    raise _Stopped
+                continue
+            if isinstance(item, int):
+                state["total"] = item
+                continue
+            batch.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + self.batch_wait
+        return batch
+
+    def _infer(self, prepared_q, slots, report_q, stop) -> None:
+        state = {"total": None, "seen": 0}
+        try:
+            while state["total"] is None or state["seen"] < state["total"]:
+                batch = self._collect(prepared_q, stop, state)
+                state["seen"] += len(batch)
+                for _ in batch:
+                    slots.release()
+
+                accepted = []
+                for path, future in batch:
+                    try:
+                        prepared = future.result()
+                    except Exception as e:  # noqa: BLE001 — reported per image
+                        _put(report_q, [_Scored(path, error=_describe(e))], stop)
+                        continue
+                    if prepared.rejected is not None:
+                        _put(report_q, [_Scored(path, prepared, prepared.rejected)], stop)
+                    else:
+                        accepted.append((path, prepared))
+                if not accepted:
+                    continue
+
+                start = time.perf_counter()
+                try:
+                    raw = lb.predict_model_views_raw(
+                        [p.view for _, p in accepted],
+                        [p.key for _, p in accepted],
+                        batch_size=self.batch_size,
+                    )
+                except Exception as e:  # noqa: BLE001 — fails the whole batch
+                    failed = [_Scored(path, error=_describe(e)) for path, _ in accepted]
+                    _put(report_q, failed, stop)
+                    continue
+                elapsed = time.perf_counter() - start
+                scored = []
+                for (path, prepared), row in zip(accepted, raw):
+                    prepared.timings["inference"] = elapsed
+                    prepared = prepared._replace(batch_size=len(accepted))
+                    scored.append(_Scored(path, prepared, raw=row))
+                _put(report_q, scored, stop)
+        except _Stopped:
+            return
+        finally:
+            if not stop.is_set():
+                for _ in range(self.template_workers):
+                    report_q.put(None)
+
+    def _report(self, report_q, out_q, stop) -> None:
+        try:
+            while True:
+                items = _get(report_q, stop)
+                if items is None:
+                    break
+                for item in _templated(items):
+                    if item.error is not None:
+                        result = StagedResult(item.path, error=item.error)
+                    else:
+                        result = self._finish(item.path, item.prepared, item.report, item.raw)
+                    _put(out_q, result, stop)
+        except _Stopped:
+            return
+        finally:
+            if not stop.is_set():
+                out_q.put(None)
+
+    def _finish(
+        self, path: str, prepared: _Prepared, report: dict, raw: np.ndarray | None
+    ) -> StagedResult:
+        """Parse + guardrails, exactly as VLMGuardPipeline.run does."""
+        timings = prepared.timings
+        context = {**self.context, "image_enhanced": True}
+        with record(into=timings):
+            with span("parse"):
+                analysis, raw_output = parse_raw(report)
+            final, audit = self.guardrail_engine.apply_with_audit(analysis, context)
+        result = PipelineResult(
+            analysis=final,
+            raw_output=raw_output,
+            status="ok" if final.confidence != "Low" else "low_confidence",
+            elapsed_seconds=time.time() - prepared.started,
+            audit=audit,
+            image_enhanced=True,
+            metadata={"timings": timings},
+        )
+        return StagedResult(
+            path, result=result, timings=timings, raw=raw, batch_size=prepared.batch_size
+        )
+
+
+def _templated(items: list[_Scored]) -> list[_Scored]:
+    """``items`` with a report for every raw row, templated in one
+    :func:`local_backend.build_reports` call and timed as ``template``."""
+    pending = [i for i, item in enumerate(items) if item.report is None and item.error is None]
+    if not pending:
+        return items
+    start = time.perf_counter()
+    try:
+        reports = lb.build_reports(
+            lb.probability_matrix(np.stack([items[i].raw for i in pending]))
+        )
+    except Exception as e:  # noqa: BLE001 — fails the whole batch
+        return [item._replace(error=_describe(e)) if i in pending else item
+                for i, item in enumerate(items)]
+    elapsed = time.perf_counter() - start
+    items = list(items)
+    for i, report in zip(pending, reports):
+        items[i].prepared.timings["template"] = elapsed
+        items[i] = items[i]._replace(report=report)
+    return items
+
+
+def _describe(error: BaseException) -> str:
+    return f"{type(error).__name__}: {error}"
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    """Blocking get that gives up once the consumer has stopped reading."""
+    while True:
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            if stop.is_set():
+                raise _Stopped from None
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> None:
+    """Blocking put that gives up once the consumer has stopped reading."""
+    while True:
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            if stop.is_set():
+                raise _Stopped from None
@@ -2,10 +2,17 @@ import os
 
 import streamlit as st
 from PIL import Image
-# google.generativeai is imported lazily inside the Gemini branch so the offline
+# google.generativeai is imported lazily inside _gemini_pipeline so the offline
 # Local CXR backend runs without the cloud SDK installed.
 
-from radiology_pipeline import build_local_pipeline, build_pipeline
+import local_backend
+from cascade_pipeline import HEDGE_RULE, ROUTING_RULE, CascadePipeline, HedgedPipeline
+from radiology_pipeline import (
+    GEMINI_MODEL_NAME,
+    SYSTEM_INSTRUCTION,
+    build_async_pipeline,
+    build_local_pipeline,
+)
 
 # ── Page config ───────────────────────────────────────────────────────────────
 
@@ -37,15 +44,81 @@ def _get_api_key():
         return None
 
 
+@st.cache_resource(show_spinner=False)
+def _gemini_pipeline(api_key, model_name):
+    """One Gemini pipeline per (key, model) for the whole server process, not
+    one per rerun. Raises ImportError without the SDK (and is then retried)."""
+    import google.generativeai as genai
+
+    genai.configure(api_key=api_key)
+    model = genai.GenerativeModel(
+        model_name=model_name,
+        system_instruction=SYSTEM_INSTRUCTION,
+    )
+    # Shared by every session: one concurrency limit, rate limit and retry
+    # policy for the whole server (see gemini_backend).
+    return build_async_pipeline(model)
+
+
+@st.cache_resource(show_spinner=False)
+def _local_pipeline(model_path):
+    """One local pipeline per model file for the whole server process. Raises
+    FileNotFoundError (and is then retried) until the model exists."""
+    local_backend.ensure_model_available()
+    return build_local_pipeline()
+
+
+@st.cache_resource(show_spinner=False)
+def _cascade_pipeline(api_key, model_name, model_path):
+    """The local and Gemini pipelines above, chained local-first (see
+    cascade_pipeline); its escalation counters cover the whole server."""
+    return CascadePipeline(_local_pipeline(model_path), _gemini_pipeline(api_key, model_name))
+
+
+@st.cache_resource(show_spinner=False)
+def _hedged_pipeline(api_key, model_name, model_path):
+    """The Gemini pipeline with the local model as its latency-budget fallback
+    (see cascade_pipeline.HedgedPipeline)."""
+    return HedgedPipeline(_gemini_pipeline(api_key, model_name), _local_pipeline(model_path))
+
+
+def _render_readiness():
+    """Sidebar status of the background warm-up (see local_backend.start_warm_up)."""
+    warm_up = local_backend.start_warm_up()
+    if not warm_up.done():
+        st.info("⏳ Warming up the local model…")
+    elif warm_up.exception() is None:
+        st.success(f"✅ Local model ready (warm-up {warm_up.result():.1f}s)")
+    else:
+        st.warning(f"Warm-up failed; the model loads on first use. ({warm_up.exception()})")
+
+
+def _show_readiness():
+    """Start the warm-up if it is not running yet and render its status, polling
+    once a second until it finishes."""
+    warming = not local_backend.start_warm_up().done()
+    st.fragment(run_every=1.0 if warming else None)(_render_readiness)()
+
+
+# With CHEXNET_WARM_UP=1, load the ONNX session and run one inference as soon as
+# the server handles its first script run; otherwise the warm-up starts when the
+# Local or Cascade backend is selected. Either way the first upload does not pay
+# for it.
+if local_backend.WARM_UP_ON_START:
+    local_backend.start_warm_up()
+
+
 with st.sidebar:
     st.header("Configuration")
 
     backend = st.radio(
         "Analysis backend",
-        ["Gemini (cloud)", "Local CXR (CPU)"],
+        ["Gemini (cloud)", "Local CXR (CPU)", "Cascade (local → Gemini)"],
         help=(
             "Gemini: any modality, needs GOOGLE_API_KEY. "
-            "Local CXR: chest X-rays only, runs on CPU with no API key or network."
+            "Local CXR: chest X-rays only, runs on CPU with no API key or network. "
+            "Cascade: the local model first; Gemini only for uncertain or flagged "
+            "reads and CT (needs both)."
         ),
     )
 
@@ -56,36 +129,65 @@ with st.sidebar:
         if not api_key:
             st.error("⚠️ API Key missing.")
             st.info("Please set GOOGLE_API_KEY in Streamlit Secrets.")
+        else:
+            hedge = st.checkbox(
+                "Fall back to the local model when Gemini is slow", value=True,
+                help="After HEDGE_BUDGET_S seconds without an answer, the local "
+                "chest-X-ray model runs too and the first chest report wins.",
+            )
+            try:
+                pipeline = _gemini_pipeline(api_key, GEMINI_MODEL_NAME)
+                st.success("API Key Loaded")
+            except ImportError:
+                st.error("google-generativeai is not installed.")
+                st.code("pip install -r requirements.txt")
+            else:
+                if hedge:
+                    try:
+                        pipeline = _hedged_pipeline(
+                            api_key, GEMINI_MODEL_NAME, local_backend.model_path()
+                        )
+                    except FileNotFoundError:
+                        st.caption("Local model not found — no fallback when Gemini is slow.")
+                    else:
+                        tail = pipeline.latency_percentiles()
+                        if tail:
+                            st.caption(
+                                f"Hedged {pipeline.stats['hedged']} of "
+                                f"{pipeline.stats['studies']} studies; time to result "
+                                f"p95 {tail['p95']:.1f}s, p99 {tail['p99']:.1f}s."
+                            )
+    elif backend == "Cascade (local → Gemini)":
+        api_key = _get_api_key()
+        if not api_key:
+            st.error("⚠️ API Key missing — the cascade escalates to Gemini.")
+            st.info("Please set GOOGLE_API_KEY in Streamlit Secrets.")
         else:
             try:
-                import google.generativeai as genai
+                pipeline = _cascade_pipeline(api_key, GEMINI_MODEL_NAME, local_backend.model_path())
             except ImportError:
                 st.error("google-generativeai is not installed.")
                 st.code("pip install -r requirements.txt")
-                genai = None
-
-            if genai is not None:
-                st.success("API Key Loaded")
-                genai.configure(api_key=api_key)
-                model = genai.GenerativeModel(
-                    model_name="gemini-2.0-flash",
-                    system_instruction=(
-                        "If this is not a medical image, set is_medical_image to false "
-                        "and leave per_structure_findings as an empty list."
-                    ),
+            except FileNotFoundError as e:
+                st.error("Local model not found.")
+                st.code(str(e))
+            else:
+                stats = pipeline.stats
+                st.caption(
+                    f"Escalated {stats['escalated']} of {stats['studies']} studies "
+                    f"({pipeline.escalation_rate:.0%}) to Gemini."
                 )
-                pipeline = build_pipeline(model)
+                _show_readiness()
     else:
         st.info("🖥️ Local chest-X-ray model — CPU only, no API key required.")
         st.caption("Chest radiographs only; other modalities are flagged, not analysed.")
         try:
-            from local_backend import ensure_model_available
-
-            ensure_model_available()
-            pipeline = build_local_pipeline()
+            pipeline = _local_pipeline(local_backend.model_path())
         except FileNotFoundError as e:
             st.error("Local model not found.")
             st.code(str(e))
+        else:
+            _show_readiness()
 
 # ── Severity display helpers ──────────────────────────────────────────────────
 
@@ -105,6 +207,17 @@ def _render_finding(finding):
         f"{finding['observation']} ({finding['severity']})"
     )
 
+
+def _render_timings(timings):
+    """Per-stage wall time of the run (see stage_timing), slowest first."""
+    if not timings:
+        return
+    rows = "\n".join(
+        f"| `{stage}` | {seconds * 1000:.1f} |"
+        for stage, seconds in sorted(timings.items(), key=lambda kv: -kv[1])
+    )
+    st.markdown("**Stage timings**\n\n| Stage | ms |\n|---|---:|\n" + rows)
+
 # ── Main layout ───────────────────────────────────────────────────────────────
 
 col1, col2 = st.columns([1, 1])
@@ -116,7 +229,11 @@ with col1:
     )
 
     if uploaded_file:
-        image = Image.open(uploaded_file)
+        if backend == "Local CXR (CPU)":
+            # Decode straight at the resolution the local model needs.
+            image = local_backend.load_image(uploaded_file)
+        else:
+            image = Image.open(uploaded_file)
         st.image(image, caption="Uploaded Scan", width="stretch")
         analyze_clicked = st.button("Generate Preliminary Report", type="primary")
 
@@ -141,6 +258,16 @@ with col2:
                     )
                     validated = result.analysis
                     audit_entries = result.audit.summary()
+                    routes = [
+                        e for e in audit_entries if e["rule"] in (ROUTING_RULE, HEDGE_RULE)
+                    ]
+                    for route in routes:
+                        audit_entries.remove(route)
+                        st.caption(f"Route: {route['message']}")
+                    answered_locally = backend == "Local CXR (CPU)" or "local" in (
+                        result.metadata.get("route", {}).get("backend"),
+                        result.metadata.get("hedge", {}).get("backend"),
+                    )
 
                     was_blocked = any(
                         e["action"] == "block" for e in audit_entries
@@ -163,6 +290,7 @@ with col2:
                         with st.expander("vlm-guard audit trail"):
                             for entry in audit_entries:
                                 st.json(entry)
+                            _render_timings(result.metadata.get("timings"))
                         st.stop()
 
                     # ── Structured report ─────────────────────────────────
@@ -178,7 +306,7 @@ with col2:
 
                     per_structure = validated.metadata["per_structure"]
 
-                    if backend == "Local CXR (CPU)" and per_structure:
+                    if answered_locally and per_structure:
                         # Local findings are probability-ranked correlated labels:
                         # headline the strongest, fold the associated ones away.
                         st.markdown("**Primary finding:**")
@@ -206,6 +334,7 @@ with col2:
                                 st.json(entry)
                         else:
                             st.success("No rules triggered — output passed all checks.")
+                        _render_timings(result.metadata.get("timings"))
                         st.caption(
                             "Validated by vlm-guard v0.1.2 — MohamedFakhry2007/vlm-guard"
                         )
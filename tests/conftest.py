@@ -0,0 +1,72 @@
+"""Shared fixtures: a fake onnxruntime session for the local backend and the
+films the batch pipelines are run on."""
+import threading
+import types
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import local_backend as lb
+from result_cache import ResultCache
+
+
+class FakeSession:
+    """Stands in for onnxruntime.InferenceSession: records every run() batch
+    shape and returns per-image logits derived from the mean pixel so order is
+    checkable. Safe to call from several threads."""
+
+    def __init__(self, metadata=None):
+        self.batches = []
+        self.metadata = metadata or {}
+        self.intra_op_threads = []  # one entry per _create_session call
+        self._lock = threading.Lock()
+
+    def get_inputs(self):
+        class _Input:
+            name = "image"
+        return [_Input()]
+
+    def get_modelmeta(self):
+        return types.SimpleNamespace(custom_metadata_map=self.metadata)
+
+    def run(self, output_names, feeds):
+        batch = feeds["image"]
+        with self._lock:
+            self.batches.append(batch.shape)
+        logits = batch.reshape(len(batch), -1).mean(axis=1) / 256.0 - 5.0
+        return [np.repeat(logits[:, None], len(lb.PATHOLOGIES), axis=1)]
+
+
+@pytest.fixture
+def fake_session(monkeypatch, tmp_path):
+    """Install a FakeSession behind a placeholder model file and a fresh,
+    memory-only logit cache."""
+    model = tmp_path / "chexnet.onnx"
+    model.write_bytes(b"fake")
+    session = FakeSession()
+
+    def create(intra_op_threads=None):
+        session.intra_op_threads.append(intra_op_threads)
+        return session
+
+    monkeypatch.setattr(lb, "_ONNX_PATH", str(model))
+    monkeypatch.setattr(lb, "_create_session", create)
+    monkeypatch.setattr(lb, "_pool", None)
+    monkeypatch.setattr(lb, "_cache", ResultCache(max_entries=64))
+    return session
+
+
+def films(directory, count):
+    """``count`` greyscale noise films (they pass the X-ray gate) plus one
+    colour photo (it does not), as PNG paths in ``directory``."""
+    rng = np.random.default_rng(3)
+    paths = []
+    for i in range(count):
+        noise = (rng.random((128, 160)) * 255).astype(np.uint8)
+        path = directory / f"film{i:02d}.png"
+        Image.fromarray(noise, mode="L").save(path)
+        paths.append(str(path))
+    photo = directory / "photo.png"
+    Image.new("RGB", (128, 128), color=(220, 30, 30)).save(photo)
+    return paths + [str(photo)]
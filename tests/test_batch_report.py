@@ -0,0 +1,153 @@
+"""Offline tests for the batch JSONL runner.
+
+ONNX inference is monkeypatched exactly as in test_local_backend.py, so these
+run without the model file or onnxruntime.
+Run: pytest tests/test_batch_report.py
+"""
+import io
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import batch_report as br
+import local_backend as lb
+from radiology_pipeline import build_local_pipeline
+
+
+def _write_images(directory, names):
+    rng = np.random.default_rng(0)
+    for name in names:
+        path = directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        noise = (rng.random((64, 64)) * 255).astype(np.uint8)
+        Image.fromarray(noise, mode="L").save(path)
+    return [str(directory / n) for n in names]
+
+
+@pytest.fixture
+def local_pipeline(monkeypatch):
+    probs = {name: 0.1 for name in lb.PATHOLOGIES}
+    probs["Effusion"] = 0.8
+    monkeypatch.setattr(lb, "looks_like_xray", lambda img: True)
+    monkeypatch.setattr(lb, "looks_like_ct_slice", lambda img: False)
+    monkeypatch.setattr(lb, "predict_probabilities", lambda img: probs)
+    return build_local_pipeline()
+
+
+# ── input enumeration ─────────────────────────────────────────────────────────
+
+
+def test_directory_is_walked_recursively_in_order(tmp_path):
+    expected = _write_images(tmp_path, ["b.png", "a.jpg", "sub/c.jpeg"])
+    (tmp_path / "notes.txt").write_text("not an image")
+    assert list(br.iter_inputs([str(tmp_path)])) == sorted(expected)
+
+
+def test_glob_and_manifests(tmp_path):
+    paths = _write_images(tmp_path, ["x1.png", "x2.png", "y.png"])
+    assert sorted(br.iter_inputs([str(tmp_path / "x*.png")])) == paths[:2]
+
+    (tmp_path / "list.txt").write_text("# header comment\ny.png\n\nx1.png\n")
+    assert list(br.iter_inputs([str(tmp_path / "list.txt")])) == [paths[2], paths[0]]
+
+    (tmp_path / "list.csv").write_text("id,path\n1,x2.png\n2,y.png\n")
+    assert list(br.iter_inputs([str(tmp_path / "list.csv")])) == [paths[1], paths[2]]
+
+
+def test_inputs_are_lazy():
+    gen = br.iter_inputs(["/nonexistent/**/*.png"])
+    assert iter(gen) is gen  # a generator: nothing is enumerated up front
+
+
+# ── running ───────────────────────────────────────────────────────────────────
+
+
+def test_records_stream_one_per_image(tmp_path, local_pipeline):
+    paths = _write_images(tmp_path, [f"{i}.png" for i in range(5)])
+    (tmp_path / "broken.png").write_bytes(b"not a png")
+    out = io.StringIO()
+
+    counts = br.run_batch(
+        br.iter_inputs([str(tmp_path)]), out, local_pipeline, workers=2
+    )
+
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert counts == {"skipped": 0, "ok": 5, "error": 1}
+    assert {r["path"] for r in records} == set(paths) | {str(tmp_path / "broken.png")}
+    ok = next(r for r in records if r["status"] == "ok")
+    assert ok["analysis"]["metadata"]["is_medical_image"] is True
+    assert ok["analysis"]["confidence"] == "Medium"
+    assert isinstance(ok["audit"], list)
+    assert set(ok["timings"]) == {"decode", "pipeline", "total"}
+    assert "error" in next(r for r in records if r["status"] == "error")
+
+
+def test_bounded_in_flight(tmp_path):
+    paths = [str(tmp_path / f"{i}.png") for i in range(50)]
+    produced = []
+
+    def lazy_paths():
+        for p in paths:
+            produced.append(p)
+            yield p
+
+    written = []
+
+    class _Pipeline:
+        def run(self, image, prompt, context=None):
+            raise AssertionError("unreachable: the files do not exist")
+
+    def on_record(record):
+        # Never more than 2 × workers images pulled ahead of what was written.
+        written.append(record)
+        assert len(produced) - len(written) <= 2 * 3
+
+    br.run_batch(lazy_paths(), io.StringIO(), _Pipeline(), workers=3, on_record=on_record)
+    assert len(written) == 50
+
+
+def test_resume_skips_completed(tmp_path, local_pipeline):
+    paths = _write_images(tmp_path / "imgs", ["a.png", "b.png", "c.png"])
+    output = tmp_path / "out.jsonl"
+    output.write_text(
+        json.dumps({"path": paths[0], "status": "ok"}) + "\n"
+        + json.dumps({"path": paths[1], "status": "error", "error": "x"}) + "\n"
+        + '{"path": "truncated'
+    )
+
+    done = br.completed_paths(str(output))
+    assert done == {paths[0]}  # failures are retried, torn lines ignored
+
+    out = io.StringIO()
+    counts = br.run_batch(paths, out, local_pipeline, skip=done)
+    assert counts["skipped"] == 1
+    assert {json.loads(l)["path"] for l in out.getvalue().splitlines()} == set(paths[1:])
+
+
+def test_run_staged_writes_records(tmp_path, monkeypatch):
+    from staged_pipeline import StagedLocalPipeline
+
+    paths = _write_images(tmp_path, ["a.png", "b.png", "c.png"])
+    (tmp_path / "broken.png").write_bytes(b"not a png")
+    monkeypatch.setattr(lb, "gate_report", lambda pyramid: None)
+    monkeypatch.setattr(lb, "cache_key", lambda pyramid: None)
+    monkeypatch.setattr(
+        lb, "predict_model_views_raw",
+        lambda views, keys=None, batch_size=None: np.full((len(views), 18), 0.1, np.float32),
+    )
+    monkeypatch.setattr(lb, "probability_matrix", lambda raw: raw)
+    out = io.StringIO()
+
+    counts = br.run_staged(
+        br.iter_inputs([str(tmp_path)]), out,
+        StagedLocalPipeline(prepare_workers=2, batch_size=4), skip={paths[0]},
+    )
+
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert counts == {"skipped": 1, "ok": 2, "error": 1}
+    ok = next(r for r in records if r["status"] == "ok")
+    assert {"decode", "inference", "guardrails", "total"} <= set(ok["timings"])
+    assert "batch_size" not in ok["timings"]  # seconds only
+    assert 1 <= ok["batch_size"] <= 2
@@ -0,0 +1,43 @@
+"""Smoke test for tools/benchmark.py — the suite runs offline and emits every
+stage with percentiles, so it cannot silently rot between benchmark runs.
+
+Run: pytest tests/test_benchmark.py -v
+"""
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tools"))
+
+import benchmark  # noqa: E402
+import local_backend as lb  # noqa: E402
+
+
+def test_suite_reports_every_stage(monkeypatch, tmp_path):
+    # run_suite repoints the backend at its stand-in model; restore afterwards.
+    monkeypatch.setattr(lb, "_ONNX_PATH", lb._ONNX_PATH)
+    monkeypatch.setattr(lb, "_pool", None)
+    monkeypatch.setattr(lb, "_cache", None)
+
+    report = benchmark.run_suite(
+        sizes=[300], iterations=3, batch_size=4, gemini_latency_ms=1, model=None
+    )
+
+    json.dumps(report)  # machine-readable
+    assert report["meta"]["model"] == "stand-in"
+    stages = {r["stage"] for r in report["results"]}
+    assert stages == {
+        "session.run[1]", "session.run[4]", "build_report", "parse_raw", "guardrails",
+        "decode.full", "decode.reduced", "looks_like_xray", "looks_like_ct_slice",
+        "_preprocess", "pipeline.local", "pipeline.gemini",
+    }
+    for r in report["results"]:
+        assert 0 <= r["p50_ms"] <= r["p95_ms"] <= r["p99_ms"]
+        assert r["peak_rss_mb"] > 0
+    gemini = next(r for r in report["results"] if r["stage"] == "pipeline.gemini")
+    assert gemini["p50_ms"] >= 1  # the injected latency is part of the run
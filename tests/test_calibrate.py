@@ -0,0 +1,136 @@
+"""Offline tests for the threshold calibration tool (tools/calibrate.py) and
+the per-pathology thresholds local_backend loads from its output.
+
+Metrics are checked against brute-force per-threshold loops on small random
+data with ties and missing labels; no model is involved.
+Run: pytest tests/test_calibrate.py
+"""
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tools"))
+
+import calibrate  # noqa: E402
+import local_backend as lb  # noqa: E402
+from logit_store import LogitStore  # noqa: E402
+
+
+def _dataset(count=400, seed=0):
+    rng = np.random.default_rng(seed)
+    labels = (rng.random((count, len(lb.PATHOLOGIES))) < 0.3).astype(float)
+    probs = np.clip(rng.normal(0.35 + 0.3 * labels, 0.15), 0, 1).round(2)  # many ties
+    labels[rng.random(labels.shape) < 0.1] = np.nan
+    return probs, labels
+
+
+def _reference(p, y):
+    """AUROC and average precision of one column by looping over thresholds."""
+    known = ~np.isnan(y)
+    p, y = p[known], y[known]
+    pos, neg = p[y == 1], p[y == 0]
+    greater = (pos[:, None] > neg[None, :]).mean()
+    ties = (pos[:, None] == neg[None, :]).mean()
+    ap, last_recall = 0.0, 0.0
+    for t in np.unique(p)[::-1]:
+        flagged = p >= t
+        recall = (flagged & (y == 1)).sum() / len(pos)
+        ap += (recall - last_recall) * (flagged & (y == 1)).sum() / flagged.sum()
+        last_recall = recall
+    return greater + 0.5 * ties, ap
+
+
+def test_metrics_match_brute_force():
+    probs, labels = _dataset()
+    c = calibrate.curves(probs, labels)
+    for j in (0, 7, 17):
+        roc, ap = _reference(probs[:, j], labels[:, j])
+        assert calibrate.auroc(c)[j] == pytest.approx(roc)
+        assert calibrate.average_precision(c)[j] == pytest.approx(ap)
+    assert c.positives.tolist() == (labels == 1).sum(axis=0).tolist()
+
+
+def test_thresholds_by_method():
+    probs, labels = _dataset()
+    c = calibrate.curves(probs, labels)
+    for j in (0, 5):
+        p, y = probs[:, j], labels[:, j]
+        known = ~np.isnan(y)
+        p, y = p[known], y[known]
+
+        def rates(t):
+            flagged = p >= t
+            return (flagged & (y == 1)).sum() / (y == 1).sum(), (flagged & (y == 0)).sum() / (y == 0).sum()
+
+        j_best = max(tpr - fpr for tpr, fpr in map(rates, np.unique(p)))
+        tpr, fpr = rates(calibrate.optimal_thresholds(c, "youden")[j])
+        assert tpr - fpr == pytest.approx(j_best)
+
+        threshold = calibrate.optimal_thresholds(c, "specificity", 0.9)[j]
+        tpr, fpr = rates(threshold)
+        assert 1 - fpr >= 0.9
+        assert tpr == max(s for s, f in map(rates, np.unique(p)) if 1 - f >= 0.9)
+
+
+def test_separable_pathology_gets_perfect_threshold():
+    probs, labels = _dataset()
+    probs[:, 3] = np.where(labels[:, 3] == 1, 0.8, 0.2)
+    config = calibrate.calibrate(probs, labels)
+    metrics = config["metrics"]["Pneumothorax"]
+    assert metrics["auroc"] == 1.0
+    assert metrics["sensitivity_at_specificity"]["0.95"] == 1.0
+    assert 0.2 < config["thresholds"]["Pneumothorax"] <= 0.8
+
+
+def test_config_round_trips_into_local_backend(tmp_path, monkeypatch):
+    probs, labels = _dataset()
+    labels[:, lb.PATHOLOGIES.index("Hernia")] = 0.0  # no positives: keeps the default
+    config = calibrate.calibrate(probs, labels)
+    path = tmp_path / "thresholds.json"
+    path.write_text(json.dumps(config))
+
+    thresholds = lb.load_thresholds(str(path), default=0.5)
+    assert "Hernia" not in config["thresholds"]
+    assert thresholds[lb.PATHOLOGIES.index("Hernia")] == 0.5
+    assert thresholds[0] == config["thresholds"]["Atelectasis"]
+
+    monkeypatch.setattr(lb, "_THRESHOLDS_PATH", str(path))
+    monkeypatch.setattr(lb, "_loaded_bands", None)
+    assert lb.default_bands().threshold == lb.load_thresholds(str(path))
+
+    path.write_text(json.dumps({"thresholds": {"Dragon": 0.3}}))
+    with pytest.raises(ValueError, match="unknown"):
+        lb.load_thresholds(str(path))
+
+
+def test_cli_calibrates_from_store_and_labels_csv(tmp_path):
+    probs, labels = _dataset(60)
+    logits = np.log(probs.clip(1e-4, 1 - 1e-4) / (1 - probs.clip(1e-4, 1 - 1e-4)))
+    with LogitStore.create(str(tmp_path / "s"), outputs="logits", model="m:1") as store:
+        for i, row in enumerate(logits):
+            store.append(str(tmp_path / f"{i}.png"), row)
+
+    header = ["path"] + [name.replace("_", " ") for name in lb.PATHOLOGIES]
+    lines = [",".join(header)]
+    for i, row in enumerate(labels):
+        cells = ["" if np.isnan(v) else str(int(v)) for v in row]
+        lines.append(",".join([f"{i}.png"] + cells))
+    lines.append(",".join(["missing.png"] + ["1"] * len(lb.PATHOLOGIES)))
+    (tmp_path / "labels.csv").write_text("\n".join(lines) + "\n")
+
+    out = tmp_path / "thresholds.json"
+    assert calibrate.main([
+        str(tmp_path / "labels.csv"), "--store", str(tmp_path / "s"), "-o", str(out),
+        "--min-positives", "1", "--curves", str(tmp_path / "curves.npz"),
+    ]) == 0
+    config = json.loads(out.read_text())
+    assert config["images"] == 60 and config["model"] == "m:1"
+    assert set(config["thresholds"]) == set(lb.PATHOLOGIES)
+    assert config["metrics"]["Effusion"]["auroc"] == pytest.approx(
+        calibrate.auroc(calibrate.curves(probs, labels))[7], abs=1e-3
+    )
+    with np.load(tmp_path / "curves.npz") as curves:
+        assert curves["Effusion/tpr"][-1] == 1.0
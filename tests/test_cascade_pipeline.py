@@ -0,0 +1,236 @@
+"""Offline tests for the local-first cascade and the latency hedge
+(cascade_pipeline.py).
+
+The local backend's model_fn is replaced by templated reports
+(``local_backend.build_report``) and Gemini by a canned CT report, or by a fake
+async model with injected latency, so neither the ONNX model nor an API key is
+needed.
+Run: pytest tests/test_cascade_pipeline.py
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+import local_backend as lb
+import gemini_backend as gb
+from cascade_pipeline import CascadePipeline, HedgedPipeline, escalation_reasons
+from radiology_pipeline import TimedPipeline, build_async_pipeline, engine, parse_raw
+
+_GEMINI = {
+    "modality": "CT", "view": "Axial", "is_medical_image": True,
+    "impression": "No acute intracranial abnormality.", "confidence_level": "High",
+    "key_findings": "Unremarkable.", "per_structure_findings": [],
+    "recommendation": "Routine follow-up.",
+}
+
+
+def _pipeline(model_fn):
+    return TimedPipeline(model_fn=model_fn, parser_fn=parse_raw, guardrail_engine=engine)
+
+
+class _Remote:
+    def __init__(self, error=None):
+        self.calls = 0
+        self.error = error
+        self.pipeline = _pipeline(self._model_fn)
+
+    def _model_fn(self, image, prompt):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return json.dumps(_GEMINI)
+
+    def run(self, image, prompt, context=None):
+        return self.pipeline.run(image, prompt, context)
+
+
+def _cascade(report, remote=None):
+    remote = remote or _Remote()
+    return CascadePipeline(_pipeline(lambda image, prompt: report), remote), remote
+
+
+def _run(cascade):
+    return cascade.run(Image.new("RGB", (32, 32)), "x", context={"scan_type": "radiology"})
+
+
+_NORMAL = {name: 0.05 for name in lb.PATHOLOGIES}
+
+
+def test_confident_normal_film_stays_local():
+    cascade, remote = _cascade(lb.build_report(_NORMAL, is_medical=True))
+    result = _run(cascade)
+    assert remote.calls == 0
+    assert result.analysis.confidence == "High"
+    assert result.metadata["route"] == {"backend": "local", "reasons": []}
+    entry = result.audit.entries[0]
+    assert (entry.rule_name, entry.action_type) == ("cascade_routing", "route")
+    assert [e["rule"] for e in result.audit.summary()] == ["cascade_routing"]
+    assert all(stage.startswith("local.") for stage in result.metadata["timings"])
+    assert cascade.stats["local"] == 1 and cascade.escalation_rate == 0.0
+
+
+@pytest.mark.parametrize("report, reason", [
+    (lb.build_report({}, is_medical=False, unsupported_modality=True), "ct_slice"),
+    (lb.build_report({}, is_medical=False), "guardrail"),
+    (lb.build_report({**_NORMAL, "Effusion": 0.7}, is_medical=True), "medium_confidence"),
+])
+def test_escalates_to_gemini(report, reason):
+    cascade, remote = _cascade(report)
+    result = _run(cascade)
+    assert remote.calls == 1
+    assert result.analysis.metadata["modality"] == "CT"
+    assert result.metadata["route"]["backend"] == "gemini"
+    assert result.metadata["route"]["reasons"][0] == reason
+    assert "Escalated to Gemini" in result.audit.entries[0].message
+    assert any(stage.startswith("gemini.") for stage in result.metadata["timings"])
+    assert cascade.stats[reason] == 1 and cascade.escalation_rate == 1.0
+
+
+def test_reasons_of_a_ct_rejection():
+    local = _pipeline(lambda image, prompt: lb.build_report({}, False, unsupported_modality=True))
+    result = local.run(Image.new("RGB", (8, 8)), "x")
+    assert escalation_reasons(result) == ["ct_slice", "guardrail", "low_confidence"]
+
+
+def test_failed_escalation_returns_the_local_report():
+    remote = _Remote(error=TimeoutError("no Gemini response within 120s"))
+    cascade, _ = _cascade(lb.build_report({**_NORMAL, "Effusion": 0.7}, is_medical=True), remote)
+    result = _run(cascade)
+    assert result.analysis.confidence == "Medium"
+    assert result.metadata["route"]["backend"] == "local"
+    assert result.audit.entries[0].action_type == "flag"
+    assert "TimeoutError" in result.audit.entries[0].message
+    assert cascade.stats["escalation_failed"] == 1
+
+
+def test_escalation_rate_over_mixed_traffic():
+    reports = [lb.build_report(_NORMAL, is_medical=True)] * 3 + [
+        lb.build_report({}, is_medical=False, unsupported_modality=True)
+    ]
+    queue = iter(reports)
+    remote = _Remote()
+    cascade = CascadePipeline(_pipeline(lambda image, prompt: next(queue)), remote)
+    for _ in reports:
+        _run(cascade)
+    assert cascade.escalation_rate == 0.25
+    assert cascade.stats["studies"] == 4 and remote.calls == 1
+
+
+# ── latency hedge ─────────────────────────────────────────────────────────────
+
+
+class _SlowModel:
+    """Async Gemini stand-in answering after ``latency`` seconds; records
+    whether its request was cancelled."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.cancelled = False
+
+    async def generate_content_async(self, contents, **kwargs):
+        try:
+            await asyncio.sleep(self.latency)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return type("Response", (), {"text": json.dumps(_GEMINI)})()
+
+
+def _hedged(latency, local_report, budget=0.1, local_delay=0.0, fallback_workers=None):
+    model = _SlowModel(latency)
+    primary = build_async_pipeline(model, cache=None, rate_per_minute=60_000, deadline=5.0,
+                                   policy=gb.RetryPolicy(1, 0.01, 0.01), rng=random.Random(0))
+
+    def local_fn(image, prompt):
+        time.sleep(local_delay)
+        return local_report
+
+    hedged = HedgedPipeline(primary, _pipeline(local_fn), budget,
+                            fallback_workers=fallback_workers)
+    return hedged, model
+
+
+def test_fast_gemini_is_not_hedged():
+    hedged, model = _hedged(0.0, lb.build_report(_NORMAL, is_medical=True), budget=2.0)
+    result = _run(hedged)
+    assert result.analysis.metadata["modality"] == "CT"
+    assert result.metadata["hedge"]["hedged"] is False
+    assert result.audit.entries[0].rule_name == "latency_hedge"
+    assert result.audit.summary() == []  # a non-event stays out of the summary
+    assert hedged.stats["hedged"] == 0 and hedged.stats["primary_won"] == 1
+    hedged.client.close()
+
+
+def test_slow_gemini_loses_to_a_local_chest_report_and_is_cancelled():
+    hedged, model = _hedged(3.0, lb.build_report(_NORMAL, is_medical=True))
+    started = time.monotonic()
+    result = _run(hedged)
+    assert time.monotonic() - started < 1.0
+    assert result.metadata["hedge"]["backend"] == "local"
+    assert result.analysis.confidence == "High"
+    assert "cancelled" in result.audit.entries[0].message
+    assert hedged.stats["fallback_won"] == 1 and hedged.stats["primary_cancelled"] == 1
+    deadline = time.monotonic() + 2.0
+    while not model.cancelled and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert model.cancelled and hedged.client.stats["cancelled"] == 1
+    hedged.client.close()
+
+
+def test_non_chest_image_waits_for_gemini():
+    hedged, _ = _hedged(0.3, lb.build_report({}, is_medical=False, unsupported_modality=True))
+    result = _run(hedged)
+    assert result.metadata["hedge"] == {
+        "backend": "gemini", "hedged": True, "budget": 0.1,
+        "seconds": result.metadata["hedge"]["seconds"],
+    }
+    assert result.analysis.metadata["modality"] == "CT"
+    assert hedged.stats["fallback_rejected"] == 1 and hedged.stats["primary_won"] == 1
+    hedged.client.close()
+
+
+def test_gemini_answering_first_after_the_hedge_wins():
+    hedged, _ = _hedged(0.2, lb.build_report(_NORMAL, is_medical=True), local_delay=1.0)
+    result = _run(hedged)
+    assert result.metadata["hedge"]["backend"] == "gemini"
+    assert hedged.stats["hedged"] == 1 and hedged.stats["primary_won"] == 1
+    hedged.client.close()
+
+
+def test_queued_local_run_is_cancelled_when_gemini_wins():
+    hedged, _ = _hedged(0.3, lb.build_report(_NORMAL, is_medical=True), fallback_workers=1)
+    busy = threading.Event()
+    hedged._fallback_pool.submit(busy.wait, 5)  # another study holds the only local worker
+    result = _run(hedged)
+    busy.set()
+    assert result.metadata["hedge"]["backend"] == "gemini"
+    assert hedged.stats["hedged"] == 1 and hedged.stats["fallback_cancelled"] == 1
+    hedged.client.close()
+
+
+def test_gemini_failure_falls_back_or_raises():
+    local = _pipeline(lambda image, prompt: lb.build_report(_NORMAL, is_medical=True))
+    hedged = HedgedPipeline(_Remote(error=ConnectionError("reset")), local, budget=5.0)
+    started = time.monotonic()
+    result = _run(hedged)
+    assert time.monotonic() - started < 1.0  # no wait for the budget
+    assert result.metadata["hedge"]["backend"] == "local"
+    assert "ConnectionError" in result.audit.entries[0].message
+
+    ct = _pipeline(lambda image, prompt: lb.build_report({}, False, unsupported_modality=True))
+    hedged = HedgedPipeline(_Remote(error=ConnectionError("reset")), ct, budget=5.0)
+    with pytest.raises(ConnectionError):
+        _run(hedged)
+    assert hedged.stats["primary_failed"] == 1
+
+
+def test_tail_latency_percentiles():
+    hedged = HedgedPipeline(_Remote(), _Remote())
+    assert hedged.latency_percentiles() == {}
+    hedged.latencies.extend(i / 100 for i in range(1, 101))
+    assert hedged.latency_percentiles() == {"p50": 0.5, "p95": 0.95, "p99": 0.99}
@@ -41,6 +41,7 @@ def _make_pipeline_result(action_type=None, confidence="High", is_medical=True):
     result = MagicMock()
     result.analysis = analysis
     result.audit = audit
+    result.metadata = {"timings": {"model": 0.2, "guardrails": 0.001}}
     return result
 
 
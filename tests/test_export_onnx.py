@@ -0,0 +1,70 @@
+"""Offline tests for the fused-graph export in tools/export_onnx.py, and for
+local_backend's IOBinding path on real onnxruntime sessions.
+
+The benchmark's stand-in graph (same I/O as the real model) is fused and run
+through local_backend, so no PyTorch or model download is needed.
+Run: pytest tests/test_export_onnx.py
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tools"))
+
+import export_onnx  # noqa: E402
+import local_backend as lb  # noqa: E402
+from benchmark import stand_in_model  # noqa: E402
+
+
+@pytest.fixture
+def models(tmp_path):
+    plain, fused = str(tmp_path / "plain.onnx"), str(tmp_path / "fused.onnx")
+    stand_in_model(plain)
+    assert export_onnx.fuse(plain, fused) == 0
+    return plain, fused
+
+
+def _predict_with(monkeypatch, path, image):
+    monkeypatch.setattr(lb, "_ONNX_PATH", path)
+    monkeypatch.setattr(lb, "_pool", None)
+    monkeypatch.setattr(lb, "_cache", False)
+    return lb.get_session_pool().layout, lb.predict_probabilities(image)
+
+
+def test_fused_graph_matches_plain_graph(models, monkeypatch):
+    plain, fused = models
+    film = Image.fromarray(
+        (np.random.default_rng(1).random((300, 260)) * 255).astype(np.uint8), mode="L"
+    )
+
+    plain_layout, want = _predict_with(monkeypatch, plain, film)
+    fused_layout, got = _predict_with(monkeypatch, fused, film)
+
+    assert plain_layout == lb.GraphLayout(uint8_input=False, probabilities=False)
+    assert fused_layout == lb.GraphLayout(uint8_input=True, probabilities=True)
+    assert got == pytest.approx(want, abs=1e-5)
+
+
+def test_compare_fused_passes_on_synthetic_films(models):
+    plain, fused = models
+    assert export_onnx.compare_fused(None, 4, source=plain, target=fused) == 0
+
+
+def test_bound_run_matches_plain_session_run(models, monkeypatch):
+    monkeypatch.setattr(lb, "_ONNX_PATH", models[0])
+    monkeypatch.setattr(lb, "_pool", None)
+    views = [np.full((224, 224), v, np.uint8) for v in (0, 90, 255)]
+
+    bound = lb._run_session(views)
+    with lb.get_session_pool().session() as session:
+        plain = session.run(None, {"img": lb._normalise(np.stack(views)[:, None])})[0]
+        assert hasattr(session, "io_binding")  # the IOBinding path, not the fallback
+
+    np.testing.assert_allclose(bound, plain, rtol=1e-6)
+    assert lb._run_session(views[:1]) == pytest.approx(plain[:1])
@@ -0,0 +1,343 @@
+"""Offline tests for the async Gemini client (gemini_backend.py).
+
+A fake model stands in for ``genai.GenerativeModel``: its
+``generate_content_async`` sleeps for an injected latency and raises scripted
+API errors, so no network or API key is needed.
+Run: pytest tests/test_gemini_backend.py
+"""
+import asyncio
+import io
+import json
+import random
+import threading
+import time
+import types
+from concurrent.futures import CancelledError
+
+import pytest
+from PIL import Image
+
+import gemini_backend as gb
+from radiology_pipeline import build_async_pipeline, build_pipeline
+
+_REPORT = {
+    "modality": "CT", "view": "Axial", "is_medical_image": True,
+    "impression": "No acute abnormality.", "confidence_level": "High",
+    "key_findings": "Unremarkable.", "per_structure_findings": [],
+    "recommendation": "Routine follow-up.",
+}
+
+
+class _ApiError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+class _FakeModel:
+    """Answers after ``latency`` seconds; ``errors`` is a list of HTTP codes
+    raised by the first calls, one per call, before answers start."""
+
+    def __init__(self, latency=0.0, errors=(), error_rate=0.0, seed=0):
+        self.latency = latency
+        self.errors = list(errors)
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.calls = []
+        self.contents = []
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+
+    async def generate_content_async(self, contents, **kwargs):
+        with self._lock:
+            self.calls.append((time.monotonic(), kwargs))
+            self.contents.append(contents)
+            error = self.errors.pop(0) if self.errors else None
+            if error is None and self.rng.random() < self.error_rate:
+                error = 503
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            if error is not None:
+                raise _ApiError(error)
+            prompt = contents[0]
+            return type("Response", (), {"text": json.dumps({**_REPORT, "impression": prompt})})()
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def _client(model, **options):
+    options = {
+        "max_concurrency": 4, "rate_per_minute": 60_000, "burst": 100,
+        "policy": gb.RetryPolicy(max_attempts=4, base=0.01, cap=0.05),
+        "deadline": 5.0, "rng": random.Random(0), **options,
+    }
+    return gb.AsyncGeminiClient(model, **options)
+
+
+def _image():
+    return Image.new("RGB", (32, 32))
+
+
+def test_requests_overlap_within_the_concurrency_limit():
+    model = _FakeModel(latency=0.05)
+    client = _client(model, max_concurrency=8)
+
+    async def main():
+        return await asyncio.gather(*(client.generate(_image(), f"p{i}") for i in range(40)))
+
+    started = time.monotonic()
+    texts = asyncio.run(main())
+    elapsed = time.monotonic() - started
+    assert [json.loads(t)["impression"] for t in texts] == [f"p{i}" for i in range(40)]
+    assert model.peak_in_flight == 8
+    assert elapsed < 40 * 0.05 / 2  # far from serial
+    assert model.calls[0][1]["generation_config"]["response_mime_type"] == "application/json"
+    client.close()
+
+
+def test_retryable_errors_are_retried_then_succeed():
+    model = _FakeModel(errors=[429, 503, 500])
+    client = _client(model)
+    assert json.loads(client(_image(), "x"))["impression"] == "x"
+    assert client.stats["attempts"] == 4
+    assert client.stats["retries"] == 3 and client.stats["throttled"] == 1
+    client.close()
+
+
+def test_client_errors_and_exhausted_retries_raise():
+    model = _FakeModel(errors=[400])
+    client = _client(model)
+    with pytest.raises(_ApiError, match="400"):
+        client(_image(), "x")
+    assert client.stats["attempts"] == 1
+
+    model.errors = [503] * 4
+    with pytest.raises(_ApiError, match="503"):
+        client(_image(), "x")
+    assert client.stats["attempts"] == 1 + 4 and client.stats["failed"] == 2
+    client.close()
+
+
+def test_deadline_bounds_the_whole_study():
+    client = _client(_FakeModel(latency=2.0), deadline=0.1)
+    started = time.monotonic()
+    with pytest.raises(gb.GeminiDeadlineExceeded):
+        client(_image(), "x")
+    assert time.monotonic() - started < 1.0
+    assert client.stats["deadline_exceeded"] == 1
+    client.close()
+
+
+def test_token_bucket_paces_request_starts():
+    model = _FakeModel()
+    client = _client(model, rate_per_minute=60 * 50, burst=2)  # 50/s
+
+    async def main():
+        await asyncio.gather(*(client.generate(_image(), "x") for i in range(12)))
+
+    asyncio.run(main())
+    starts = sorted(t for t, _ in model.calls)
+    # two burst tokens, then ten more at 20 ms spacing
+    assert starts[-1] - starts[0] >= 10 * 0.02 * 0.9
+    client.close()
+
+
+def test_429_pauses_everyone():
+    bucket = gb.TokenBucket(rate=1000, capacity=10)
+
+    async def main():
+        await bucket.acquire()
+        bucket.pause(0.1)
+        started = time.monotonic()
+        await bucket.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(main()) >= 0.09
+
+
+def test_throughput_under_injected_errors():
+    model = _FakeModel(latency=0.02, error_rate=0.2, seed=3)
+    client = _client(model, max_concurrency=20, policy=gb.RetryPolicy(8, 0.005, 0.02))
+    futures = [client.submit(_image(), f"p{i}") for i in range(200)]
+    texts = [f.result() for f in futures]
+    assert len(texts) == 200
+    assert client.stats["requests"] == 200 and client.stats["retries"] > 0
+    assert client.stats["failed"] == 0
+    client.close()
+
+
+def test_async_pipeline_runs_the_guardrails():
+    pipeline = build_async_pipeline(_FakeModel(errors=[503]), **{
+        "policy": gb.RetryPolicy(3, 0.01, 0.01), "rate_per_minute": 6000,
+    })
+    result = pipeline.run(_image(), "No acute abnormality.", context={"scan_type": "radiology"})
+    assert result.status == "ok"
+    assert result.analysis.metadata["modality"] == "CT"
+    assert pipeline.client.stats["retries"] == 1
+    assert "model" in result.metadata["timings"]
+    assert "upload_encode" in result.metadata["timings"]
+    pipeline.client.close()
+
+
+# ── upload encoding ───────────────────────────────────────────────────────────
+
+
+def test_encode_upload_caps_size_and_sends_a_grey_film_as_one_channel():
+    film = Image.new("RGB", (1700, 2000), (120, 120, 120))  # as the enhancer returns it
+    upload = gb.encode_upload(film, gb.UploadEncoding(max_side=1000, greyscale=True, format="jpeg", quality=80))
+    assert upload.size == (850, 1000)
+    assert upload.part["mime_type"] == "image/jpeg"
+    sent = Image.open(io.BytesIO(upload.part["data"]))
+    assert (sent.format, sent.mode, sent.size) == ("JPEG", "L", (850, 1000))
+    assert upload.nbytes == len(upload.part["data"]) and upload.seconds > 0
+
+    small = gb.encode_upload(_image(), gb.UploadEncoding(max_side=1000, greyscale=False, format="png"))
+    sent = Image.open(io.BytesIO(small.part["data"]))
+    assert (sent.format, sent.mode, sent.size) == ("PNG", "RGB", (32, 32))  # never upscaled
+
+    with pytest.raises(ValueError, match="format"):
+        gb.encode_upload(film, gb.UploadEncoding(format="webp"))
+
+
+def test_encode_upload_keeps_the_colour_of_a_colour_image():
+    photo = Image.new("RGB", (1200, 900), (220, 30, 30))
+    photo.putpixel((0, 0), (10, 10, 10))
+    assert not gb.is_greyscale(photo) and gb.is_greyscale(photo.convert("L").convert("RGB"))
+    upload = gb.encode_upload(photo, gb.UploadEncoding(max_side=600, greyscale=True, format="png"))
+    sent = Image.open(io.BytesIO(upload.part["data"]))
+    assert (sent.mode, sent.size) == ("RGB", (600, 450))
+    assert sent.getpixel((300, 200)) == (220, 30, 30)
+
+
+def test_client_sends_the_encoded_film_and_counts_bytes(tmp_path):
+    model = _FakeModel(errors=[503])
+    encoding = gb.UploadEncoding(max_side=16, greyscale=True, format="png")
+    client = _client(model, upload=encoding, cache=_cache(tmp_path))
+    client(_image(), "x")
+    prompt, part = model.contents[-1]
+    assert prompt == "x" and part["mime_type"] == "image/png"
+    assert Image.open(io.BytesIO(part["data"])).size == (16, 16)
+    assert client.stats["bytes_sent"] == 2 * len(part["data"])  # retried once
+
+    raw = _client(model, upload=None, cache=_cache(tmp_path))
+    raw(_image(), "x")  # another encoding: not served from the first one's cache entry
+    assert isinstance(model.contents[-1][1], Image.Image)
+    assert raw.stats["cache_hits"] == 0 and raw.stats["bytes_sent"] == 0
+    client.close()
+    raw.close()
+
+
+def test_close_cancels_requests_in_flight():
+    client = _client(_FakeModel(latency=1.0))
+    future = client.submit(_image(), "x")
+    time.sleep(0.1)
+    client.close()
+    with pytest.raises(CancelledError):
+        future.result(timeout=3)
+    assert future.cancelled()
+
+
+# ── response cache ────────────────────────────────────────────────────────────
+
+
+def _cache(tmp_path, **options):
+    from result_cache import ResultCache
+
+    return gb.ResponseCache(ResultCache(max_entries=0, directory=str(tmp_path)), **options)
+
+
+def test_cached_responses_survive_a_restart(tmp_path):
+    model = _FakeModel()
+    first = _client(model, cache=_cache(tmp_path))
+    text = first(_image(), "x")
+    first.close()
+
+    again = _client(model, cache=_cache(tmp_path))  # a new process, same directory
+    assert again(_image(), "x") == text
+    assert len(model.calls) == 1
+    assert again.stats["cache_hits"] == 1 and again.stats["requests"] == 0
+
+    again(_image(), "y")  # another prompt
+    again(Image.new("RGB", (32, 32), "white"), "x")  # other pixels
+    _client(model, cache=_cache(tmp_path, model_name="gemini-other"))(_image(), "x")
+    assert len(model.calls) == 4
+    again.close()
+
+
+def test_ttl_and_bypass(tmp_path):
+    now = [1000.0]
+    model = _FakeModel()
+    client = _client(model, cache=_cache(tmp_path, ttl=60, clock=lambda: now[0]))
+    client(_image(), "x")
+    now[0] += 30
+    client(_image(), "x")
+    assert len(model.calls) == 1
+    now[0] += 31  # 61 s after the first answer
+    client(_image(), "x")
+    assert len(model.calls) == 2
+
+    client.bypass_cache = True
+    client(_image(), "x")
+    assert len(model.calls) == 3
+    client.bypass_cache = False
+    now[0] += 59  # the bypassed call refreshed the entry
+    client(_image(), "x")
+    assert len(model.calls) == 3
+    client.close()
+
+
+def test_failures_and_non_json_are_not_cached(tmp_path):
+    cache = _cache(tmp_path)
+    model = _FakeModel(errors=[400])
+    client = _client(model, cache=cache)
+    with pytest.raises(_ApiError):
+        client(_image(), "x")
+    client(_image(), "x")
+    assert len(model.calls) == 2
+
+    key = cache.key(_image(), "z")
+    cache.put(key, "not json")
+    assert cache.get(key) is None
+    client.close()
+
+
+def test_default_cache_is_keyed_by_the_model_system_instruction(monkeypatch, tmp_path):
+    monkeypatch.setattr(gb, "_CACHE_SIZE", 0)
+    content = types.SimpleNamespace(parts=[types.SimpleNamespace(text="Answer in French.")])
+    french = types.SimpleNamespace(model_name="models/gemini-x", _system_instruction=content)
+    assert gb.system_instruction_of(french) == "Answer in French."
+    assert gb.system_instruction_of(_FakeModel()) == gb.SYSTEM_INSTRUCTION
+
+    default = gb.default_response_cache(_FakeModel(), str(tmp_path))
+    assert default.key(_image(), "x") != gb.default_response_cache(french, str(tmp_path)).key(
+        _image(), "x"
+    )
+    explicit = gb.default_response_cache(french, str(tmp_path), gb.SYSTEM_INSTRUCTION)
+    assert explicit.key(_image(), "x") == gb.ResponseCache(
+        explicit.store, model_name="gemini-x"
+    ).key(_image(), "x")
+
+
+class _SyncModel:
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, contents, **kwargs):
+        self.calls += 1
+        return types.SimpleNamespace(text=json.dumps(_REPORT))
+
+
+def test_sync_pipeline_caches_responses(monkeypatch, tmp_path):
+    monkeypatch.setattr(gb, "_CACHE_DIR", str(tmp_path))
+    model = _SyncModel()
+    pipeline = build_pipeline(model)
+    for _ in range(2):
+        assert pipeline.run(_image(), "x").analysis.confidence == "High"
+    assert model.calls == 1
+
+    build_pipeline(model, cached=False).run(_image(), "x")
+    assert model.calls == 2
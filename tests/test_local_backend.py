@@ -8,6 +8,7 @@ the existing vlm-guard rules fire correctly off it.
 Run: pytest tests/test_local_backend.py
 """
 import json
+import types
 
 import numpy as np
 import pytest
@@ -15,6 +16,7 @@ from PIL import Image
 
 import local_backend as lb
 from radiology_pipeline import RADIOLOGY_JSON_SCHEMA, build_local_pipeline, parse_to_analysis
+from tests.conftest import FakeSession
 
 _SEVERITY_ENUM = set(
     RADIOLOGY_JSON_SCHEMA["properties"]["per_structure_findings"]["items"][
@@ -152,6 +154,47 @@ def test_report_findings_sorted_by_probability():
     assert severities[0].startswith("Cardiomegaly")  # highest prob first
 
 
+def test_report_per_pathology_thresholds():
+    probs = {name: 0.3 for name in lb.PATHOLOGIES}
+    probs["Nodule"] = 0.35
+    thresholds = tuple(0.25 if name == "Nodule" else 0.5 for name in lb.PATHOLOGIES)
+    report = lb.build_report(probs, is_medical=True, bands=lb.ReportBands(thresholds))
+    assert [f["observation"] for f in report["per_structure_findings"]] == [
+        "Nodule (probability 35%)"
+    ]
+    # A negative read is only decisive if every pathology clears its own margin.
+    probs["Nodule"] = 0.18
+    assert lb.build_report(probs, True, bands=lb.ReportBands(thresholds))["confidence_level"] == "Medium"
+    assert lb.build_report(probs, True, bands=lb.ReportBands(0.5))["confidence_level"] == "High"
+
+
+def test_per_pathology_table_loads_once_as_arrays(tmp_path):
+    path = tmp_path / "bands.json"
+    path.write_text(json.dumps({
+        "thresholds": {"Nodule": 0.2},
+        "severity": {"Nodule": [0.3, 0.4, 0.5]},
+    }))
+    bands = lb.load_bands(str(path))
+    table = lb.report_table(bands)
+    assert lb.report_table(bands) is table
+    assert table.thresholds.shape == (len(lb.PATHOLOGIES),)
+    assert table.severity.shape == (len(lb.PATHOLOGIES), 3)
+    assert not table.severity.flags.writeable
+
+    probs = {name: 0.1 for name in lb.PATHOLOGIES}
+    probs.update({"Nodule": 0.45, "Mass": 0.7})
+    findings = lb.build_report(probs, True, bands=bands)["per_structure_findings"]
+    assert [(f["observation"].split()[0], f["severity"]) for f in findings] == [
+        ("Mass", "moderate"), ("Nodule", "severe"),
+    ]
+    row = np.array([[probs[name] for name in lb.PATHOLOGIES]])
+    assert lb.build_reports(row, bands)[0]["per_structure_findings"] == findings
+
+    path.write_text(json.dumps({"thresholds": {}, "severity": {"Nodule": [0.5, 0.4, 0.6]}}))
+    with pytest.raises(ValueError, match="ascending"):
+        lb.load_bands(str(path))
+
+
 def test_report_non_medical():
     report = lb.build_report({}, is_medical=False)
     _assert_schema_shaped(report)
@@ -181,6 +224,31 @@ def test_pipeline_runs_with_local_backend(monkeypatch):
     assert "critical" in result.analysis.metadata["severity_list"]
     assert isinstance(result.audit.summary(), list)
 
+    timings = result.metadata["timings"]
+    assert {"enhance", "model", "gates", "preprocess", "inference", "template",
+            "parse", "guardrails", "guardrails.severity_consistency_check"} <= set(timings)
+    assert timings["model"] >= timings["inference"]
+
+
+def test_structured_pipeline_matches_string_contract(monkeypatch):
+    from radiology_pipeline import TimedPipeline, engine, parse_raw
+
+    probs = {name: 0.1 for name in lb.PATHOLOGIES}
+    probs["Effusion"] = 0.7
+    monkeypatch.setattr(lb, "looks_like_xray", lambda img: True)
+    monkeypatch.setattr(lb, "predict_probabilities", lambda img: probs)
+    string_pipeline = TimedPipeline(
+        model_fn=lb.local_model_fn, parser_fn=parse_raw, guardrail_engine=engine
+    )
+    structured_pipeline = TimedPipeline(
+        model_fn=lb.local_model_fn_structured, parser_fn=parse_raw, guardrail_engine=engine
+    )
+
+    a = string_pipeline.run(_grey_image(), "x", context={})
+    b = structured_pipeline.run(_grey_image(), "x", context={})
+    assert a.analysis == b.analysis
+    assert json.loads(a.raw_output) == json.loads(b.raw_output)
+
 
 def test_pipeline_blocks_non_xray(monkeypatch):
     monkeypatch.setattr(lb, "looks_like_xray", lambda img: False)
@@ -195,3 +263,496 @@ def test_pipeline_blocks_non_xray(monkeypatch):
     actions = [e["action"] for e in result.audit.summary()]
     assert "block" in actions
     assert result.analysis.metadata["is_medical_image"] is False
+
+
+# ── batched inference (session faked) ────────────────────────────────────────
+
+
+def _flat_image(value):
+    return Image.new("L", (64, 64), color=value).convert("RGB")
+
+
+def test_batch_runs_one_session_call(fake_session, monkeypatch):
+    session = fake_session
+    monkeypatch.setattr(lb, "_cache", False)  # compare against fresh single runs
+    images = [_flat_image(v) for v in (0, 64, 128, 255)]
+
+    batched = lb.predict_probabilities_batch(images)
+    assert session.batches == [(4, 1, 224, 224)]
+
+    singles = [lb.predict_probabilities(img) for img in images]
+    for got, want in zip(batched, singles):
+        assert got == pytest.approx(want)
+    # Order preserved: brighter input → higher logit → higher probability.
+    tops = [p["Atelectasis"] for p in batched]
+    assert tops == sorted(tops)
+
+
+def test_batch_chunks_by_batch_size(fake_session):
+    lb.predict_probabilities_batch([_flat_image(v) for v in range(5)], batch_size=2)
+    assert [shape[0] for shape in fake_session.batches] == [2, 2, 1]
+
+
+def test_fused_graph_gets_pixels_and_returns_probabilities(fake_session):
+    fake_session.metadata = {"chexnet.input": "uint8", "chexnet.output": "probabilities"}
+    fed = []
+    fake_session.run = lambda names, feeds: fed.append(feeds["image"]) or [
+        np.full((len(feeds["image"]), len(lb.PATHOLOGIES)), 0.75, np.float32)
+    ]
+
+    probs = lb.predict_probabilities(_flat_image(200))
+
+    assert fed[0].dtype == np.uint8 and fed[0].shape == (1, 1, 224, 224)
+    assert set(probs.values()) == {0.75}  # passed through, no second sigmoid
+
+
+def test_plain_graph_outputs_get_sigmoid():
+    logits = np.array([[-2.0, 0.0, 0.5, 3.0]], np.float32)  # mixed in/out of [0, 1]
+    got = lb._to_probabilities(logits, lb.GraphLayout(False, False))
+    assert got == pytest.approx(1.0 / (1.0 + np.exp(-logits)))
+
+
+def test_io_buffers_are_reused_and_aligned(fake_session, monkeypatch):
+    monkeypatch.setattr(lb, "_cache", False)
+    fed = []
+    run = fake_session.run
+    fake_session.run = lambda names, feeds: fed.append(feeds["image"]) or run(names, feeds)
+
+    lb.predict_probabilities_batch([_flat_image(v) for v in (10, 20)])
+    buffers = lb.get_session_pool().buffers(fake_session, 1)
+    lb.predict_probabilities(_flat_image(30))
+
+    assert lb.get_session_pool().buffers(fake_session, 2) is buffers
+    assert buffers.inputs.ctypes.data % 64 == 0 and buffers.outputs.ctypes.data % 64 == 0
+    assert all(np.shares_memory(batch, buffers.inputs) for batch in fed)
+    assert fed[-1][0] == pytest.approx(lb._preprocess(_flat_image(30))[0])
+
+
+def test_model_fn_batch_skips_gated_images(fake_session, monkeypatch):
+    session = fake_session
+    monkeypatch.setattr(lb, "looks_like_xray", lambda p: p.source.size != (32, 32))
+    monkeypatch.setattr(lb, "looks_like_ct_slice", lambda img: False)
+    images = [_flat_image(200), Image.new("RGB", (32, 32)), _flat_image(50)]
+
+    reports = [json.loads(r) for r in lb.local_model_fn_batch(images, "x")]
+
+    assert session.batches == [(2, 1, 224, 224)]
+    assert [r["is_medical_image"] for r in reports] == [True, False, True]
+    for report in reports:
+        _assert_schema_shaped(report)
+
+
+# ── micro-batching scheduler ──────────────────────────────────────────────────
+
+
+def test_microbatcher_coalesces_concurrent_requests():
+    import threading
+
+    sizes = []
+    release = threading.Event()
+
+    def run_batch(images):
+        sizes.append(len(images))
+        release.wait(timeout=5)  # hold the first batch so the rest pile up
+        return [{"id": img.size[0]} for img in images]
+
+    batcher = lb.MicroBatcher(max_batch_size=8, max_wait_ms=50, run_batch=run_batch)
+    results = {}
+
+    def call(i):
+        results[i] = batcher.submit(Image.new("L", (i + 1, 1)))
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(5)]
+    threads[0].start()
+    while not sizes:  # first request is in flight on its own
+        pass
+    for t in threads[1:]:
+        t.start()
+    release.set()
+    for t in threads:
+        t.join(timeout=5)
+
+    assert sizes[0] == 1
+    assert sum(sizes) == 5 and len(sizes) < 5  # the four stragglers were batched
+    assert results == {i: {"id": i + 1} for i in range(5)}  # each caller got its own
+
+
+def test_microbatcher_lone_request_does_not_wait():
+    import time
+
+    batcher = lb.MicroBatcher(max_wait_ms=2000, run_batch=lambda imgs: [{}] * len(imgs))
+    start = time.monotonic()
+    batcher.submit(Image.new("L", (1, 1)))
+    assert time.monotonic() - start < 1.0
+
+
+def test_microbatcher_propagates_errors():
+    def run_batch(images):
+        raise RuntimeError("session failed")
+
+    batcher = lb.MicroBatcher(run_batch=run_batch)
+    with pytest.raises(RuntimeError, match="session failed"):
+        batcher.submit(Image.new("L", (1, 1)))
+
+
+def test_predict_routes_through_scheduler(fake_session, monkeypatch):
+    monkeypatch.setattr(lb, "_MICROBATCH", True)
+    monkeypatch.setattr(lb, "_scheduler", None)
+    probs = lb.predict_probabilities(_flat_image(100))
+    assert set(probs) == set(lb.PATHOLOGIES)
+    assert lb._scheduler is not None
+
+
+# ── logit cache ───────────────────────────────────────────────────────────────
+
+
+def test_cache_hit_skips_inference(fake_session):
+    image = _flat_image(90)
+    first = lb.predict_probabilities(image)
+    second = lb.predict_probabilities(image.copy())  # same pixels, new object
+    assert second == first
+    assert len(fake_session.batches) == 1
+
+
+def test_batch_runs_only_cache_misses(fake_session):
+    lb.predict_probabilities(_flat_image(1))
+    lb.predict_probabilities_batch([_flat_image(v) for v in (1, 2, 1, 3)])
+    assert fake_session.batches == [(1, 1, 224, 224), (2, 1, 224, 224)]
+
+
+def test_cache_survives_threshold_change(fake_session, monkeypatch):
+    image = _flat_image(240)
+    before = lb.predict_probabilities(image)
+    monkeypatch.setattr(lb, "DETECTION_THRESHOLD", 0.1)
+    assert lb.predict_probabilities(image) == before
+    assert len(fake_session.batches) == 1
+
+
+def test_cache_invalidated_by_reloading_a_new_model(fake_session, monkeypatch):
+    image = _flat_image(42)
+    lb.predict_probabilities(image)
+    with open(lb._ONNX_PATH, "ab") as f:
+        f.write(b"re-exported")
+    lb.predict_probabilities(image)  # the pooled session still runs the old weights
+    assert len(fake_session.batches) == 1
+    monkeypatch.setattr(lb, "_pool", None)  # reload
+    lb.predict_probabilities(image)
+    assert len(fake_session.batches) == 2
+
+
+def test_prepared_model_view_shares_the_image_cache_entry(fake_session):
+    image = _flat_image(33)
+    view = lb.ImagePyramid(image).model_view
+    assert lb.predict_probabilities(view) == lb.predict_probabilities(image)
+    assert len(fake_session.batches) == 1
+
+
+def test_cache_key_is_the_model_view(fake_session):
+    image = _flat_image(77)
+    bigger = image.resize((image.width * 2, image.height * 2))  # same 224×224 view
+    assert lb.cache_key(image) == lb.cache_key(lb.ImagePyramid(bigger))
+    assert lb.cache_key(image) != lb.cache_key(_flat_image(78))
+
+
+# ── session pool ──────────────────────────────────────────────────────────────
+
+
+def test_session_pool_bounds_and_reuses_sessions():
+    import threading
+    import time
+
+    created = []
+
+    def factory():
+        time.sleep(0.01)
+        created.append(object())
+        return created[-1]
+
+    pool = lb.SessionPool(size=2, factory=factory)
+    in_use, peak, lock = set(), [0], threading.Lock()
+
+    def worker():
+        for _ in range(5):
+            with pool.session() as session:
+                with lock:
+                    assert session not in in_use  # never lent twice at once
+                    in_use.add(session)
+                    peak[0] = max(peak[0], len(in_use))
+                time.sleep(0.002)
+                with lock:
+                    in_use.discard(session)
+
+    threads = [threading.Thread(target=worker) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(created) == 2 and peak[0] == 2
+
+    serial = lb.SessionPool(size=4, factory=object)
+    with serial.session() as first:
+        pass
+    with serial.session() as second:
+        assert second is first  # idle sessions are reused before creating more
+
+
+def test_session_pool_failed_creation_frees_its_slot():
+    attempts = []
+
+    def factory():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("model load failed")
+        return object()
+
+    pool = lb.SessionPool(size=1, factory=factory)
+    with pytest.raises(RuntimeError):
+        with pool.session():
+            pass
+    with pool.session() as session:
+        assert session is not None
+
+
+def test_session_pool_size_from_tunables(monkeypatch):
+    monkeypatch.setattr(lb, "_SESSION_POOL_SIZE", "auto")
+    monkeypatch.setattr(lb, "_INTRA_OP_THREADS", 2)
+    monkeypatch.setattr(lb.os, "cpu_count", lambda: 16)
+    assert lb._pool_size() == 8
+    monkeypatch.setattr(lb, "_SESSION_POOL_SIZE", "3")
+    assert lb._pool_size() == 3
+
+
+def test_warm_up_creates_every_pooled_session(monkeypatch, tmp_path):
+    sessions = []
+
+    def factory():
+        sessions.append(FakeSession())
+        return sessions[-1]
+
+    monkeypatch.setattr(lb, "_pool", lb.SessionPool(size=3, factory=factory))
+    lb.warm_up()
+    assert len(sessions) == 3
+    assert all(s.batches == [(1, 1, 224, 224)] for s in sessions)
+
+
+# ── warm-up ───────────────────────────────────────────────────────────────────
+
+
+def test_warm_up_runs_one_uncached_inference(fake_session):
+    assert lb.warm_up() >= 0
+    assert fake_session.batches == [(1, 1, 224, 224)]
+    assert len(lb._cache) == 0
+
+
+def test_start_warm_up_caches_a_failure_until_retried(monkeypatch, tmp_path):
+    monkeypatch.setattr(lb, "_warm_up", None)
+    monkeypatch.setattr(lb, "_ONNX_PATH", str(tmp_path / "missing.onnx"))
+    failed = lb.start_warm_up()
+    assert isinstance(failed.exception(timeout=5), FileNotFoundError)
+
+    (tmp_path / "missing.onnx").write_bytes(b"fake")
+    monkeypatch.setattr(lb, "_create_session", FakeSession)
+    monkeypatch.setattr(lb, "_pool", None)
+    assert lb.start_warm_up() is failed
+    ready = lb.start_warm_up(retry=True)
+    assert ready is not failed
+    assert ready.result(timeout=5) >= 0
+    assert lb.start_warm_up() is ready
+
+
+# ── shared image pyramid vs the full-resolution path ─────────────────────────
+
+
+def _synthetic_cxr(width, height):
+    """Smooth CXR-like film: bright mediastinum, darker lung fields, soft ribs."""
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    x, y = xx / width, yy / height
+    lungs = np.exp(-(((x - 0.3) / 0.15) ** 2 + ((y - 0.5) / 0.3) ** 2)) + np.exp(
+        -(((x - 0.7) / 0.15) ** 2 + ((y - 0.5) / 0.3) ** 2)
+    )
+    ribs = 0.15 * np.sin(y * 60.0) ** 2
+    arr = 200.0 - 120.0 * lungs + 40.0 * ribs * lungs
+    return Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8), mode="L").convert("RGB")
+
+
+def _reference_preprocess(image):
+    """The original full-resolution _preprocess, kept as the parity reference."""
+    gray = image.convert("L")
+    w, h = gray.size
+    side = min(w, h)
+    left, top = (w - side) // 2, (h - side) // 2
+    gray = gray.crop((left, top, left + side, top + side)).resize((224, 224))
+    return np.asarray(gray, dtype=np.float32)
+
+
+def _reference_xray_stats(image):
+    small = np.asarray(image.convert("RGB").resize((64, 64))).astype(np.float32)
+    return (float((small.max(axis=2) - small.min(axis=2)).mean()),
+            float(small.mean(axis=2).std()))
+
+
+@pytest.mark.parametrize("size", [(2000, 1600), (1200, 1500), (300, 300)])
+def test_pyramid_model_input_matches_full_resolution(size):
+    image = _synthetic_cxr(*size)
+    pyramid = lb.ImagePyramid(image)
+    diff = np.abs(pyramid.model_view.astype(np.float32) - _reference_preprocess(image))
+    assert diff.mean() < 1.0   # grey levels, out of 255
+    assert diff.max() <= 4.0
+
+
+@pytest.mark.parametrize("size", [(2000, 1600), (256, 256)])
+def test_pyramid_gate_stats_match_full_resolution(size):
+    image = _synthetic_cxr(*size)
+    saturation, contrast = lb._xray_stats(lb.ImagePyramid(image))
+    ref_saturation, ref_contrast = _reference_xray_stats(image)
+    assert saturation == pytest.approx(ref_saturation, abs=0.5)
+    assert contrast == pytest.approx(ref_contrast, rel=0.02)
+
+    ref_ct = np.asarray(image.convert("L").resize((96, 96)), dtype=np.float32)
+    pyr_ct = lb.ImagePyramid(image).ct_view
+    assert np.abs(pyr_ct - ref_ct).mean() < 1.0
+
+
+def test_pyramid_gates_agree_on_large_ct_and_colour():
+    yy, xx = np.mgrid[0:2048, 0:2048]
+    disk = ((xx - 1024) ** 2 + (yy - 1024) ** 2) < 880 ** 2
+    arr = np.zeros((2048, 2048), np.uint8)
+    arr[disk] = 160
+    ct = Image.fromarray(arr, mode="L").convert("RGB")
+    assert lb.looks_like_ct_slice(lb.ImagePyramid(ct)) is True
+
+    photo = Image.new("RGB", (1800, 1800), color=(200, 40, 40))
+    assert lb.looks_like_xray(lb.ImagePyramid(photo)) is False
+
+
+def test_pyramid_converts_colour_once():
+    image = _synthetic_cxr(1000, 1000)
+    pyramid = lb.ImagePyramid(image)
+    assert pyramid.base.size == (500, 500)  # reduced before any conversion
+    assert pyramid.gray is pyramid.gray    # cached, built once
+
+
+# ── reduced-resolution decode ────────────────────────────────────────────────
+
+
+def _save(image, path, **kwargs):
+    image.save(path, **kwargs)
+    return str(path)
+
+
+@pytest.mark.parametrize("fmt", ["JPEG", "PNG"])
+def test_load_image_decodes_large_films_reduced(tmp_path, fmt):
+    film = _synthetic_cxr(3000, 2400)
+    path = _save(film.convert("L"), tmp_path / f"film.{fmt.lower()}", format=fmt)
+
+    image = lb.load_image(path)
+    assert image.mode == "RGB"
+    assert 448 <= min(image.size) < 2 * 448
+
+    full = lb.load_image(path, min_side=0)
+    assert full.size == (3000, 2400)
+    diff = np.abs(
+        lb.ImagePyramid(image).model_view.astype(np.float32)
+        - lb.ImagePyramid(full).model_view.astype(np.float32)
+    )
+    assert diff.mean() < 1.5
+    assert lb.looks_like_xray(image) == lb.looks_like_xray(full)
+
+
+def test_load_image_keeps_small_images_and_modes(tmp_path):
+    small = _save(_synthetic_cxr(600, 500), tmp_path / "small.png")
+    assert lb.load_image(small).size == (600, 500)
+
+    palette = _synthetic_cxr(1200, 1200).convert("P")
+    image = lb.load_image(_save(palette, tmp_path / "p.png"))
+    assert image.mode == "RGB" and image.size == (600, 600)
+
+
+# ── model variant selection ───────────────────────────────────────────────────
+
+
+def test_model_variant_paths():
+    assert lb._resolve_model_path("fp32").endswith("chexnet.onnx")
+    assert lb._resolve_model_path("int8").endswith("chexnet.int8.onnx")
+    assert lb._resolve_model_path("fused").endswith("chexnet.fused.onnx")
+    with pytest.raises(ValueError, match="CHEXNET_MODEL_VARIANT"):
+        lb._resolve_model_path("fp16")
+
+
+def test_missing_int8_model_explains_quantize(monkeypatch, tmp_path):
+    monkeypatch.setattr(lb, "_MODEL_VARIANT", "int8")
+    monkeypatch.setattr(lb, "_ONNX_PATH", str(tmp_path / "chexnet.int8.onnx"))
+    with pytest.raises(FileNotFoundError, match="--quantize"):
+        lb.ensure_model_available()
+
+
+# ── session configuration (onnxruntime faked) ─────────────────────────────────
+
+
+def _fake_ort():
+    """Minimal stand-in for the onnxruntime module: records every session built
+    and writes the optimised-graph file when asked to, as the real one does."""
+    ort = types.SimpleNamespace(__version__="0.0-test", created=[])
+    ort.ExecutionMode = types.SimpleNamespace(ORT_SEQUENTIAL="seq", ORT_PARALLEL="par")
+    ort.GraphOptimizationLevel = types.SimpleNamespace(
+        ORT_DISABLE_ALL="off", ORT_ENABLE_BASIC="basic",
+        ORT_ENABLE_EXTENDED="extended", ORT_ENABLE_ALL="all",
+    )
+
+    class SessionOptions:
+        optimized_model_filepath = ""
+
+    def InferenceSession(path, sess_options, providers):
+        if sess_options.optimized_model_filepath:
+            with open(sess_options.optimized_model_filepath, "wb") as f:
+                f.write(b"optimised")
+        ort.created.append((path, sess_options))
+        return object()
+
+    ort.SessionOptions = SessionOptions
+    ort.InferenceSession = InferenceSession
+    return ort
+
+
+def test_session_options_from_tunables(monkeypatch):
+    monkeypatch.setattr(lb, "_INTRA_OP_THREADS", 4)
+    monkeypatch.setattr(lb, "_EXECUTION_MODE", "parallel")
+    monkeypatch.setattr(lb, "_GRAPH_OPT_LEVEL", "extended")
+    monkeypatch.setattr(lb, "_CPU_MEM_ARENA", False)
+    opts = lb._session_options(_fake_ort())
+    assert opts.intra_op_num_threads == 4
+    assert opts.inter_op_num_threads == 1
+    assert opts.execution_mode == "par"
+    assert opts.graph_optimization_level == "extended"
+    assert opts.enable_cpu_mem_arena is False
+
+
+def test_session_options_reject_unknown_level(monkeypatch):
+    monkeypatch.setattr(lb, "_GRAPH_OPT_LEVEL", "turbo")
+    with pytest.raises(ValueError, match="CHEXNET_GRAPH_OPT_LEVEL"):
+        lb._session_options(_fake_ort())
+
+
+def test_optimized_graph_saved_then_reused(monkeypatch, tmp_path):
+    import sys
+
+    ort = _fake_ort()
+    model = tmp_path / "chexnet.onnx"
+    model.write_bytes(b"fake")
+    monkeypatch.setitem(sys.modules, "onnxruntime", ort)
+    monkeypatch.setattr(lb, "_ONNX_PATH", str(model))
+    monkeypatch.setattr(lb, "_OPTIMIZED_MODEL_DIR", str(tmp_path / "opt"))
+
+    lb._create_session()  # cold start: optimise and save
+    lb._create_session()  # warm start: load the saved graph
+
+    (first_path, first_opts), (second_path, second_opts) = ort.created
+    assert first_path == str(model)
+    assert first_opts.graph_optimization_level == "all"
+    cached = list((tmp_path / "opt").glob("*.opt.onnx"))
+    assert [str(p) for p in cached] == [second_path]
+    assert second_opts.graph_optimization_level == "off"
+
+    model.write_bytes(b"re-exported")  # new model identity → new cache entry
+    lb._create_session()
+    assert ort.created[-1][0] == str(model)
@@ -0,0 +1,154 @@
+"""Offline tests for the raw-output store and re-templating from it.
+
+No model is involved: rows are written directly (or by a staged batch run with
+inference monkeypatched, as in test_batch_report.py).
+Run: pytest tests/test_logit_store.py
+"""
+import io
+import json
+
+import numpy as np
+import pytest
+
+import batch_report as br
+import local_backend as lb
+from logit_store import LogitStore, retemplate
+
+
+def _logits(count, seed=0):
+    return np.random.default_rng(seed).normal(-1.5, 1.5, (count, len(lb.PATHOLOGIES)))
+
+
+@pytest.fixture
+def store(tmp_path):
+    with LogitStore.create(str(tmp_path / "s"), outputs="logits", model="m:1") as s:
+        for i, row in enumerate(_logits(5)):
+            s.append(f"film{i}.png", row)
+    return str(tmp_path / "s")
+
+
+def test_rows_round_trip_through_memmap(store):
+    with LogitStore(store) as s:
+        assert s.paths == [f"film{i}.png" for i in range(5)]
+        np.testing.assert_array_equal(s.matrix(), _logits(5).astype(np.float32))
+        assert s.probabilities(1, 3) == pytest.approx(
+            1.0 / (1.0 + np.exp(-_logits(5)[1:3])), abs=1e-6
+        )
+
+
+def test_torn_tail_is_trimmed_and_appends_continue(store):
+    with open(f"{store}/outputs.f32", "ab") as f:
+        f.write(b"\x00" * 10)  # half a row, no index line
+    with open(f"{store}/index.jsonl", "a") as f:
+        f.write('{"path": "torn')
+
+    with LogitStore.create(store, outputs="logits", model="m:1", append=True) as s:
+        assert len(s) == 5
+        s.append("film5.png", np.zeros(len(lb.PATHOLOGIES)))
+    with LogitStore(store) as s:
+        assert s.paths[-1] == "film5.png" and s.matrix().shape == (6, len(lb.PATHOLOGIES))
+
+
+def test_append_refuses_another_model(store):
+    with pytest.raises(ValueError, match="cannot append"):
+        LogitStore.create(store, outputs="logits", model="m:2", append=True)
+    with LogitStore.create(store, outputs="logits", model="m:2") as s:  # fresh store
+        assert len(s) == 0
+
+
+def test_build_reports_matches_build_report():
+    probs = 1.0 / (1.0 + np.exp(-_logits(300, seed=1))).astype(np.float32)
+    probs[0] = 0.5  # ties on the threshold keep PATHOLOGIES order
+    bands = lb.ReportBands(threshold=0.4, severity=(0.5, 0.7, 0.85))
+    expected = [
+        lb.build_report(dict(zip(lb.PATHOLOGIES, row.tolist())), True, bands=bands)
+        for row in probs
+    ]
+    assert lb.build_reports(probs, bands) == expected
+    per_pathology = bands._replace(
+        threshold=tuple(np.linspace(0.2, 0.7, len(lb.PATHOLOGIES))),
+        severity=tuple((t + 0.05, t + 0.1, t + 0.2) for t in np.linspace(0.2, 0.7, len(lb.PATHOLOGIES))),
+    )
+    assert lb.build_reports(probs, per_pathology) == [
+        lb.build_report(dict(zip(lb.PATHOLOGIES, row.tolist())), True, bands=per_pathology)
+        for row in probs
+    ]
+    assert lb.build_reports(probs[:0]) == []
+
+
+def test_retemplate_applies_new_threshold(store):
+    out_default, out_low = io.StringIO(), io.StringIO()
+    with LogitStore(store) as s:
+        retemplate(s, out_default)
+        counts = retemplate(s, out_low, lb.ReportBands(threshold=0.05))
+
+    default = [json.loads(line) for line in out_default.getvalue().splitlines()]
+    low = [json.loads(line) for line in out_low.getvalue().splitlines()]
+    assert [r["path"] for r in low] == [f"film{i}.png" for i in range(5)]
+    assert sum(counts.values()) == 5
+    findings = [len(r["analysis"]["metadata"]["per_structure"]) for r in low]
+    assert findings > [len(r["analysis"]["metadata"]["per_structure"]) for r in default]
+    assert all(isinstance(r["audit"], list) for r in low)
+
+
+def test_a_path_is_stored_once(store):
+    with LogitStore.create(store, outputs="logits", model="m:1", append=True) as s:
+        s.append("film2.png", np.zeros(len(lb.PATHOLOGIES)))
+        assert len(s) == 5
+    with LogitStore(store) as s:
+        np.testing.assert_array_equal(s.matrix()[2], _logits(5)[2].astype(np.float32))
+
+
+def _fake_inference(monkeypatch):
+    """Pass every film through the gates; its raw row is its mean pixel / 50."""
+    monkeypatch.setattr(lb, "gate_report", lambda pyramid: None)
+    monkeypatch.setattr(lb, "cache_key", lambda pyramid: None)
+    monkeypatch.setattr(
+        lb, "predict_model_views_raw",
+        lambda views, keys=None, batch_size=None: np.stack(
+            [np.full(len(lb.PATHOLOGIES), v.mean() / 50.0, np.float32) for v in views]
+        ),
+    )
+    monkeypatch.setattr(lb, "_pool", lb.SessionPool(factory=lambda: None))
+    monkeypatch.setattr(lb.SessionPool, "layout", lb.GraphLayout(False, False))
+
+
+def test_staged_batch_run_fills_the_store(tmp_path, monkeypatch):
+    from PIL import Image
+
+    from staged_pipeline import StagedLocalPipeline
+
+    for i in range(3):
+        Image.new("L", (64, 64), color=40 * i).save(tmp_path / f"{i}.png")
+    _fake_inference(monkeypatch)
+    with LogitStore.create(str(tmp_path / "s"), outputs="logits", model="m") as s:
+        br.run_staged(br.iter_inputs([str(tmp_path)]), io.StringIO(),
+                      StagedLocalPipeline(prepare_workers=2), store=s)
+        stored = dict(zip(s.paths, s.matrix()[:, 0].tolist()))
+    assert stored == pytest.approx({str(tmp_path / f"{i}.png"): 40 * i / 50.0 for i in range(3)})
+
+
+def test_resume_after_a_lost_record_stores_no_duplicates(tmp_path, monkeypatch):
+    from PIL import Image
+
+    from staged_pipeline import StagedLocalPipeline
+
+    films = tmp_path / "films"
+    films.mkdir()
+    for i in range(3):
+        Image.new("L", (64, 64), color=40 * i).save(films / f"{i}.png")
+    _fake_inference(monkeypatch)
+    output, directory = tmp_path / "out.jsonl", str(tmp_path / "s")
+
+    with open(output, "w") as out, LogitStore.create(directory, "logits", "m") as s:
+        br.run_staged(br.iter_inputs([str(films)]), out, StagedLocalPipeline(), store=s)
+    lines = output.read_text().splitlines(keepends=True)
+    output.write_text("".join(lines[:-1]) + lines[-1][:10])  # killed mid-write
+
+    skip = br.completed_paths(str(output))
+    assert len(skip) == 2
+    with open(output, "a") as out, LogitStore.create(directory, "logits", "m", append=True) as s:
+        counts = br.run_staged(br.iter_inputs([str(films)]), out, StagedLocalPipeline(),
+                               skip=skip, store=s)
+        assert counts["ok"] == 1
+        assert sorted(s.paths) == sorted(str(films / f"{i}.png") for i in range(3))
@@ -43,3 +43,26 @@ def test_unpacks_like_the_pipeline_does():
 def test_invalid_json_raises():
     with pytest.raises(json.JSONDecodeError):
         parse_raw("not json")
+
+
+# ── structured fast path (in-process backends) ────────────────────────────────
+
+
+def test_dict_matches_string_path():
+    from_string, _ = parse_raw(json.dumps(_VALID))
+    from_dict, raw_output = parse_raw(dict(_VALID))
+    assert from_dict == from_string
+    assert json.loads(raw_output) == _VALID  # raw_output stays a string
+
+
+def test_prebuilt_analysis_passes_through():
+    analysis, _ = parse_raw(json.dumps(_VALID))
+    same, raw_output = parse_raw(analysis)
+    assert same is analysis
+    assert Analysis.model_validate_json(raw_output) == analysis
+
+
+def test_dict_missing_field_raises():
+    broken = {k: v for k, v in _VALID.items() if k != "impression"}
+    with pytest.raises(KeyError):
+        parse_raw(broken)
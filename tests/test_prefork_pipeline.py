@@ -0,0 +1,54 @@
+"""Offline tests for the pre-fork worker pool.
+
+The onnxruntime session is faked in the parent; forked workers inherit the
+fake exactly as they would inherit a real session. Results are checked against
+build_local_pipeline().run on the same files.
+Run: pytest tests/test_prefork_pipeline.py
+"""
+import multiprocessing
+import os
+
+import pytest
+
+import local_backend as lb
+from prefork_pipeline import PreforkLocalPipeline
+from radiology_pipeline import build_local_pipeline
+from result_cache import ResultCache
+from tests.conftest import films
+
+pytestmark = pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(), reason="needs fork"
+)
+
+
+@pytest.fixture
+def fake_session(fake_session, monkeypatch):
+    """The shared fake session, with the logit cache off."""
+    monkeypatch.setattr(lb, "_cache", ResultCache(max_entries=0))
+    return fake_session
+
+
+def test_matches_serial_pipeline_in_input_order(fake_session, tmp_path):
+    paths = films(tmp_path, 5) + [str(tmp_path / "missing.png")]
+
+    results = list(PreforkLocalPipeline(workers=3).run(iter(paths)))
+
+    # One single-threaded session, loaded in the parent before forking.
+    assert fake_session.intra_op_threads == [1]
+    assert lb._pool is None  # the parent's pool is restored afterwards
+    assert [r.path for r in results] == paths
+    assert "FileNotFoundError" in results[-1].error
+
+    serial = build_local_pipeline()
+    for r in results[:-1]:
+        expected = serial.run(
+            lb.load_image(r.path), "x", context={"scan_type": "radiology"}
+        )
+        assert r.result.analysis == expected.analysis
+        assert r.result.metadata["worker_pid"] != os.getpid()
+        assert {"decode", "gates", "guardrails"} <= set(r.timings)
+    assert "inference" in results[0].timings
+
+
+def test_empty_input(fake_session):
+    assert list(PreforkLocalPipeline(workers=2).run([])) == []
@@ -0,0 +1,53 @@
+"""Offline tests for the two-tier ResultCache (memory LRU + on-disk tier).
+
+Run: pytest tests/test_result_cache.py
+"""
+import os
+
+from result_cache import ResultCache
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ResultCache(max_entries=2)
+    cache.put("a", b"1")
+    cache.put("b", b"2")
+    assert cache.get("a") == b"1"  # touch "a" so "b" becomes the LRU entry
+    cache.put("c", b"3")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1"
+    assert cache.get("c") == b"3"
+
+
+def test_memory_tier_disabled():
+    cache = ResultCache(max_entries=0)
+    cache.put("a", b"1")
+    assert cache.get("a") is None
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    ResultCache(directory=str(tmp_path)).put("k", b"logits")
+    fresh = ResultCache(directory=str(tmp_path))
+    assert fresh.get("k") == b"logits"
+    assert len(fresh) == 1  # promoted into memory on the disk hit
+
+
+def test_disk_tier_evicts_oldest_by_size(tmp_path):
+    cache = ResultCache(max_entries=0, directory=str(tmp_path), max_bytes=250)
+    for i, key in enumerate(("old", "mid", "new")):
+        cache.put(key, bytes(100))
+        # Pin distinct mtimes so eviction order does not depend on clock resolution.
+        os.utime(tmp_path / f"{key}.bin", (1000 + i, 1000 + i))
+    cache.put("newest", bytes(100))
+    assert cache.get("old") is None
+    assert cache.get("mid") is None
+    assert cache.get("newest") == bytes(100)
+    total = sum(p.stat().st_size for p in tmp_path.glob("*.bin"))
+    assert total <= 250
+
+
+def test_clear_empties_both_tiers(tmp_path):
+    cache = ResultCache(directory=str(tmp_path))
+    cache.put("k", b"v")
+    cache.clear()
+    assert cache.get("k") is None
+    assert not list(tmp_path.glob("*.bin"))
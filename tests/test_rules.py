@@ -3,6 +3,7 @@
 No Gemini call, no API key required.
 Run: pytest tests/test_rules.py
 """
+import threading
 from unittest.mock import MagicMock
 
 import pytest
@@ -12,6 +13,7 @@ from radiology_pipeline import (
     SeverityConsistencyRule,
     engine,
 )
+from stage_timing import record
 
 
 def _make_analysis(
@@ -141,3 +143,15 @@ class TestGuardrailEngine:
         _, audit = engine.apply_with_audit(analysis, {})
         fired = [e for e in audit.summary() if e.get("modified")]
         assert len(fired) == 0
+
+    def test_lock_wait_is_timed_apart_from_the_rules(self):
+        """A run queued behind another records the wait as guardrails.wait."""
+        analysis = _make_analysis()
+        engine._lock.acquire()
+        timer = threading.Timer(0.1, engine._lock.release)
+        timer.start()
+        with record() as timings:
+            engine.apply_with_audit(analysis, {})
+        timer.join()
+        assert timings["guardrails.wait"] >= 0.09
+        assert timings["guardrails"] < timings["guardrails.wait"]
@@ -0,0 +1,58 @@
+"""Offline tests for stage_timing spans and recorders.
+
+Run: pytest tests/test_stage_timing.py -v
+"""
+import threading
+import time
+
+import stage_timing
+from stage_timing import record, span, timed
+
+
+def test_span_is_noop_outside_a_recorder():
+    assert span("x") is span("y")  # the shared null context, nothing allocated
+    with span("x"):
+        pass
+
+
+def test_spans_accumulate_by_name():
+    slow = timed("slow", lambda: time.sleep(0.01))
+    with record() as timings:
+        slow()
+        slow()
+        with span("block"):
+            pass
+    assert set(timings) == {"slow", "block"}
+    assert timings["slow"] >= 0.02
+    assert span("slow") is span("other")  # recorder closed again
+
+
+def test_recorders_are_isolated_per_thread():
+    results = {}
+
+    def worker(name, delay):
+        with record() as timings:
+            with span(name):
+                time.sleep(delay)
+        results[name] = timings
+
+    threads = [threading.Thread(target=worker, args=(f"t{i}", 0.01)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert all(set(timings) == {name} for name, timings in results.items())
+
+
+def test_record_into_existing_dict_and_disabled(monkeypatch):
+    existing = {"decode": 1.0}
+    with record(into=existing):
+        with span("parse"):
+            pass
+    assert set(existing) == {"decode", "parse"}
+
+    monkeypatch.setattr(stage_timing, "ENABLED", False)
+    with record() as timings:
+        with span("parse"):
+            pass
+    assert timings is None
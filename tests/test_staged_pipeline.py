@@ -0,0 +1,113 @@
+"""Offline tests for the staged decode → batched inference → report pipeline.
+
+The onnxruntime session is faked (tests/conftest.py); results are
+checked against build_local_pipeline().run on the same files.
+Run: pytest tests/test_staged_pipeline.py
+"""
+import time
+
+import pytest
+from PIL import Image
+
+import local_backend as lb
+from radiology_pipeline import build_local_pipeline
+from result_cache import ResultCache
+from staged_pipeline import StagedLocalPipeline
+from tests.conftest import films
+
+
+@pytest.fixture
+def fake_session(fake_session, monkeypatch):
+    """The shared fake session, with the logit cache off so every image reaches it."""
+    monkeypatch.setattr(lb, "_cache", ResultCache(max_entries=0))
+    return fake_session
+
+
+def test_matches_serial_pipeline(fake_session, tmp_path):
+    paths = films(tmp_path, 6)
+    serial = build_local_pipeline()
+    expected = {}
+    for path in paths:
+        with Image.open(path) as image:
+            expected[path] = serial.run(image.convert("RGB"), "x", context={"scan_type": "radiology"})
+    fake_session.batches.clear()
+
+    staged = StagedLocalPipeline(prepare_workers=3, batch_size=4, batch_wait_ms=200)
+    results = {r.path: r for r in staged.run(paths)}
+
+    assert set(results) == set(paths)
+    for path, want in expected.items():
+        got = results[path].result
+        assert got.analysis.model_dump() == want.analysis.model_dump()
+        assert got.audit.summary() == want.audit.summary()
+        assert got.status == want.status
+    # The colour photo was gated in stage 1 and never reached inference.
+    sizes = [shape[0] for shape in fake_session.batches]
+    assert sum(sizes) == 6
+    assert max(sizes) > 1
+    timings = results[paths[0]].timings
+    assert {"decode", "enhance", "gates", "preprocess", "inference", "template",
+            "guardrails"} <= set(timings)
+
+
+def test_templating_runs_in_the_report_stage(fake_session, tmp_path, monkeypatch):
+    build_reports = lb.build_reports
+
+    def slow_build_reports(probs, bands=None):
+        time.sleep(0.2)
+        return build_reports(probs, bands)
+
+    monkeypatch.setattr(lb, "build_reports", slow_build_reports)
+    results = list(StagedLocalPipeline(prepare_workers=2).run(films(tmp_path, 2)[:2]))
+    for r in results:
+        assert r.timings["template"] >= 0.2 > r.timings["inference"]
+
+
+def test_errors_are_reported_per_image(fake_session, tmp_path):
+    paths = films(tmp_path, 2)
+    broken = tmp_path / "broken.png"
+    broken.write_bytes(b"not a png")
+    results = list(StagedLocalPipeline(prepare_workers=2).run(paths + [str(broken)]))
+    errors = [r for r in results if r.error]
+    assert [r.path for r in errors] == [str(broken)]
+    assert len(results) == 4
+
+
+def test_bounded_queue_depth(fake_session, tmp_path):
+    paths = films(tmp_path, 1)[:1] * 40
+    pulled = 0
+
+    def lazy():
+        nonlocal pulled
+        for path in paths:
+            pulled += 1
+            yield path
+
+    staged = StagedLocalPipeline(prepare_workers=2, queue_depth=4, batch_size=2)
+    received = 0
+    for _ in staged.run(lazy()):
+        received += 1
+        # prepare slots + report queue + output queue, plus one in each hand-off
+        assert pulled - received <= 4 * 3 + 3
+    assert received == 40
+
+
+def test_empty_input_and_early_close(fake_session, tmp_path):
+    staged = StagedLocalPipeline(prepare_workers=1)
+    assert list(staged.run([])) == []
+    paths = films(tmp_path, 1)[:1] * 20
+    stream = staged.run(paths)
+    next(stream)
+    stream.close()  # consumer walks away: stage threads must not hang the test
+
+
+def test_process_pool_prepare(fake_session, tmp_path, monkeypatch):
+    # Spawned workers re-import local_backend and do not see monkeypatches, only
+    # the environment: disable the logit cache so they never look for the model.
+    monkeypatch.setenv("CHEXNET_CACHE_SIZE", "0")
+    paths = films(tmp_path, 3)
+    results = list(StagedLocalPipeline(prepare_workers=2, use_processes=True).run(paths))
+    assert len(results) == 4
+    assert [r.error for r in results] == [None] * 4
+    blocked = [r for r in results if r.path.endswith("photo.png")]
+    assert blocked[0].result.analysis.metadata["is_medical_image"] is False
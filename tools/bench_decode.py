@@ -0,0 +1,111 @@
+"""Decode benchmark: full decode vs :func:`local_backend.load_image`.
+
+Writes synthetic 2k–4k chest films as JPEG and PNG, then times each decode path
+and measures its peak memory. Every (size, format, path) case runs in a fresh
+interpreter so the peak RSS of one case cannot leak into the next.
+
+    python tools/bench_decode.py
+    python tools/bench_decode.py --sizes 2048 4096 --repeat 20
+
+Peak memory is the child's high-water RSS growth over its baseline after
+imports, i.e. what the decode itself added. ``full`` is what the app did
+before (``Image.open(...).convert("RGB")``); ``reduced`` is ``load_image``.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from benchmark import peak_rss_kb  # noqa: E402
+
+
+def _synthetic_film(side: int):
+    """Greyscale CXR-like film with fine texture, so JPEG/PNG sizes are realistic."""
+    import numpy as np
+    from PIL import Image
+
+    height, width = side, int(side * 0.85)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    x, y = xx / width, yy / height
+    lungs = np.exp(-(((x - 0.3) / 0.15) ** 2 + ((y - 0.5) / 0.3) ** 2)) + np.exp(
+        -(((x - 0.7) / 0.15) ** 2 + ((y - 0.5) / 0.3) ** 2)
+    )
+    noise = np.random.default_rng(0).normal(0, 6, size=lungs.shape)
+    arr = 200.0 - 120.0 * lungs + 30.0 * np.sin(y * 60.0) ** 2 * lungs + noise
+    return Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8), mode="L")
+
+
+def _child(path: str, method: str, repeat: int) -> None:
+    """Decode ``path`` ``repeat`` times in this process and print one JSON line."""
+    from PIL import Image
+
+    import local_backend as lb
+
+    baseline = peak_rss_kb()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        if method == "full":
+            with Image.open(path) as image:
+                image = image.convert("RGB")
+        else:
+            image = lb.load_image(path)
+        times.append(time.perf_counter() - start)
+        size = image.size
+        del image
+    times.sort()
+    print(json.dumps({
+        "decoded_size": list(size),
+        "median_ms": 1000 * times[len(times) // 2],
+        "peak_mb": (peak_rss_kb() - baseline) / 1024,
+    }))
+
+
+def _run_case(path: str, method: str, repeat: int) -> dict:
+    out = subprocess.run(
+        [sys.executable, __file__, "--child", path, method, str(repeat)],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(out)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2048, 3072, 4096],
+                        help="long side of the synthetic films, in pixels")
+    parser.add_argument("--formats", nargs="+", default=["JPEG", "PNG"])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--child", nargs=3, metavar=("PATH", "METHOD", "REPEAT"),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        path, method, repeat = args.child
+        _child(path, method, int(repeat))
+        return 0
+
+    print(f"{'source':>16} {'fmt':>5} {'path':>8} {'decoded':>10} "
+          f"{'median ms':>10} {'peak MB':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for side in args.sizes:
+            film = _synthetic_film(side)
+            for fmt in args.formats:
+                path = os.path.join(tmp, f"film_{side}.{fmt.lower()}")
+                film.save(path, format=fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+                for method in ("full", "reduced"):
+                    r = _run_case(path, method, args.repeat)
+                    source = "×".join(map(str, film.size))
+                    decoded = "×".join(map(str, r["decoded_size"]))
+                    print(f"{source:>16} {fmt:>5} {method:>8} {decoded:>10} "
+                          f"{r['median_ms']:>10.1f} {r['peak_mb']:>8.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
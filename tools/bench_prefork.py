@@ -0,0 +1,132 @@
+"""Memory benchmark: forked workers sharing one session vs independent workers.
+
+For each worker count, starts N worker processes that each run one inference
+and then idle, and sums the memory of the whole process tree (parent +
+workers) while they are all alive:
+
+* ``prefork``     — the parent loads the session once, then forks the workers
+  (what :class:`prefork_pipeline.PreforkLocalPipeline` does)
+* ``independent`` — each spawned worker loads its own session
+
+    python tools/bench_prefork.py
+    python tools/bench_prefork.py --workers 1 2 4 8 --model models/chexnet.onnx -o mem.json
+
+The figure that matters is total **PSS** (proportional set size): each shared
+page is split evenly between the processes that map it, so the sum is the real
+footprint. Summed RSS counts shared pages once per process and is shown for
+contrast. Without ``--model``, a stand-in graph with ``--stand-in-mb`` of
+weights (default 30, about DenseNet-121) is used.
+"""
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+
+from benchmark import stand_in_model  # noqa: E402
+
+
+def _memory_kb(pid: int) -> tuple[int, int]:
+    """(PSS, RSS) of ``pid`` in KiB; PSS falls back to RSS without smaps_rollup."""
+    rss = pss = None
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    pss = int(line.split()[1])
+    except OSError:
+        pass
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1])
+    return (pss if pss is not None else rss), rss
+
+
+def _serve(load_own_session: bool, ready, done) -> None:
+    """Worker body: (load a session,) run one inference, report, idle until told."""
+    import local_backend as lb
+
+    if load_own_session:
+        lb.warm_up()
+    lb._run_session([np.full((224, 224), 100, np.uint8)])
+    ready.put(os.getpid())
+    done.wait()
+
+
+def measure(mode: str, workers: int) -> dict:
+    import local_backend as lb
+
+    if mode == "prefork":
+        lb._pool = lb.SessionPool(1, factory=lambda: lb._create_session(intra_op_threads=1))
+        lb.warm_up()
+        gc.collect()
+        gc.freeze()
+        ctx = multiprocessing.get_context("fork")
+    else:
+        ctx = multiprocessing.get_context("spawn")
+    ready, done = ctx.Queue(), ctx.Event()
+    procs = [
+        ctx.Process(target=_serve, args=(mode == "independent", ready, done))
+        for _ in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    pids = [ready.get(timeout=120) for _ in procs]
+    pss, rss = map(sum, zip(*(_memory_kb(pid) for pid in [os.getpid(), *pids])))
+    done.set()
+    for p in procs:
+        p.join()
+    if mode == "prefork":
+        gc.unfreeze()
+        lb._pool = None
+    return {"mode": mode, "workers": workers,
+            "total_pss_mb": round(pss / 1024, 1), "total_rss_mb": round(rss / 1024, 1)}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--model", default=None, help="ONNX model (default: stand-in)")
+    parser.add_argument("--stand-in-mb", type=float, default=30.0)
+    parser.add_argument("-o", "--output", default=None, help="also write results as JSON")
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.TemporaryDirectory()
+    model = args.model
+    if not model:
+        model = os.path.join(tmp.name, "stand_in.onnx")
+        stand_in_model(model, weights_mb=args.stand_in_mb)
+    # Read by local_backend at import, here and in every spawned worker.
+    os.environ["CHEXNET_ONNX_PATH"] = os.path.abspath(model)
+    os.environ["CHEXNET_INTRA_OP_THREADS"] = "1"
+    os.environ["CHEXNET_CACHE_SIZE"] = "0"
+    import local_backend as lb  # already imported (via benchmark) in this process
+
+    lb._ONNX_PATH = os.environ["CHEXNET_ONNX_PATH"]
+    lb._cache = False
+
+    results = []
+    print(f"{'workers':>7} {'mode':>12} {'total PSS MB':>13} {'total RSS MB':>13}")
+    for workers in args.workers:
+        for mode in ("independent", "prefork"):
+            r = measure(mode, workers)
+            results.append(r)
+            print(f"{workers:>7} {mode:>12} {r['total_pss_mb']:>13.1f} {r['total_rss_mb']:>13.1f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"model": args.model or f"stand-in ({args.stand_in_mb} MB)",
+                       "results": results}, f, indent=2)
+    tmp.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
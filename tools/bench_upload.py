@@ -0,0 +1,96 @@
+"""Upload benchmark: Gemini payload size and encode time across resolutions.
+
+Encodes synthetic 1k–4k chest films, as they leave the HIGH_CONTRAST enhancer
+(RGB, full size), with :func:`gemini_backend.encode_upload` under several
+:class:`gemini_backend.UploadEncoding` settings, and prints the bytes that
+would go over the wire and the median encode time. ``sdk`` is the baseline:
+the full-size RGB film as a default-quality JPEG, which is what the SDK makes
+of a PIL image handed to ``generate_content``.
+
+    python tools/bench_upload.py
+    python tools/bench_upload.py --sizes 2048 4096 --max-sides 768 1024 1536 --repeat 20
+    python tools/bench_upload.py -o upload.json
+
+No network or API key is needed.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from benchmark import synthetic_cxr  # noqa: E402
+from gemini_backend import UploadEncoding, encode_upload  # noqa: E402
+
+
+def _sdk_baseline(image) -> int:
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG")
+    return len(buf.getvalue())
+
+
+def _settings(max_sides: list[int], qualities: list[int]) -> list[tuple[str, UploadEncoding]]:
+    settings = []
+    for side in max_sides:
+        for quality in qualities:
+            settings.append((f"L {side} jpeg q{quality}", UploadEncoding(side, True, "jpeg", quality)))
+        settings.append((f"L {side} png", UploadEncoding(side, True, "png")))
+    settings.append((f"RGB {max_sides[-1]} jpeg q{qualities[-1]}",
+                     UploadEncoding(max_sides[-1], False, "jpeg", qualities[-1])))
+    return settings
+
+
+def measure(image, encoding: UploadEncoding, repeat: int) -> dict:
+    times, upload = [], None
+    for _ in range(repeat):
+        upload = encode_upload(image, encoding)
+        times.append(upload.seconds)
+    times.sort()
+    return {
+        "encoded_size": list(upload.size),
+        "bytes": upload.nbytes,
+        "median_ms": 1000 * times[len(times) // 2],
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1024, 2048, 3072, 4096],
+                        help="long side of the synthetic films, in pixels")
+    parser.add_argument("--max-sides", type=int, nargs="+", default=[768, 1024, 1536],
+                        help="UploadEncoding.max_side values to try")
+    parser.add_argument("--qualities", type=int, nargs="+", default=[75, 85, 95],
+                        help="JPEG qualities to try")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("-o", "--output", help="also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'source':>10} {'setting':>18} {'sent':>10} {'KB':>8} {'vs sdk':>7} {'median ms':>10}")
+    for side in args.sizes:
+        film = synthetic_cxr(side)
+        source = "×".join(map(str, film.size))
+        start = time.perf_counter()
+        baseline = _sdk_baseline(film)
+        sdk_ms = 1000 * (time.perf_counter() - start)
+        print(f"{source:>10} {'sdk':>18} {source:>10} {baseline / 1024:>8.1f} {1:>7.2f} {sdk_ms:>10.1f}")
+        results.append({"source": list(film.size), "setting": "sdk", "bytes": baseline})
+        for name, encoding in _settings(args.max_sides, args.qualities):
+            r = measure(film, encoding, args.repeat)
+            sent = "×".join(map(str, r["encoded_size"]))
+            print(f"{source:>10} {name:>18} {sent:>10} {r['bytes'] / 1024:>8.1f} "
+                  f"{r['bytes'] / baseline:>7.2f} {r['median_ms']:>10.1f}")
+            results.append({"source": list(film.size), "setting": name,
+                            "encoding": encoding._asdict(), **r})
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,340 @@
+"""Offline benchmark suite for every stage of the local and Gemini pipelines.
+
+Runs on deterministic synthetic CXR-like films at several resolutions, with no
+network and no model download, and writes one machine-readable JSON file so
+runs can be compared across commits:
+
+    python tools/benchmark.py -o bench.json
+    python tools/benchmark.py -o bench.json --sizes 1024 3072 --iterations 50
+    python tools/benchmark.py --model models/chexnet.onnx --gemini-latency-ms 1200
+
+Stages timed separately (each at every resolution unless noted):
+
+* ``decode.full`` / ``decode.reduced`` — JPEG bytes → RGB, full decode vs
+  :func:`local_backend.load_image`
+* ``looks_like_xray`` / ``looks_like_ct_slice`` / ``_preprocess`` — on a decoded
+  image, each building its own pyramid as a lone caller would
+* ``session.run[1]`` / ``session.run[N]`` — ONNX inference, single and batched
+  (resolution-independent)
+* ``build_report`` / ``parse_raw`` / ``guardrails`` — templating, parsing and
+  the rule engine (resolution-independent)
+* ``pipeline.local`` / ``pipeline.gemini`` — the full ``VLMGuardPipeline.run``;
+  Gemini is replaced by a fake model whose ``generate_content`` sleeps for
+  ``--gemini-latency-ms`` and returns a canned schema response
+
+Without ``--model`` (or when the file is missing) a small stand-in ONNX graph
+with the real model's input/output shapes is generated, so ONNX timings are
+then only comparable between runs that both used the stand-in; the JSON records
+which model was used. The logit and Gemini response caches are disabled throughout.
+
+Each stage entry holds p50/p95/p99/mean in milliseconds and the peak RSS (MB)
+reached while the stage ran. On Linux the RSS high-water mark is reset before
+every stage (``/proc/self/clear_refs``), so the figure is per stage; elsewhere
+it is the process-wide peak so far, as recorded in ``meta.peak_rss_scope``.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import local_backend as lb  # noqa: E402
+from radiology_pipeline import (  # noqa: E402
+    build_local_pipeline,
+    build_pipeline,
+    engine,
+    parse_raw,
+)
+
+PROMPT = "Analyze this medical image."
+CONTEXT = {"scan_type": "radiology"}
+
+
+# ── Synthetic inputs ──────────────────────────────────────────────────────────
+
+
+def synthetic_cxr(side: int, seed: int = 0) -> Image.Image:
+    """Deterministic CXR-like RGB film: bright mediastinum, darker lung fields,
+    soft ribs and film grain. ``side`` is the long (vertical) side."""
+    height, width = side, int(side * 0.85)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    x, y = xx / width, yy / height
+    lungs = np.exp(-(((x - 0.3) / 0.15) ** 2 + ((y - 0.5) / 0.3) ** 2)) + np.exp(
+        -(((x - 0.7) / 0.15) ** 2 + ((y - 0.5) / 0.3) ** 2)
+    )
+    grain = np.random.default_rng(seed).normal(0, 6, size=lungs.shape)
+    arr = 200.0 - 120.0 * lungs + 30.0 * np.sin(y * 60.0) ** 2 * lungs + grain
+    grey = Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8), mode="L")
+    return grey.convert("RGB")
+
+
+def _jpeg_bytes(image: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def stand_in_model(path: str, weights_mb: float = 0) -> None:
+    """Write a small ONNX graph with the real model's I/O: (N,1,224,224) → (N,18)
+    logits. Conv → ReLU → global pool → Gemm, deterministic weights.
+    ``weights_mb`` > 0 inserts a square hidden layer of about that many MB, for
+    benchmarks where the size of the weights matters (DenseNet-121 is ~28 MB)."""
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+
+    rng = np.random.default_rng(0)
+    hidden = 16
+    weights = [
+        numpy_helper.from_array(
+            rng.normal(0, 0.01, (16, 1, 7, 7)).astype(np.float32), "conv_w"
+        ),
+    ]
+    nodes = [
+        helper.make_node("Conv", ["img", "conv_w"], ["c"], strides=[2, 2], pads=[3, 3, 3, 3]),
+        helper.make_node("Relu", ["c"], ["r"]),
+        helper.make_node("GlobalAveragePool", ["r"], ["p"]),
+        helper.make_node("Flatten", ["p"], ["f"]),
+    ]
+    if weights_mb > 0:
+        hidden = int((weights_mb * 1024 * 1024 / 4) ** 0.5)
+        weights += [
+            numpy_helper.from_array(
+                rng.normal(0, 0.1, (16, hidden)).astype(np.float32), "up_w"
+            ),
+            numpy_helper.from_array(
+                rng.normal(0, 0.01, (hidden, hidden)).astype(np.float32), "hidden_w"
+            ),
+        ]
+        nodes += [
+            helper.make_node("MatMul", ["f", "up_w"], ["u"]),
+            helper.make_node("MatMul", ["u", "hidden_w"], ["h"]),
+        ]
+    weights += [
+        numpy_helper.from_array(
+            rng.normal(0, 0.1, (hidden, len(lb.PATHOLOGIES))).astype(np.float32), "fc_w"
+        ),
+        numpy_helper.from_array(np.zeros(len(lb.PATHOLOGIES), np.float32), "fc_b"),
+    ]
+    nodes.append(helper.make_node(
+        "Gemm", ["h" if weights_mb > 0 else "f", "fc_w", "fc_b"], ["logits"]
+    ))
+    graph = helper.make_graph(
+        nodes, "chexnet_stand_in",
+        [helper.make_tensor_value_info("img", TensorProto.FLOAT, ["N", 1, 224, 224])],
+        [helper.make_tensor_value_info("logits", TensorProto.FLOAT, ["N", len(lb.PATHOLOGIES)])],
+        initializer=weights,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8  # loadable by any onnxruntime >= 1.10
+    onnx.save(model, path)
+
+
+class FakeGeminiModel:
+    """Stands in for ``genai.GenerativeModel``: sleeps, then returns ``text``."""
+
+    class _Response:
+        def __init__(self, text: str):
+            self.text = text
+
+    def __init__(self, text: str, latency_ms: float):
+        self._text = text
+        self._latency = latency_ms / 1000.0
+
+    def generate_content(self, contents, **kwargs):
+        time.sleep(self._latency)
+        return self._Response(self._text)
+
+
+# ── Measurement ───────────────────────────────────────────────────────────────
+
+
+def _reset_peak_rss() -> bool:
+    """Reset the kernel's RSS high-water mark (Linux only); True on success."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_kb() -> int:
+    """High-water RSS of this process in KiB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+
+    # ru_maxrss is KiB on Linux, bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def measure(fn, iterations: int, warmup: int = 2) -> dict:
+    """Call ``fn()`` ``warmup + iterations`` times; percentiles over the timed
+    calls in milliseconds, plus the peak RSS reached meanwhile."""
+    for _ in range(warmup):
+        fn()
+    _reset_peak_rss()
+    times = np.empty(iterations)
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn()
+        times[i] = time.perf_counter() - start
+    times *= 1000.0
+    p50, p95, p99 = np.percentile(times, [50, 95, 99])
+    return {
+        "iterations": iterations,
+        "p50_ms": round(float(p50), 4),
+        "p95_ms": round(float(p95), 4),
+        "p99_ms": round(float(p99), 4),
+        "mean_ms": round(float(times.mean()), 4),
+        "peak_rss_mb": round(peak_rss_kb() / 1024, 1),
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            check=True, capture_output=True, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ── Suite ─────────────────────────────────────────────────────────────────────
+
+
+def run_suite(
+    sizes, iterations: int, batch_size: int, gemini_latency_ms: float, model: str | None
+) -> dict:
+    import onnxruntime
+
+    tmp = tempfile.TemporaryDirectory()
+    if model and os.path.exists(model):
+        model_label = os.path.abspath(model)
+    else:
+        model = os.path.join(tmp.name, "stand_in.onnx")
+        stand_in_model(model)
+        model_label = "stand-in"
+    lb._ONNX_PATH = model
+    lb._pool = None
+    lb._cache = False  # time the work, not the cache
+
+    results = []
+
+    def record(stage: str, stats: dict, resolution: str | None = None) -> None:
+        results.append({"stage": stage, "resolution": resolution, **stats})
+        where = f" @ {resolution}" if resolution else ""
+        print(f"{stage + where:>34}  p50 {stats['p50_ms']:9.3f} ms  "
+              f"p95 {stats['p95_ms']:9.3f}  p99 {stats['p99_ms']:9.3f}  "
+              f"rss {stats['peak_rss_mb']:7.1f} MB", file=sys.stderr)
+
+    # Resolution-independent stages.
+    lb.warm_up()
+    view = lb.ImagePyramid(synthetic_cxr(512)).model_view
+    record("session.run[1]", measure(lambda: lb._run_session([view]), iterations))
+    batch = [view] * batch_size
+    record(f"session.run[{batch_size}]", measure(lambda: lb._run_session(batch), iterations))
+
+    layout = lb.get_session_pool().layout
+    probs = dict(zip(
+        lb.PATHOLOGIES, lb._to_probabilities(lb._run_session([view]), layout)[0].tolist()
+    ))
+    record("build_report", measure(lambda: lb.build_report(probs, is_medical=True), iterations))
+    raw = json.dumps(lb.build_report(probs, is_medical=True))
+    record("parse_raw", measure(lambda: parse_raw(raw), iterations))
+    analysis, _ = parse_raw(raw)
+    context = {**CONTEXT, "image_enhanced": True}
+    record("guardrails", measure(lambda: engine.apply_with_audit(analysis, context), iterations))
+
+    local = build_local_pipeline()
+    gemini = build_pipeline(FakeGeminiModel(raw, gemini_latency_ms), cached=False)
+    gemini_iterations = max(3, min(iterations, int(10_000 / max(gemini_latency_ms, 1))))
+
+    for side in sizes:
+        image = synthetic_cxr(side)
+        resolution = "x".join(map(str, image.size))
+        data = _jpeg_bytes(image)
+
+        def decode_full():
+            with Image.open(io.BytesIO(data)) as im:
+                return im.convert("RGB")
+
+        record("decode.full", measure(decode_full, iterations), resolution)
+        record("decode.reduced",
+               measure(lambda: lb.load_image(io.BytesIO(data)), iterations), resolution)
+
+        decoded = decode_full()
+        record("looks_like_xray", measure(lambda: lb.looks_like_xray(decoded), iterations),
+               resolution)
+        record("looks_like_ct_slice",
+               measure(lambda: lb.looks_like_ct_slice(decoded), iterations), resolution)
+        record("_preprocess", measure(lambda: lb._preprocess(decoded), iterations), resolution)
+        record("pipeline.local",
+               measure(lambda: local.run(decoded, PROMPT, context=CONTEXT), iterations),
+               resolution)
+        record("pipeline.gemini",
+               measure(lambda: gemini.run(decoded, PROMPT, context=CONTEXT),
+                       gemini_iterations, warmup=1),
+               resolution)
+
+    tmp.cleanup()
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "onnxruntime": onnxruntime.__version__,
+            "model": model_label,
+            "batch_size": batch_size,
+            "gemini_latency_ms": gemini_latency_ms,
+            "peak_rss_scope": "stage" if _reset_peak_rss() else "process",
+        },
+        "results": results,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-o", "--output", default="benchmark.json",
+                        help="JSON file to write (default: benchmark.json)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 2048, 4096],
+                        help="long side of the synthetic films, in pixels")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=lb.BATCH_SIZE)
+    parser.add_argument("--gemini-latency-ms", type=float, default=800.0,
+                        help="injected latency of the fake Gemini model")
+    parser.add_argument("--model", default=None,
+                        help="ONNX model to time (default: a generated stand-in)")
+    args = parser.parse_args(argv)
+
+    report = run_suite(
+        args.sizes, args.iterations, args.batch_size, args.gemini_latency_ms, args.model
+    )
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(report['results'])} results to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,342 @@
+"""Calibrate per-pathology detection thresholds against a labelled dataset.
+
+``CHEXNET_THRESHOLD`` is one number for all 18 pathologies, tuned by hand. This
+tool measures how the classifier separates each pathology on locally labelled
+films and writes per-pathology thresholds that ``local_backend`` loads via
+``CHEXNET_THRESHOLDS``::
+
+    # probabilities from a batch run's logit store, joined to the labels by path
+    python tools/calibrate.py labels.csv --store archive.logits -o thresholds.json
+    # or run batched inference over the labelled films first
+    python tools/calibrate.py labels.csv -o thresholds.json --method specificity --target-specificity 0.9
+    CHEXNET_THRESHOLDS=thresholds.json streamlit run streamlit_app.py
+
+The labels CSV has a ``path`` column (relative paths resolve against the CSV's
+directory) and one column per pathology, named as in ``PATHOLOGIES`` (spaces and
+underscores are interchangeable, case is ignored). ``1`` is positive, ``0``
+negative; anything else — blank, ``-1`` (uncertain) — leaves that label out of
+that pathology's curves.
+
+Every metric is computed for all pathologies at once on (N, 18) arrays: one
+stable sort per column, cumulative true/false-positive counts, and the ROC and
+precision/recall curves at every distinct score. Sweeping 100k studies takes
+well under a second. Per pathology the config records AUROC, average precision,
+sensitivity at each ``--specificity`` and the chosen threshold:
+
+* ``youden`` (default) — maximise sensitivity + specificity − 1
+* ``f1`` — maximise F1
+* ``specificity`` — the most sensitive threshold with specificity ≥
+  ``--target-specificity``
+
+Pathologies with fewer than ``--min-positives`` positive (or negative) labels
+are left out of the threshold table, so they keep ``CHEXNET_THRESHOLD``.
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import local_backend as lb  # noqa: E402
+
+METHODS = ("youden", "f1", "specificity")
+
+
+# ── Labels ────────────────────────────────────────────────────────────────────
+
+
+def _column_key(name: str) -> str:
+    return name.strip().replace("_", " ").lower()
+
+
+def load_labels(path: str) -> tuple[list[str], np.ndarray]:
+    """(image paths, labels) from a labels CSV. ``labels`` is an
+    (N, len(PATHOLOGIES)) float array of 1 / 0, NaN where a label is unknown
+    or the CSV has no column for that pathology."""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, None) or []
+        if "path" not in header:
+            raise ValueError(f"{path}: no 'path' column")
+        path_col = header.index("path")
+        by_key = {_column_key(name): i for i, name in enumerate(header)}
+        columns = [by_key.get(_column_key(name)) for name in lb.PATHOLOGIES]
+        if all(c is None for c in columns):
+            raise ValueError(f"{path}: no pathology columns (expected names from PATHOLOGIES)")
+        rows = [row for row in reader if len(row) > path_col and row[path_col].strip()]
+
+    paths = [os.path.join(base, row[path_col].strip()) for row in rows]
+    cells = np.array(
+        [[row[c].strip() if c is not None and c < len(row) else "" for c in columns]
+         for row in rows],
+        dtype=object,
+    ).reshape(len(rows), len(lb.PATHOLOGIES))
+    labels = np.full(cells.shape, np.nan)
+    labels[np.isin(cells, ("1", "1.0"))] = 1.0
+    labels[np.isin(cells, ("0", "0.0"))] = 0.0
+    return paths, labels
+
+
+# ── Curves and metrics (vectorised over images and pathologies) ───────────────
+
+
+class Curves(NamedTuple):
+    """ROC and precision/recall points per pathology, one column each.
+
+    Row 0 is the "flag nothing" point; row k ≥ 1 applies the k-th highest
+    score as the threshold (``probability >= threshold``). Tied scores repeat
+    the point of their whole tie group, which adds only zero-width segments.
+    """
+
+    thresholds: np.ndarray  # (N + 1, P)
+    tpr: np.ndarray         # (N + 1, P) sensitivity / recall
+    fpr: np.ndarray         # (N + 1, P) 1 − specificity
+    precision: np.ndarray   # (N + 1, P)
+    positives: np.ndarray   # (P,)
+    negatives: np.ndarray   # (P,)
+
+
+def curves(probs: np.ndarray, labels: np.ndarray) -> Curves:
+    """ROC / PR curves of every column of ``probs`` against ``labels``
+    (same shape; NaN labels are ignored)."""
+    probs = np.asarray(probs, dtype=np.float64)
+    labels = np.asarray(labels, dtype=np.float64)
+    count, width = probs.shape
+    order = np.argsort(-probs, axis=0, kind="stable")
+    scores = np.take_along_axis(probs, order, axis=0)
+    ordered = np.take_along_axis(labels, order, axis=0)
+    tp = np.cumsum(ordered == 1.0, axis=0)
+    fp = np.cumsum(ordered == 0.0, axis=0)
+
+    # A threshold admits its whole tie group: read the counts at the group's
+    # last row, found by a reverse running minimum over group ends.
+    last = np.ones((count, width), dtype=bool)
+    last[:-1] = scores[:-1] != scores[1:]
+    end = np.where(last, np.arange(count)[:, None], count - 1)
+    end = np.minimum.accumulate(end[::-1], axis=0)[::-1]
+    tp = np.take_along_axis(tp, end, axis=0)
+    fp = np.take_along_axis(fp, end, axis=0)
+
+    top = scores[:1] if count else np.zeros((1, width))
+    thresholds = np.vstack([np.minimum(np.nextafter(top, np.inf), 1.0), scores])
+    tp = np.vstack([np.zeros((1, width)), tp])
+    fp = np.vstack([np.zeros((1, width)), fp])
+    positives, negatives = tp[-1], fp[-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tpr = tp / positives
+        fpr = fp / negatives
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 1.0)
+    return Curves(thresholds, tpr, fpr, precision, positives, negatives)
+
+
+def auroc(c: Curves) -> np.ndarray:
+    """Area under each ROC curve (trapezoidal); NaN without both classes."""
+    return ((c.fpr[1:] - c.fpr[:-1]) * (c.tpr[1:] + c.tpr[:-1]) / 2).sum(axis=0)
+
+
+def average_precision(c: Curves) -> np.ndarray:
+    """Step-wise area under each precision/recall curve; NaN without positives."""
+    return ((c.tpr[1:] - c.tpr[:-1]) * c.precision[1:]).sum(axis=0)
+
+
+def _pick(c: Curves, score: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """(row, threshold) per pathology maximising ``score``; the first —
+    highest-threshold — row wins ties."""
+    row = np.nan_to_num(score, nan=-np.inf).argmax(axis=0)
+    return row, c.thresholds[row, np.arange(c.thresholds.shape[1])]
+
+
+def sensitivity_at_specificity(c: Curves, specificity: float) -> tuple[np.ndarray, np.ndarray]:
+    """(sensitivity, threshold) per pathology: the most sensitive operating
+    point whose specificity is at least ``specificity``."""
+    row, threshold = _pick(c, np.where(1.0 - c.fpr >= specificity, c.tpr, -1.0))
+    return c.tpr[row, np.arange(c.tpr.shape[1])], threshold
+
+
+def optimal_thresholds(
+    c: Curves, method: str = "youden", target_specificity: float = 0.9
+) -> np.ndarray:
+    """Per-pathology threshold chosen by ``method`` (see the module docstring)."""
+    if method == "youden":
+        return _pick(c, c.tpr - c.fpr)[1]
+    if method == "f1":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            f1 = 2 * c.precision * c.tpr / (c.precision + c.tpr)
+        return _pick(c, f1)[1]
+    if method == "specificity":
+        return sensitivity_at_specificity(c, target_specificity)[1]
+    raise ValueError(f"unknown method {method!r}; expected one of {METHODS}")
+
+
+def calibrate(
+    probs: np.ndarray,
+    labels: np.ndarray,
+    method: str = "youden",
+    target_specificity: float = 0.9,
+    specificities: tuple[float, ...] = (0.9, 0.95),
+    min_positives: int = 10,
+) -> dict:
+    """The threshold config for ``probs`` against ``labels``: a
+    ``thresholds`` table for :func:`local_backend.load_thresholds` plus the
+    per-pathology metrics behind it."""
+    c = curves(probs, labels)
+    chosen = optimal_thresholds(c, method, target_specificity)
+    at = {s: sensitivity_at_specificity(c, s) for s in specificities}
+    roc, ap = auroc(c), average_precision(c)
+    usable = (c.positives >= min_positives) & (c.negatives >= min_positives)
+
+    def number(x) -> float | None:
+        return None if np.isnan(x) else round(float(x), 6)
+
+    metrics = {
+        name: {
+            "positives": int(c.positives[j]),
+            "negatives": int(c.negatives[j]),
+            "auroc": number(roc[j]),
+            "average_precision": number(ap[j]),
+            "sensitivity_at_specificity": {
+                str(s): number(sens[j]) for s, (sens, _) in at.items()
+            },
+            "threshold": float(chosen[j]) if usable[j] else None,
+        }
+        for j, name in enumerate(lb.PATHOLOGIES)
+    }
+    return {
+        "thresholds": {
+            name: float(chosen[j]) for j, name in enumerate(lb.PATHOLOGIES) if usable[j]
+        },
+        "method": method,
+        "target_specificity": target_specificity if method == "specificity" else None,
+        "images": int(len(probs)),
+        "metrics": metrics,
+    }
+
+
+def save_curves(path: str, c: Curves) -> None:
+    """Write each pathology's curve points (one per distinct threshold) to an
+    ``.npz`` as ``<pathology>/{thresholds,tpr,fpr,precision}``."""
+    arrays = {}
+    for j, name in enumerate(lb.PATHOLOGIES):
+        keep = np.ones(len(c.thresholds), dtype=bool)
+        keep[1:] = (c.tpr[1:, j] != c.tpr[:-1, j]) | (c.fpr[1:, j] != c.fpr[:-1, j])
+        for field in ("thresholds", "tpr", "fpr", "precision"):
+            arrays[f"{name}/{field}"] = getattr(c, field)[keep, j]
+    np.savez_compressed(path, **arrays)
+
+
+# ── Probability sources ───────────────────────────────────────────────────────
+
+
+def probabilities_from_store(
+    directory: str, paths: list[str]
+) -> tuple[np.ndarray, np.ndarray, str]:
+    """(probabilities, mask of ``paths`` found, model) from a logit store.
+    Paths are matched after normalisation, so run this from the directory
+    the batch ran in when the store holds relative paths."""
+    from logit_store import LogitStore
+
+    with LogitStore(directory) as store:
+        row_of = {os.path.normpath(os.path.abspath(p)): i for i, p in enumerate(store.paths)}
+        rows = np.array(
+            [row_of.get(os.path.normpath(os.path.abspath(p)), -1) for p in paths], dtype=np.int64
+        )
+        found = rows >= 0
+        probs = np.asarray(store.probabilities(), dtype=np.float64)[rows[found]]
+        return probs, found, store.meta["model"]
+
+
+def probabilities_from_inference(
+    paths: list[str], batch_size: int, workers: int | None
+) -> tuple[np.ndarray, np.ndarray, str]:
+    """(probabilities, mask of ``paths`` classified, model) by running the
+    staged local pipeline. Films the gates reject or that fail to decode are
+    left out."""
+    from staged_pipeline import StagedLocalPipeline
+
+    raw_of = {}
+    pipeline = StagedLocalPipeline(prepare_workers=workers, batch_size=batch_size)
+    for item in pipeline.run(paths):
+        if item.raw is not None:
+            raw_of[item.path] = item.raw
+    found = np.array([p in raw_of for p in paths], dtype=bool)
+    if not found.any():
+        return np.empty((0, len(lb.PATHOLOGIES))), found, lb._model_identity()
+    raw = np.stack([raw_of[p] for p in np.asarray(paths, dtype=object)[found]])
+    probs = lb._to_probabilities(raw, lb.get_session_pool().layout)
+    return np.asarray(probs, dtype=np.float64), found, lb._model_identity()
+
+
+# ── CLI ───────────────────────────────────────────────────────────────────────
+
+
+def _parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("labels", help="labels CSV: a path column plus one column per pathology")
+    parser.add_argument("-o", "--output", required=True, help="threshold config (JSON) to write")
+    parser.add_argument(
+        "--store", help="read probabilities from this logit store instead of running the model"
+    )
+    parser.add_argument("--method", choices=METHODS, default="youden")
+    parser.add_argument("--target-specificity", type=float, default=0.9)
+    parser.add_argument(
+        "--specificity", type=float, nargs="+", default=[0.9, 0.95],
+        help="report sensitivity at these specificities",
+    )
+    parser.add_argument("--min-positives", type=int, default=10)
+    parser.add_argument("--curves", help="also write the ROC / PR curves to this .npz")
+    parser.add_argument("--batch-size", type=int, default=lb.BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=None, help="decode workers")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv)
+    paths, labels = load_labels(args.labels)
+    if args.store:
+        probs, found, model = probabilities_from_store(args.store, paths)
+    else:
+        probs, found, model = probabilities_from_inference(paths, args.batch_size, args.workers)
+    if not found.all():
+        print(f"{int((~found).sum())} of {len(paths)} labelled images have no "
+              f"probabilities (not in the store, or rejected) and are skipped.", file=sys.stderr)
+    labels = labels[found]
+
+    started = time.perf_counter()
+    config = calibrate(
+        probs, labels, args.method, args.target_specificity,
+        tuple(args.specificity), args.min_positives,
+    )
+    elapsed = time.perf_counter() - started
+    config["model"] = model
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    if args.curves:
+        save_curves(args.curves, curves(probs, labels))
+
+    spec = args.specificity[0]
+    print(f"{'pathology':<28} {'pos':>6} {'neg':>6} {'AUROC':>6} {'AP':>6} "
+          f"{f'sens@{spec:g}':>10} {'threshold':>9}")
+    for name, m in config["metrics"].items():
+        def fmt(x, width):
+            return f"{x:>{width}.3f}" if x is not None else f"{'-':>{width}}"
+        print(f"{name:<28} {m['positives']:>6} {m['negatives']:>6} {fmt(m['auroc'], 6)} "
+              f"{fmt(m['average_precision'], 6)} "
+              f"{fmt(m['sensitivity_at_specificity'][str(spec)], 10)} "
+              f"{fmt(m['threshold'], 9)}")
+    print(f"Calibrated {len(config['thresholds'])} thresholds on {config['images']} images "
+          f"in {elapsed:.2f}s → {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -10,12 +10,40 @@ model so its output is plain pathology probabilities in a fixed order, and write
 
 Commit the resulting models/chexnet.onnx (or attach it to a release and download
 it at deploy time) so Streamlit Cloud never installs torch.
+
+INT8 variant
+------------
+``--quantize dynamic`` or ``--quantize static`` additionally writes
+``models/chexnet.int8.onnx`` with onnxruntime's quantizer and prints a parity
+report against the FP32 graph: file size, single-image CPU latency and the
+maximum per-pathology probability drift over a reference set. Select it at run
+time with ``CHEXNET_MODEL_VARIANT=int8``.
+
+    python tools/export_onnx.py --quantize dynamic
+    python tools/export_onnx.py --skip-export --quantize static \
+        --calibration-dir ~/cxr/calib --reference-dir ~/cxr/holdout
+
+Static quantization calibrates activation ranges on ``--calibration-dir``
+(any folder of JPG/PNG chest films). Quantizing needs only onnxruntime + onnx,
+so ``--skip-export`` reuses an existing FP32 model without PyTorch.
+
+Fused variant
+-------------
+``--fuse`` writes ``models/chexnet.fused.onnx``: the FP32 graph with the xrv
+normalisation (uint8 → ``(2 * x / 255 - 1) * 1024``) prepended and a Sigmoid
+appended. The runtime then feeds raw 224×224 uint8 pixels — a quarter of the
+bytes — and reads probabilities straight from the first output; the logits
+stay available as a second one. The graph is stamped with model metadata so
+``local_backend`` knows which layout it loaded. Select it with
+``CHEXNET_MODEL_VARIANT=fused``.
+
+    python tools/export_onnx.py --skip-export --fuse
 """
+import argparse
+import glob
 import os
 import sys
-
-import torch
-import torchxrayvision as xrv
+import time
 
 # Must match local_backend.PATHOLOGIES exactly — index i of the ONNX output maps
 # to PATHOLOGIES[i] at inference time, so the order is load-bearing.
@@ -28,9 +56,21 @@ EXPECTED_PATHOLOGIES = [
 
 OUT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "models")
 OUT_PATH = os.path.join(OUT_DIR, "chexnet.onnx")
+INT8_PATH = os.path.join(OUT_DIR, "chexnet.int8.onnx")
+FUSED_PATH = os.path.join(OUT_DIR, "chexnet.fused.onnx")
 
+# The parity harness reuses the runtime preprocessing, so import local_backend
+# from the repo root rather than duplicating it here.
+sys.path.insert(0, os.path.dirname(OUT_DIR))
+
+_IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+
+
+def export_fp32() -> int:
+    """Export the FP32 model to OUT_PATH and check parity with PyTorch."""
+    import torch
+    import torchxrayvision as xrv
 
-def main() -> int:
     print("Loading densenet121-res224-all (downloads weights on first run)…")
     model = xrv.models.DenseNet(weights="densenet121-res224-all")
     model.eval()
@@ -111,6 +151,305 @@ def main() -> int:
         print(f"Parity check OK (max abs diff {max_diff:.2e}).")
     except ImportError:
         print("Parity check skipped (onnxruntime not installed in export env).")
+    return 0
+
+
+# ── INT8 quantization ─────────────────────────────────────────────────────────
+
+
+def _image_paths(directory: str | None) -> list[str]:
+    if not directory:
+        return []
+    paths = glob.glob(os.path.join(os.path.expanduser(directory), "**", "*"), recursive=True)
+    return sorted(p for p in paths if p.lower().endswith(_IMAGE_EXTS))
+
+
+def _model_views(paths: list[str], limit: int):
+    """Yield (224, 224) uint8 model views prepared exactly as at run time.
+
+    With no images on disk, fall back to deterministic synthetic CXR-like films
+    so the harness still runs — a smoke test only, not an accuracy claim.
+    """
+    import numpy as np
+    from PIL import Image
+
+    from local_backend import ImagePyramid
+
+    if paths:
+        for path in paths[:limit]:
+            with Image.open(path) as image:
+                yield ImagePyramid(image.convert("RGB")).model_view
+        return
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:512, 0:512] / 512.0
+    for _ in range(limit):
+        cx, cy = rng.uniform(0.25, 0.35), rng.uniform(0.4, 0.6)
+        lungs = np.exp(-(((xx - cx) / 0.15) ** 2 + ((yy - cy) / 0.3) ** 2))
+        lungs += np.exp(-(((xx - 1 + cx) / 0.15) ** 2 + ((yy - cy) / 0.3) ** 2))
+        arr = 200.0 - 120.0 * lungs + rng.normal(0, 6, lungs.shape)
+        image = Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8), mode="L")
+        yield ImagePyramid(image).model_view
+
+
+def _model_inputs(paths: list[str], limit: int):
+    """Yield (1, 1, 224, 224) float32 inputs for the plain FP32/INT8 graphs."""
+    from local_backend import _normalise
+
+    for view in _model_views(paths, limit):
+        yield _normalise(view)[None, None]
+
+
+def quantize(mode: str, calibration_dir: str | None, calibration_size: int) -> int:
+    """Write INT8_PATH from OUT_PATH with onnxruntime's dynamic or static quantizer."""
+    from onnxruntime.quantization import (
+        CalibrationDataReader,
+        QuantFormat,
+        QuantType,
+        quantize_dynamic,
+        quantize_static,
+    )
+
+    if mode == "dynamic":
+        # Weights are INT8 offline; activations are quantized per batch at run
+        # time, so no calibration data is needed.
+        quantize_dynamic(OUT_PATH, INT8_PATH, weight_type=QuantType.QInt8)
+    else:
+        paths = _image_paths(calibration_dir)
+        if not paths:
+            print(
+                "ERROR: --quantize static needs --calibration-dir with JPG/PNG images.",
+                file=sys.stderr,
+            )
+            return 1
+
+        class _Reader(CalibrationDataReader):
+            def __init__(self):
+                self._inputs = _model_inputs(paths, calibration_size)
+
+            def get_next(self):
+                batch = next(self._inputs, None)
+                return None if batch is None else {"image": batch}
+
+        # Shape inference + graph cleanup first, as onnxruntime recommends for
+        # static quantization; the intermediate file is discarded afterwards.
+        # H/W are fixed at 224, so plain ONNX shape inference suffices and the
+        # sympy-based symbolic pass is skipped.
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+
+        prepared = INT8_PATH + ".prep.onnx"
+        quant_pre_process(OUT_PATH, prepared, skip_symbolic_shape=True)
+        print(f"Calibrating on {min(len(paths), calibration_size)} image(s)…")
+        try:
+            quantize_static(
+                prepared,
+                INT8_PATH,
+                _Reader(),
+                quant_format=QuantFormat.QDQ,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                per_channel=True,
+            )
+        finally:
+            os.remove(prepared)
+    print(f"Wrote {INT8_PATH} ({os.path.getsize(INT8_PATH) / 1e6:.1f} MB).")
+    return 0
+
+
+def _latency_ms(session, sample, runs: int = 20) -> tuple[float, float]:
+    """(median, p95) single-image session.run latency in milliseconds."""
+    import numpy as np
+
+    for _ in range(3):  # warm-up: first runs initialise kernels / arenas
+        session.run(None, {"image": sample})
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        session.run(None, {"image": sample})
+        times.append((time.perf_counter() - start) * 1000.0)
+    return float(np.median(times)), float(np.percentile(times, 95))
+
+
+def compare(reference_dir: str | None, reference_size: int, max_drift: float) -> int:
+    """Print size / latency / probability-drift parity of INT8 against FP32.
+
+    Returns 1 if any pathology's probability moves by more than ``max_drift`` on
+    the reference set, so the check can gate a release.
+    """
+    import numpy as np
+    import onnxruntime as ort
+
+    def session(path):
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = 1  # match the deployed single-thread setting
+        return ort.InferenceSession(path, sess_options=opts, providers=["CPUExecutionProvider"])
+
+    fp32, int8 = session(OUT_PATH), session(INT8_PATH)
+    paths = _image_paths(reference_dir)
+    inputs = list(_model_inputs(paths, reference_size))
+    if not paths:
+        print("No --reference-dir images; drift measured on synthetic films (smoke test).")
+
+    def probs(sess):
+        out = np.concatenate([sess.run(None, {"image": x})[0] for x in inputs])
+        return 1.0 / (1.0 + np.exp(-out))
+
+    drift = np.abs(probs(fp32) - probs(int8)).max(axis=0)
+    fp32_ms, fp32_p95 = _latency_ms(fp32, inputs[0])
+    int8_ms, int8_p95 = _latency_ms(int8, inputs[0])
+
+    print(f"\n{'':<28}{'FP32':>12}{'INT8':>12}")
+    print(f"{'size (MB)':<28}{os.path.getsize(OUT_PATH) / 1e6:>12.1f}"
+          f"{os.path.getsize(INT8_PATH) / 1e6:>12.1f}")
+    print(f"{'latency p50 (ms, 1 thread)':<28}{fp32_ms:>12.1f}{int8_ms:>12.1f}")
+    print(f"{'latency p95 (ms, 1 thread)':<28}{fp32_p95:>12.1f}{int8_p95:>12.1f}")
+    print(f"\nMax probability drift over {len(inputs)} reference image(s):")
+    for name, d in sorted(zip(EXPECTED_PATHOLOGIES, drift), key=lambda kv: -kv[1]):
+        print(f"  {name:<28}{d:.4f}")
+
+    worst = float(drift.max())
+    if worst > max_drift:
+        print(f"WARNING: max drift {worst:.4f} exceeds --max-drift {max_drift}.", file=sys.stderr)
+        return 1
+    print(f"Parity OK (max drift {worst:.4f} ≤ {max_drift}).")
+    return 0
+
+
+# ── Fused uint8 → probabilities graph ─────────────────────────────────────────
+
+
+def fuse(source: str | None = None, target: str | None = None) -> int:
+    """Write ``target`` (default FUSED_PATH): the ``source`` graph (default
+    OUT_PATH) with the xrv normalisation prepended and a Sigmoid appended."""
+    import numpy as np
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+
+    from local_backend import _META_INPUT, _META_OUTPUT
+
+    source, target = source or OUT_PATH, target or FUSED_PATH
+    model = onnx.load(source)
+    graph = model.graph
+    image, logits = graph.input[0], graph.output[0]
+
+    # The old input becomes an internal tensor fed by the normalisation nodes;
+    # the old output keeps flowing out as "logits" beside the new probabilities.
+    normalised = "image_normalised"
+    for node in graph.node:
+        node.input[:] = [normalised if name == image.name else name for name in node.input]
+        node.output[:] = ["logits" if name == logits.name else name for name in node.output]
+    logits.name = "logits"
+
+    pixels = onnx.ValueInfoProto()
+    pixels.CopyFrom(image)
+    pixels.name = "image"
+    pixels.type.tensor_type.elem_type = TensorProto.UINT8
+    probabilities = onnx.ValueInfoProto()
+    probabilities.CopyFrom(logits)
+    probabilities.name = "probabilities"
+
+    graph.initializer.extend([
+        numpy_helper.from_array(np.array(2.0 * 1024.0 / 255.0, np.float32), "pixel_scale"),
+        numpy_helper.from_array(np.array(1024.0, np.float32), "pixel_offset"),
+    ])
+    graph.node.insert(0, helper.make_node("Sub", ["image_scaled", "pixel_offset"], [normalised]))
+    graph.node.insert(0, helper.make_node("Mul", ["image_float", "pixel_scale"], ["image_scaled"]))
+    graph.node.insert(0, helper.make_node("Cast", ["image"], ["image_float"], to=TensorProto.FLOAT))
+    graph.node.append(helper.make_node("Sigmoid", ["logits"], ["probabilities"]))
+
+    del graph.input[0]
+    graph.input.insert(0, pixels)
+    graph.output.insert(0, probabilities)
+    helper.set_model_props(model, {_META_INPUT: "uint8", _META_OUTPUT: "probabilities"})
+    onnx.checker.check_model(model)
+    onnx.save(model, target)
+    print(f"Wrote {target} ({os.path.getsize(target) / 1e6:.1f} MB).")
+    return 0
+
+
+def compare_fused(
+    reference_dir: str | None,
+    reference_size: int,
+    source: str | None = None,
+    target: str | None = None,
+    tolerance: float = 1e-4,
+) -> int:
+    """Check the fused graph reproduces sigmoid(FP32 logits) on the reference set."""
+    import numpy as np
+    import onnxruntime as ort
+
+    from local_backend import _normalise
+
+    def session(path):
+        return ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+
+    plain, fused = session(source or OUT_PATH), session(target or FUSED_PATH)
+    views = np.stack(list(_model_views(_image_paths(reference_dir), reference_size)))[:, None]
+    logits = plain.run(None, {plain.get_inputs()[0].name: _normalise(views)})[0]
+    probs = fused.run(None, {"image": views})[0]
+    diff = float(np.abs(1.0 / (1.0 + np.exp(-logits)) - probs).max())
+    if diff > tolerance:
+        print(f"WARNING: fused graph drifts from FP32 by {diff:.2e}.", file=sys.stderr)
+        return 1
+    print(f"Fused parity OK over {len(views)} image(s) (max diff {diff:.2e}).")
+    return 0
+
+
+def _parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--quantize", choices=["dynamic", "static"],
+        help="also write models/chexnet.int8.onnx and report parity against FP32",
+    )
+    parser.add_argument(
+        "--fuse", action="store_true",
+        help="also write models/chexnet.fused.onnx (uint8 pixels in, probabilities out)",
+    )
+    parser.add_argument(
+        "--skip-export", action="store_true",
+        help="reuse the existing FP32 model (no PyTorch needed)",
+    )
+    parser.add_argument("--calibration-dir", help="JPG/PNG films for static calibration")
+    parser.add_argument("--calibration-size", type=int, default=200)
+    parser.add_argument(
+        "--reference-dir",
+        help="JPG/PNG films for the drift check (defaults to --calibration-dir)",
+    )
+    parser.add_argument("--reference-size", type=int, default=100)
+    parser.add_argument(
+        "--max-drift", type=float, default=0.05,
+        help="fail if any pathology's probability moves by more than this",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv)
+
+    if args.skip_export:
+        if not os.path.exists(OUT_PATH):
+            print(f"ERROR: --skip-export but {OUT_PATH} does not exist.", file=sys.stderr)
+            return 1
+    else:
+        rc = export_fp32()
+        if rc:
+            return rc
+
+    if args.quantize:
+        rc = quantize(args.quantize, args.calibration_dir, args.calibration_size)
+        if rc:
+            return rc
+        rc = compare(
+            args.reference_dir or args.calibration_dir, args.reference_size, args.max_drift
+        )
+        if rc:
+            return rc
+
+    if args.fuse:
+        rc = fuse() or compare_fused(
+            args.reference_dir or args.calibration_dir, args.reference_size
+        )
+        if rc:
+            return rc
 
     print("Done. Production needs only: pip install onnxruntime numpy pillow")
     return 0